@@ -6,6 +6,7 @@ import type {
   UserProfileResponse, 
   PaymentsResponse, 
   GiftsResponse,
+  BootstrapResponse,
   ActivateGiftResponse,
   CreatePaymentResponse,
   PaymentStatusResponse
@@ -53,6 +54,23 @@ async function apiRequest<T>(endpoint: string, options?: RequestInit): Promise<T
 
 // API методы
 
+// Хуки, смонтированные сразу после открытия Mini App, берут данные из одного
+// запроса /bootstrap; позже (и при refetch) — из отдельных эндпоинтов
+const BOOTSTRAP_REUSE_MS = 15000;
+let bootstrap: { promise: Promise<BootstrapResponse>; startedAt: number } | null = null;
+
+/**
+ * Общий ответ /bootstrap или null, если окно открытия Mini App уже прошло
+ */
+export function takeBootstrap(): Promise<BootstrapResponse> | null {
+  if (!bootstrap) {
+    bootstrap = { promise: apiRequest<BootstrapResponse>('/bootstrap'), startedAt: Date.now() };
+  } else if (Date.now() - bootstrap.startedAt > BOOTSTRAP_REUSE_MS) {
+    return null;
+  }
+  return bootstrap.promise;
+}
+
 /**
  * Получить профиль пользователя
  */
@@ -108,8 +126,10 @@ export async function createPayment(
 }
 
 /**
- * Проверить статус платежа
+ * Проверить статус платежа.
+ * С wait (секунды) сервер держит запрос, пока статус не изменится (long-poll)
  */
-export async function checkPaymentStatus(paymentId: string): Promise<PaymentStatusResponse> {
-  return apiRequest<PaymentStatusResponse>(`/payments/${paymentId}/status`);
+export async function checkPaymentStatus(paymentId: string, wait: number = 0): Promise<PaymentStatusResponse> {
+  const query = wait > 0 ? `?wait=${wait}` : '';
+  return apiRequest<PaymentStatusResponse>(`/payments/${paymentId}/status${query}`);
 }
@@ -74,6 +74,15 @@ export interface GiftsResponse {
   receivedGifts: ReceivedGift[];
 }
 
+// Профиль, платежи и подарки одним запросом
+export interface BootstrapResponse {
+  success: boolean;
+  user: User;
+  payments: Payment[];
+  purchasedGifts: GiftCode[];
+  receivedGifts: ReceivedGift[];
+}
+
 export interface ActivateGiftResponse {
   success: boolean;
   error?: string;
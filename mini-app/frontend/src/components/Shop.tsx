@@ -14,6 +14,10 @@ import { createPayment, checkPaymentStatus } from '../api/client';
 
 type PaymentMethod = 'stars' | 'sbp' | 'card';
 
+// Long-poll статуса платежа: до 4 запросов по 25 секунд
+const PAYMENT_WAIT_SECONDS = 25;
+const PAYMENT_WAIT_ATTEMPTS = 4;
+
 const paymentMethods: { id: PaymentMethod; name: string; icon: React.ReactNode; description: string }[] = [
   { id: 'stars', name: 'Telegram Stars', icon: <Star className="w-5 h-5" />, description: 'Быстрая оплата' },
   { id: 'sbp', name: 'СБП', icon: <Smartphone className="w-5 h-5" />, description: 'Без комиссии' },
@@ -32,14 +36,20 @@ export function Shop() {
   const discount = LOYALTY_DISCOUNTS[loyaltyLevel];
   const levelColor = LOYALTY_COLORS[loyaltyLevel];
 
-  // Проверяем статус платежа при возврате в Mini App
+  // Ждём итог платежа при возврате в Mini App (сервер отвечает, когда статус изменится)
   useEffect(() => {
+    let cancelled = false;
+
     const checkPendingPayment = async () => {
       const pendingPaymentId = sessionStorage.getItem('pending_payment_id');
       if (!pendingPaymentId) return;
 
       try {
-        const result = await checkPaymentStatus(pendingPaymentId);
+        let result = await checkPaymentStatus(pendingPaymentId);
+        for (let attempt = 0; result.status === 'pending' && attempt < PAYMENT_WAIT_ATTEMPTS && !cancelled; attempt++) {
+          result = await checkPaymentStatus(pendingPaymentId, PAYMENT_WAIT_SECONDS);
+        }
+        if (cancelled) return;
         if (result.status === 'completed') {
           sessionStorage.removeItem('pending_payment_id');
           haptic('success');
@@ -62,6 +72,9 @@ export function Shop() {
     };
 
     checkPendingPayment();
+    return () => {
+      cancelled = true;
+    };
   }, [refetch]);
 
   const handlePurchase = async () => {
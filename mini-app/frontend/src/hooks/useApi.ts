@@ -1,6 +1,22 @@
 import { useState, useEffect, useCallback } from 'react';
-import { getUserProfile, getUserPayments, getUserGifts } from '../api/client';
-import type { User, Payment, GiftCode, ReceivedGift } from '../api/types';
+import { getUserProfile, getUserPayments, getUserGifts, takeBootstrap } from '../api/client';
+import type { User, Payment, GiftCode, ReceivedGift, BootstrapResponse } from '../api/types';
+
+// Первая загрузка: данные из общего /bootstrap, если он ещё актуален
+async function loadInitial<T>(pick: (b: BootstrapResponse) => T, fallback: () => Promise<T>): Promise<T> {
+  const bootstrap = takeBootstrap();
+  if (bootstrap) {
+    try {
+      const response = await bootstrap;
+      if (response.success) {
+        return pick(response);
+      }
+    } catch {
+      // Отдельный запрос ниже покажет ошибку, если она повторится
+    }
+  }
+  return fallback();
+}
 
 // Хук для загрузки профиля пользователя
 export function useUserProfile() {
@@ -8,11 +24,11 @@ export function useUserProfile() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
-  const refetch = useCallback(async () => {
+  const load = useCallback(async (initial: boolean) => {
     setLoading(true);
     setError(null);
     try {
-      const profile = await getUserProfile();
+      const profile = initial ? await loadInitial((b) => b.user, getUserProfile) : await getUserProfile();
       setData(profile);
     } catch (e) {
       setError(e instanceof Error ? e.message : 'Ошибка загрузки');
@@ -21,9 +37,11 @@ export function useUserProfile() {
     }
   }, []);
 
+  const refetch = useCallback(() => load(false), [load]);
+
   useEffect(() => {
-    refetch();
-  }, [refetch]);
+    load(true);
+  }, [load]);
 
   return { data, loading, error, refetch };
 }
@@ -34,11 +52,11 @@ export function usePayments() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
-  const refetch = useCallback(async () => {
+  const load = useCallback(async (initial: boolean) => {
     setLoading(true);
     setError(null);
     try {
-      const result = await getUserPayments();
+      const result = initial ? await loadInitial((b) => ({ payments: b.payments }), getUserPayments) : await getUserPayments();
       setData(result.payments || []);
     } catch (e) {
       setError(e instanceof Error ? e.message : 'Ошибка загрузки');
@@ -47,9 +65,11 @@ export function usePayments() {
     }
   }, []);
 
+  const refetch = useCallback(() => load(false), [load]);
+
   useEffect(() => {
-    refetch();
-  }, [refetch]);
+    load(true);
+  }, [load]);
 
   return { data, loading, error, refetch };
 }
@@ -61,11 +81,13 @@ export function useGifts() {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
-  const refetch = useCallback(async () => {
+  const load = useCallback(async (initial: boolean) => {
     setLoading(true);
     setError(null);
     try {
-      const result = await getUserGifts();
+      const result = initial
+        ? await loadInitial((b) => ({ purchasedGifts: b.purchasedGifts, receivedGifts: b.receivedGifts }), getUserGifts)
+        : await getUserGifts();
       setPurchased(result.purchasedGifts || []);
       setReceived(result.receivedGifts || []);
     } catch (e) {
@@ -75,9 +97,11 @@ export function useGifts() {
     }
   }, []);
 
+  const refetch = useCallback(() => load(false), [load]);
+
   useEffect(() => {
-    refetch();
-  }, [refetch]);
+    load(true);
+  }, [load]);
 
   return { purchased, received, loading, error, refetch };
 }
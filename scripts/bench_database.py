@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark write throughput of the bot database (data/bot_data.db layer).
+
+Compares two storage profiles on a temporary database:
+  * legacy  — rollback journal, default PRAGMAs, new connection per call,
+              writes executed one by one (how the bot worked before);
+  * current — profile from DB_* env vars (WAL, synchronous=NORMAL, mmap,
+              cache, connection pool and the batching writer thread),
+              writes issued concurrently through the async model API.
+
+The workload mirrors a payment burst: Payment.update_status + Loyalty.add_points.
+
+Usage:
+    python3 scripts/bench_database.py [writes] [concurrency]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src import database  # noqa: E402
+from src.database import (  # noqa: E402
+    LEGACY_STORAGE_PROFILE,
+    Loyalty,
+    Payment,
+    StorageProfile,
+    configure_storage,
+    init_database,
+)
+
+USERS = 200
+
+
+def prepare(db_path: Path, profile: StorageProfile, writes: int) -> list[int]:
+    """Creates schema, users and pending payments for the benchmark."""
+    configure_storage(profile, db_path)
+    init_database()
+    with database.get_db_connection() as conn:
+        conn.executemany(
+            "INSERT INTO bot_users (telegram_id, username) VALUES (?, ?)",
+            [(user_id, f"user{user_id}") for user_id in range(USERS)],
+        )
+        conn.executemany(
+            "INSERT INTO payments (user_id, stars, invoice_payload, subscription_days) VALUES (?, ?, ?, ?)",
+            [(i % USERS, 100, f"{i % USERS}:1:100", 30) for i in range(writes)],
+        )
+        return [row["id"] for row in conn.execute("SELECT id FROM payments").fetchall()]
+
+
+def run_legacy(payment_ids: list[int]) -> float:
+    started = time.perf_counter()
+    for payment_id in payment_ids:
+        Payment.update_status(payment_id, "completed")
+        Loyalty.add_points(payment_id % USERS, 10)
+    return time.perf_counter() - started
+
+
+async def run_current(payment_ids: list[int], concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(payment_id: int) -> None:
+        async with semaphore:
+            await Payment.aio.update_status(payment_id, "completed")
+            await Loyalty.aio.add_points(payment_id % USERS, 10)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(payment_id) for payment_id in payment_ids))
+    return time.perf_counter() - started
+
+
+def report(name: str, writes: int, elapsed: float) -> float:
+    rate = writes / elapsed if elapsed else float("inf")
+    print(f"{name:<8} {writes:>7} writes in {elapsed:7.3f}s  ->  {rate:10.1f} writes/sec")
+    return rate
+
+
+def main() -> None:
+    payments = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    writes = payments * 2
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ids = prepare(Path(tmp) / "legacy.db", LEGACY_STORAGE_PROFILE, payments)
+        before = report("legacy", writes, run_legacy(ids))
+
+        profile = StorageProfile.from_env()
+        ids = prepare(Path(tmp) / "current.db", profile, payments)
+        after = report("current", writes, asyncio.run(run_current(ids, concurrency)))
+        asyncio.run(database.close_database())
+
+    print(f"speedup: x{after / before:.1f} (journal={profile.journal_mode}, "
+          f"synchronous={profile.synchronous}, batch={profile.write_batch_size})")
+
+
+if __name__ == "__main__":
+    main()
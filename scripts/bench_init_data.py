@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark Mini App initData validation (src/webapp/auth.py).
+
+Measures the per-request authentication cost for three paths:
+  * legacy  — secret key derived and initData parsed on every call
+              (how require_auth worked before);
+  * miss    — InitDataValidator with the cached secret key, cache disabled;
+  * hit     — InitDataValidator answering from the validated-initData LRU
+              (repeated API calls of an open Mini App, payment polling).
+
+Usage:
+    python3 scripts/bench_init_data.py [requests] [distinct users]
+"""
+
+import hashlib
+import hmac
+import json
+import sys
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.webapp.auth import InitDataValidator  # noqa: E402
+
+BOT_TOKEN = "123456:bench-token"
+
+
+def make_init_data(user_id: int) -> str:
+    """Builds initData signed the way Telegram signs it."""
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"AAH{user_id:012d}",
+        "user": json.dumps({
+            "id": user_id,
+            "first_name": "Bench",
+            "last_name": "User",
+            "username": f"bench{user_id}",
+            "language_code": "ru",
+            "allows_write_to_pm": True,
+        }, separators=(",", ":")),
+    }
+    secret_key = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    fields["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return "&".join(f"{k}={quote(v)}" for k, v in fields.items())
+
+
+def run(validate, samples: list[str], requests: int) -> float:
+    started = time.perf_counter()
+    for i in range(requests):
+        if validate(samples[i % len(samples)]) is None:
+            raise SystemExit("validation failed")
+    return time.perf_counter() - started
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    samples = [make_init_data(user_id) for user_id in range(1, users + 1)]
+
+    results = {
+        "legacy": run(lambda data: InitDataValidator(BOT_TOKEN, cache_size=0).validate(data), samples, requests),
+        "miss": run(InitDataValidator(BOT_TOKEN, cache_size=0).validate, samples, requests),
+        "hit": run(InitDataValidator(BOT_TOKEN, cache_size=users).validate, samples, requests),
+    }
+
+    print(f"{requests} validations over {users} distinct initData strings")
+    for name, elapsed in results.items():
+        print(f"  {name:<7} {elapsed / requests * 1e6:8.2f} us/request  {requests / elapsed:12,.0f} req/s")
+    print(f"  speedup hit vs legacy: {results['legacy'] / results['hit']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
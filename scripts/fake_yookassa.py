@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Local fake of the YooKassa API v3 for testing payments without real money.
+
+Implements the subset the bot uses:
+  POST /v3/payments                 — create payment (honours Idempotence-Key)
+  GET  /v3/payments/{id}            — get payment
+and control endpoints for tests:
+  POST /v3/payments/{id}/succeed    — mark payment as paid (succeeded)
+  POST /v3/payments/{id}/cancel     — mark payment as canceled
+
+Point the bot at it:
+    YOOKASSA_API_URL=http://127.0.0.1:8765/v3
+    YOOKASSA_SHOP_ID=test YOOKASSA_SECRET_KEY=test
+
+Usage:
+    python3 scripts/fake_yookassa.py [--port 8765] [--latency 0.2] [--fail-rate 0.1] [--auto-succeed]
+"""
+
+import argparse
+import asyncio
+import random
+import uuid
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class FakeYooKassa:
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0, auto_succeed: bool = False) -> None:
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.auto_succeed = auto_succeed
+        self.payments: dict[str, dict] = {}
+        self.idempotence: dict[str, str] = {}
+
+    async def _simulate_network(self) -> None:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise web.HTTPServiceUnavailable(text='{"type": "error", "code": "internal_server_error"}')
+
+    def _build_payment(self, params: dict) -> dict:
+        payment_id = str(uuid.uuid4())
+        confirmation = dict(params.get("confirmation") or {})
+        if confirmation.get("type") == "qr":
+            confirmation["confirmation_data"] = f"https://qr.nspk.ru/{payment_id.replace('-', '').upper()}"
+        else:
+            confirmation["type"] = "redirect"
+            confirmation["confirmation_url"] = f"https://yoomoney.ru/checkout/payments/v2/contract?orderId={payment_id}"
+        return {
+            "id": payment_id,
+            "status": "pending",
+            "paid": False,
+            "amount": params["amount"],
+            "confirmation": confirmation,
+            "created_at": now_iso(),
+            "description": params.get("description"),
+            "metadata": params.get("metadata") or {},
+            "recipient": {"account_id": "test", "gateway_id": "test"},
+            "refundable": False,
+            "test": True,
+        }
+
+    async def create_payment(self, request: web.Request) -> web.Response:
+        await self._simulate_network()
+        key = request.headers.get("Idempotence-Key")
+        if not key:
+            return web.json_response(
+                {"type": "error", "code": "invalid_request", "description": "Idempotence-Key header is required"},
+                status=400,
+            )
+        if key in self.idempotence:
+            return web.json_response(self.payments[self.idempotence[key]])
+
+        params = await request.json()
+        if not params.get("amount", {}).get("value"):
+            return web.json_response(
+                {"type": "error", "code": "invalid_request", "parameter": "amount"}, status=400
+            )
+        payment = self._build_payment(params)
+        if self.auto_succeed:
+            self._set_status(payment, "succeeded")
+        self.payments[payment["id"]] = payment
+        self.idempotence[key] = payment["id"]
+        return web.json_response(payment)
+
+    async def get_payment(self, request: web.Request) -> web.Response:
+        await self._simulate_network()
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        return web.json_response(payment)
+
+    @staticmethod
+    def _set_status(payment: dict, status: str) -> None:
+        payment["status"] = status
+        payment["paid"] = status == "succeeded"
+        if status == "succeeded":
+            payment["captured_at"] = now_iso()
+
+    async def change_status(self, request: web.Request) -> web.Response:
+        payment = self.payments.get(request.match_info["payment_id"])
+        if not payment:
+            return web.json_response({"type": "error", "code": "not_found"}, status=404)
+        action = request.match_info["action"]
+        self._set_status(payment, "succeeded" if action == "succeed" else "canceled")
+        return web.json_response(payment)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v3/payments", self.create_payment)
+        app.router.add_get("/v3/payments/{payment_id}", self.get_payment)
+        app.router.add_post("/v3/payments/{payment_id}/{action:succeed|cancel}", self.change_status)
+        return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="artificial response delay, seconds")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--auto-succeed", action="store_true", help="create payments already succeeded")
+    args = parser.parse_args()
+
+    fake = FakeYooKassa(latency=args.latency, fail_rate=args.fail_rate, auto_succeed=args.auto_succeed)
+    print(f"Fake YooKassa on http://{args.host}:{args.port}/v3")
+    web.run_app(fake.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
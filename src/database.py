@@ -1,11 +1,22 @@
 """База данных для пользователей бота и рефералов."""
+import asyncio
+import functools
+import json
+import os
+import queue
 import secrets
 import sqlite3
 import string
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Optional
+
+from src.utils.metrics import DB_DURATION
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 # Используем директорию data для хранения БД (монтируется через volume в Docker)
@@ -14,16 +25,265 @@ DATA_DIR.mkdir(exist_ok=True)  # Создаем директорию, если 
 DB_PATH = DATA_DIR / "bot_data.db"
 
 
+@dataclass(frozen=True)
+class StorageProfile:
+    """Настройки хранилища SQLite (режим журнала, PRAGMA, пул и очередь записи)."""
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    mmap_size: int = 128 * 1024 * 1024  # байт
+    cache_size: int = -16000  # отрицательное значение — размер в KiB (~16 МБ)
+    busy_timeout_ms: int = 5000
+    pool_size: int = 4
+    statement_cache_size: int = 256
+    write_queue: bool = True
+    write_batch_size: int = 64
+
+    @classmethod
+    def from_env(cls) -> "StorageProfile":
+        """Собирает профиль из переменных окружения DB_*."""
+        default = cls()
+        return cls(
+            journal_mode=os.getenv("DB_JOURNAL_MODE", default.journal_mode).upper(),
+            synchronous=os.getenv("DB_SYNCHRONOUS", default.synchronous).upper(),
+            mmap_size=int(os.getenv("DB_MMAP_SIZE", str(default.mmap_size))),
+            cache_size=int(os.getenv("DB_CACHE_SIZE", str(default.cache_size))),
+            busy_timeout_ms=int(os.getenv("DB_BUSY_TIMEOUT_MS", str(default.busy_timeout_ms))),
+            pool_size=max(1, int(os.getenv("DB_POOL_SIZE", str(default.pool_size)))),
+            write_queue=os.getenv("DB_WRITE_QUEUE", "true").lower() == "true",
+            write_batch_size=max(1, int(os.getenv("DB_WRITE_BATCH_SIZE", str(default.write_batch_size)))),
+        )
+
+
+# Профиль «как было»: rollback-журнал, PRAGMA по умолчанию, соединение на каждый запрос.
+# Используется для сравнения в scripts/bench_database.py.
+LEGACY_STORAGE_PROFILE = StorageProfile(
+    journal_mode="DELETE",
+    synchronous="FULL",
+    mmap_size=0,
+    cache_size=-2000,
+    busy_timeout_ms=5000,
+    pool_size=0,
+    write_queue=False,
+)
+
+
 def dict_factory(cursor, row):
     """Преобразует результаты запроса в dict."""
     return {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
 
 
+def _connect(path: Path, profile: StorageProfile) -> sqlite3.Connection:
+    """Открывает соединение и применяет PRAGMA профиля."""
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        timeout=profile.busy_timeout_ms / 1000,
+        cached_statements=profile.statement_cache_size,
+    )
+    conn.row_factory = dict_factory
+    conn.execute(f"PRAGMA synchronous = {profile.synchronous}")
+    conn.execute(f"PRAGMA cache_size = {profile.cache_size}")
+    conn.execute(f"PRAGMA mmap_size = {profile.mmap_size}")
+    conn.execute(f"PRAGMA busy_timeout = {profile.busy_timeout_ms}")
+    return conn
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite.
+
+    Соединения не закрываются после каждого запроса, поэтому sqlite3 переиспользует
+    подготовленные выражения из своего кеша. Если все соединения заняты
+    (например, вложенный get_db_connection), открывается временное соединение —
+    пул никогда не блокирует вызывающего.
+    """
+
+    def __init__(self, path: Path, profile: StorageProfile) -> None:
+        self.path = path
+        self.profile = profile
+        self.size = profile.pool_size
+        self._idle: queue.LifoQueue[sqlite3.Connection] = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        """Берёт свободное соединение из пула или открывает новое."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return _connect(self.path, self.profile)
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Возвращает соединение в пул (лишние соединения закрываются)."""
+        with self._lock:
+            if not self._closed and self._idle.qsize() < self.size:
+                self._idle.put_nowait(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Закрывает все простаивающие соединения."""
+        with self._lock:
+            self._closed = True
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+
+class DatabaseWriter:
+    """Единственный поток записи в БД.
+
+    Все операции записи ставятся в очередь и выполняются одним соединением,
+    поэтому писатели не конкурируют за блокировку файла. Накопившиеся в очереди
+    операции объединяются в одну транзакцию (каждая — в своём SAVEPOINT, так что
+    ошибка одной не откатывает остальные); результат отдаётся после COMMIT.
+    Чтение идёт параллельно через пул — в режиме WAL оно не ждёт писателя.
+    """
+
+    def __init__(self, path: Path, profile: StorageProfile) -> None:
+        self.path = path
+        self.profile = profile
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def in_writer_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, func: Callable[..., Any], args: tuple, kwargs: dict) -> Future:
+        """Ставит операцию записи в очередь и возвращает Future с её результатом."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((func, args, kwargs, future))
+        return future
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        conn = _connect(self.path, self.profile)
+        # Транзакциями управляем сами (BEGIN/SAVEPOINT/COMMIT)
+        conn.isolation_level = None
+        _local.writer_conn = conn
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                stop = False
+                while len(batch) < self.profile.write_batch_size:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._execute_batch(conn, batch)
+                if stop:
+                    break
+        finally:
+            _local.writer_conn = None
+            conn.close()
+
+    @staticmethod
+    def _execute_batch(conn: sqlite3.Connection, batch: list) -> None:
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, args, kwargs, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT batch_item")
+                try:
+                    results.append((future, func(*args, **kwargs), None))
+                    conn.execute("RELEASE batch_item")
+                except Exception as exc:
+                    conn.execute("ROLLBACK TO batch_item")
+                    conn.execute("RELEASE batch_item")
+                    results.append((future, None, exc))
+            conn.execute("COMMIT")
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for future, result, exc in results:
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+
+    def stop(self) -> None:
+        """Дожидается выполнения очереди и останавливает поток записи."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+
+# Соединение потока записи (внутри него get_db_connection работает в общей транзакции)
+_local = threading.local()
+_profile = StorageProfile.from_env()
+_pool = ConnectionPool(DB_PATH, _profile)
+_writer = DatabaseWriter(DB_PATH, _profile)
+# Выделенные потоки для запросов из корутин: event loop не ждёт SQLite
+_db_executor = ThreadPoolExecutor(max_workers=max(1, _profile.pool_size), thread_name_prefix="sqlite")
+
+
+def configure_storage(profile: StorageProfile, path: Path | None = None) -> None:
+    """Переключает хранилище на другой профиль (и, опционально, файл БД).
+
+    Вызывается до начала работы с БД (или из тестов/бенчмарков): текущие
+    соединения закрываются, поток записи останавливается.
+    """
+    global DB_PATH, _profile, _pool, _writer, _db_executor
+    _writer.stop()
+    _pool.close()
+    _db_executor.shutdown(wait=True)
+    if path is not None:
+        DB_PATH = Path(path)
+    _profile = profile
+    _pool = ConnectionPool(DB_PATH, profile)
+    _writer = DatabaseWriter(DB_PATH, profile)
+    _db_executor = ThreadPoolExecutor(max_workers=max(1, profile.pool_size), thread_name_prefix="sqlite")
+
+
+def get_storage_profile() -> StorageProfile:
+    """Возвращает активный профиль хранилища."""
+    return _profile
+
+
+def get_write_queue_size() -> int:
+    """Количество операций записи, ожидающих выполнения."""
+    return _writer.queue_size
+
+
 @contextmanager
 def get_db_connection():
-    """Контекстный менеджер для работы с БД."""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = dict_factory
+    """Контекстный менеджер для работы с БД (соединение берётся из пула)."""
+    writer_conn = getattr(_local, "writer_conn", None)
+    if writer_conn is not None:
+        # Внутри потока записи: фиксацией управляет DatabaseWriter
+        yield writer_conn
+        return
+    conn = _pool.acquire()
     try:
         yield conn
         conn.commit()
@@ -31,136 +291,420 @@ def get_db_connection():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        _pool.release(conn)
 
 
-def init_database():
-    """Инициализирует базу данных."""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Таблица пользователей бота
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS bot_users (
-                telegram_id INTEGER PRIMARY KEY,
-                username TEXT,
-                language TEXT DEFAULT 'ru',
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                trial_used BOOLEAN DEFAULT 0,
-                referrer_id INTEGER,
-                remnawave_user_uuid TEXT,
-                auto_renewal BOOLEAN DEFAULT 0,
-                last_renewal_notification TIMESTAMP,
-                FOREIGN KEY (referrer_id) REFERENCES bot_users(telegram_id)
-            )
-        """)
-        
-        # Миграция: добавляем поля автопродления, если их нет
-        try:
-            cursor.execute("ALTER TABLE bot_users ADD COLUMN auto_renewal BOOLEAN DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
-        try:
-            cursor.execute("ALTER TABLE bot_users ADD COLUMN last_renewal_notification TIMESTAMP")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
-        # Миграция: добавляем поля системы лояльности
-        try:
-            cursor.execute("ALTER TABLE bot_users ADD COLUMN loyalty_points INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cursor.execute("ALTER TABLE bot_users ADD COLUMN loyalty_status TEXT DEFAULT 'bronze'")
-        except sqlite3.OperationalError:
-            pass
-        
-        try:
-            cursor.execute("ALTER TABLE bot_users ADD COLUMN total_spent INTEGER DEFAULT 0")
-        except sqlite3.OperationalError:
-            pass
-        
-        # Таблица рефералов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS referrals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                referrer_id INTEGER,
-                referred_id INTEGER,
-                bonus_days INTEGER DEFAULT 0,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (referrer_id) REFERENCES bot_users(telegram_id),
-                FOREIGN KEY (referred_id) REFERENCES bot_users(telegram_id),
-                UNIQUE(referrer_id, referred_id)
-            )
-        """)
-        
-        # Таблица платежей (Telegram Stars и YooKassa)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                stars INTEGER,
-                amount_rub INTEGER,
-                status TEXT DEFAULT 'pending',
-                remnawave_user_uuid TEXT,
-                invoice_payload TEXT,
-                subscription_days INTEGER,
-                payment_method TEXT DEFAULT 'stars',
-                yookassa_payment_id TEXT,
-                yookassa_payment_url TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                completed_at TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES bot_users(telegram_id)
+def db_write(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Помечает метод модели как операцию записи.
+
+    При включённой очереди записи (DB_WRITE_QUEUE) вызов выполняется в потоке
+    DatabaseWriter, а синхронный вызывающий ждёт результата. Без очереди метод
+    выполняется как раньше — на соединении из пула.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profile.write_queue or _writer.in_writer_thread():
+            return func(*args, **kwargs)
+        return _writer.submit(func, args, kwargs).result()
+
+    wrapper.db_write = True
+    return wrapper
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет синхронную функцию работы с БД в пуле потоков SQLite."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_db_write(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполняет функцию записи в потоке DatabaseWriter (или в пуле, если очередь выключена)."""
+    if not _profile.write_queue:
+        return await run_db(func, *args, **kwargs)
+    return await asyncio.wrap_future(_writer.submit(func, args, kwargs))
+
+
+def _shutdown_storage() -> None:
+    _writer.stop()
+    _db_executor.shutdown(wait=True)
+    _pool.close()
+
+
+async def close_database() -> None:
+    """
+    Дописывает очередь записи, останавливает пул потоков и закрывает соединения.
+    Ожидание потоков идёт в отдельном потоке, не блокируя event loop.
+    """
+    await asyncio.to_thread(_shutdown_storage)
+
+
+class AsyncModel:
+    """Awaitable-версии статических методов модели.
+
+    ``await BotUser.aio.get_or_create(user_id, username)`` выполняет тот же
+    ``BotUser.get_or_create`` в пуле потоков SQLite, не блокируя event loop.
+    Методы, помеченные ``@db_write``, уходят в очередь потока записи.
+    Атрибуты, не являющиеся функциями (THRESHOLDS и т.п.), возвращаются как есть.
+    """
+
+    def __init__(self, model: type) -> None:
+        self._model = model
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._model, name)
+        if not callable(attr):
+            return attr
+
+        operation = f"{self._model.__name__}.{name}"
+        if getattr(attr, "db_write", False):
+            target = attr.__wrapped__
+
+            @functools.wraps(attr)
+            async def call(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await run_db_write(target, *args, **kwargs)
+                finally:
+                    DB_DURATION.observe(time.perf_counter() - started, operation=operation, kind="write")
+        else:
+            @functools.wraps(attr)
+            async def call(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await run_db(attr, *args, **kwargs)
+                finally:
+                    DB_DURATION.observe(time.perf_counter() - started, operation=operation, kind="read")
+
+        # Кешируем обёртку, чтобы не создавать её при каждом обращении
+        setattr(self, name, call)
+        return call
+
+
+def _add_column_if_missing(conn: sqlite3.Connection, table: str, column: str, definition: str) -> None:
+    """Добавляет колонку, если её ещё нет (для БД, созданных до версионирования схемы)."""
+    columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+    if column not in columns:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _migration_initial_schema(conn: sqlite3.Connection) -> None:
+    """Базовые таблицы: пользователи, рефералы, платежи, подарочные коды."""
+    # Таблица пользователей бота
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_users (
+            telegram_id INTEGER PRIMARY KEY,
+            username TEXT,
+            language TEXT DEFAULT 'ru',
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            trial_used BOOLEAN DEFAULT 0,
+            referrer_id INTEGER,
+            remnawave_user_uuid TEXT,
+            auto_renewal BOOLEAN DEFAULT 0,
+            last_renewal_notification TIMESTAMP,
+            FOREIGN KEY (referrer_id) REFERENCES bot_users(telegram_id)
+        )
+    """)
+    
+    # Таблица рефералов
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS referrals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            referrer_id INTEGER,
+            referred_id INTEGER,
+            bonus_days INTEGER DEFAULT 0,
+            registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (referrer_id) REFERENCES bot_users(telegram_id),
+            FOREIGN KEY (referred_id) REFERENCES bot_users(telegram_id),
+            UNIQUE(referrer_id, referred_id)
+        )
+    """)
+    
+    # Таблица платежей (Telegram Stars и YooKassa)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            stars INTEGER,
+            amount_rub INTEGER,
+            status TEXT DEFAULT 'pending',
+            remnawave_user_uuid TEXT,
+            invoice_payload TEXT,
+            subscription_days INTEGER,
+            payment_method TEXT DEFAULT 'stars',
+            yookassa_payment_id TEXT,
+            yookassa_payment_url TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES bot_users(telegram_id)
+        )
+    """)
+    
+    # Таблица подарочных кодов
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS gift_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT UNIQUE NOT NULL,
+            buyer_id INTEGER NOT NULL,
+            subscription_days INTEGER NOT NULL,
+            stars INTEGER DEFAULT 0,
+            amount_rub INTEGER DEFAULT 0,
+            payment_method TEXT DEFAULT 'stars',
+            status TEXT DEFAULT 'active',
+            recipient_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            activated_at TIMESTAMP,
+            remnawave_user_uuid TEXT,
+            FOREIGN KEY (buyer_id) REFERENCES bot_users(telegram_id),
+            FOREIGN KEY (recipient_id) REFERENCES bot_users(telegram_id)
+        )
+    """)
+    
+    # Индекс для быстрого поиска по коду
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gift_codes_code ON gift_codes(code)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gift_codes_buyer ON gift_codes(buyer_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_gift_codes_status ON gift_codes(status)")
+
+
+def _migration_auto_renewal(conn: sqlite3.Connection) -> None:
+    """Поля автопродления в bot_users."""
+    _add_column_if_missing(conn, "bot_users", "auto_renewal", "BOOLEAN DEFAULT 0")
+    _add_column_if_missing(conn, "bot_users", "last_renewal_notification", "TIMESTAMP")
+
+
+def _migration_loyalty(conn: sqlite3.Connection) -> None:
+    """Поля системы лояльности в bot_users."""
+    _add_column_if_missing(conn, "bot_users", "loyalty_points", "INTEGER DEFAULT 0")
+    _add_column_if_missing(conn, "bot_users", "loyalty_status", "TEXT DEFAULT 'bronze'")
+    _add_column_if_missing(conn, "bot_users", "total_spent", "INTEGER DEFAULT 0")
+
+
+def _migration_yookassa(conn: sqlite3.Connection) -> None:
+    """Поля YooKassa в payments."""
+    _add_column_if_missing(conn, "payments", "amount_rub", "INTEGER")
+    _add_column_if_missing(conn, "payments", "payment_method", "TEXT DEFAULT 'stars'")
+    _add_column_if_missing(conn, "payments", "yookassa_payment_id", "TEXT")
+    _add_column_if_missing(conn, "payments", "yookassa_payment_url", "TEXT")
+
+
+def _migration_payment_indexes(conn: sqlite3.Connection) -> None:
+    """Индексы для поиска платежей и рефералов без полного сканирования."""
+    # Payment.get_by_payload (pre_checkout, successful_payment)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_invoice_payload ON payments(invoice_payload)")
+    # Payment.get_by_yookassa_id (вебхук и проверка статуса)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_yookassa_id ON payments(yookassa_payment_id)")
+    # Покрывающий индекс для Payment.get_user_payments / get_user_stats:
+    # фильтр по (user_id, status), сортировка по created_at, остальные колонки берутся из индекса
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_payments_user_status_created
+        ON payments(user_id, status, created_at, stars, amount_rub, subscription_days, payment_method, completed_at)
+    """)
+    # Поиск реферера по приглашённому (referrer_id покрыт UNIQUE(referrer_id, referred_id))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referred ON referrals(referred_id)")
+
+
+def _migration_panel_users(conn: sqlite3.Connection) -> None:
+    """Локальная копия пользователей панели Remnawave для поиска из админки."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS panel_users (
+            uuid TEXT PRIMARY KEY,
+            username TEXT,
+            telegram_id INTEGER,
+            email TEXT,
+            description TEXT,
+            status TEXT,
+            expire_at TEXT,
+            updated_at TEXT,
+            data TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_panel_users_telegram_id ON panel_users(telegram_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_panel_users_username ON panel_users(username COLLATE NOCASE)")
+    # Полнотекстовый индекс по триграммам для поиска подстроки (SQLite >= 3.34).
+    # Если FTS5/trigram недоступны, поиск работает через LIKE по panel_users.
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS panel_users_fts USING fts5(
+                username, email, description, telegram_id,
+                content='panel_users', content_rowid='rowid', tokenize='trigram'
             )
         """)
-        
-        # Миграция: добавляем новые поля для YooKassa, если их нет
-        try:
-            cursor.execute("ALTER TABLE payments ADD COLUMN amount_rub INTEGER")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
-        try:
-            cursor.execute("ALTER TABLE payments ADD COLUMN payment_method TEXT DEFAULT 'stars'")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
-        try:
-            cursor.execute("ALTER TABLE payments ADD COLUMN yookassa_payment_id TEXT")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
+    except sqlite3.OperationalError:
+        return
+    # Каждый триггер — отдельным execute: executescript зафиксировал бы транзакцию миграции
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS panel_users_ai AFTER INSERT ON panel_users BEGIN
+            INSERT INTO panel_users_fts (rowid, username, email, description, telegram_id)
+            VALUES (new.rowid, new.username, new.email, new.description, new.telegram_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS panel_users_ad AFTER DELETE ON panel_users BEGIN
+            INSERT INTO panel_users_fts (panel_users_fts, rowid, username, email, description, telegram_id)
+            VALUES ('delete', old.rowid, old.username, old.email, old.description, old.telegram_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS panel_users_au AFTER UPDATE ON panel_users BEGIN
+            INSERT INTO panel_users_fts (panel_users_fts, rowid, username, email, description, telegram_id)
+            VALUES ('delete', old.rowid, old.username, old.email, old.description, old.telegram_id);
+            INSERT INTO panel_users_fts (rowid, username, email, description, telegram_id)
+            VALUES (new.rowid, new.username, new.email, new.description, new.telegram_id);
+        END
+    """)
+
+
+def _migration_broadcasts(conn: sqlite3.Connection) -> None:
+    """Рассылки и их получатели (переживают перезапуск бота)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            locale TEXT DEFAULT 'ru',
+            target_type TEXT NOT NULL,
+            message_text TEXT,
+            photo_id TEXT,
+            source_chat_id INTEGER,
+            source_message_id INTEGER,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            status TEXT DEFAULT 'running',
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            errors INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            error TEXT,
+            PRIMARY KEY (job_id, user_id),
+            FOREIGN KEY (job_id) REFERENCES broadcast_jobs(id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status ON broadcast_recipients(job_id, status)")
+
+
+def _migration_panel_users_status(conn: sqlite3.Connection) -> None:
+    """Индекс по статусу для массовых операций над пользователями панели."""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_panel_users_status ON panel_users(status)")
+
+
+def _migration_bot_state(conn: sqlite3.Connection) -> None:
+    """Состояние диалогов (ожидаемый ввод, FSM и т.п.), переживающее перезапуск."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_state (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_state_expires ON bot_state(expires_at)")
+
+
+
+def _migration_payments_reconcile(conn: sqlite3.Connection) -> None:
+    """Время последней проверки платежа в YooKassa и индекс ожидающих платежей по возрасту."""
+    _add_column_if_missing(conn, "payments", "checked_at", "TIMESTAMP")
+    # Payment.get_pending_yookassa: частичный индекс содержит только ожидающие платежи YooKassa
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_payments_pending_yookassa
+        ON payments(created_at)
+        WHERE status = 'pending' AND yookassa_payment_id IS NOT NULL
+    """)
+
+
+
+def _migration_notification_outbox(conn: sqlite3.Connection) -> None:
+    """Неотправленные критичные уведомления (оплаты), переживающие перезапуск."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            reply_markup TEXT,
+            kind TEXT,
+            summary TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+# Упорядоченный список миграций схемы: (версия, название, функция).
+# Новые миграции добавляются только в конец со следующим номером версии.
+MIGRATIONS: list[tuple[int, str, Callable[[sqlite3.Connection], None]]] = [
+    (1, "initial_schema", _migration_initial_schema),
+    (2, "bot_users_auto_renewal", _migration_auto_renewal),
+    (3, "bot_users_loyalty", _migration_loyalty),
+    (4, "payments_yookassa", _migration_yookassa),
+    (5, "payments_referrals_indexes", _migration_payment_indexes),
+    (6, "panel_users_index", _migration_panel_users),
+    (7, "broadcasts", _migration_broadcasts),
+    (8, "panel_users_status_index", _migration_panel_users_status),
+    (9, "bot_state", _migration_bot_state),
+    (10, "payments_reconcile", _migration_payments_reconcile),
+    (11, "notification_outbox", _migration_notification_outbox),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Возвращает номер последней применённой миграции (0 — схема не создана)."""
+    row = conn.execute("SELECT MAX(version) AS version FROM schema_version").fetchone()
+    return row["version"] or 0
+
+
+def run_migrations(conn: sqlite3.Connection) -> list[int]:
+    """Применяет ещё не применённые миграции по порядку.
+
+    Каждая миграция выполняется в своей транзакции вместе с записью в
+    schema_version, поэтому при ошибке она откатывается целиком, а при
+    следующем старте применённые миграции пропускаются.
+
+    Returns:
+        Список версий, применённых в этом вызове
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+    
+    current = get_schema_version(conn)
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN")
         try:
-            cursor.execute("ALTER TABLE payments ADD COLUMN yookassa_payment_url TEXT")
-        except sqlite3.OperationalError:
-            pass  # Колонка уже существует
-        
-        # Таблица подарочных кодов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS gift_codes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                code TEXT UNIQUE NOT NULL,
-                buyer_id INTEGER NOT NULL,
-                subscription_days INTEGER NOT NULL,
-                stars INTEGER DEFAULT 0,
-                amount_rub INTEGER DEFAULT 0,
-                payment_method TEXT DEFAULT 'stars',
-                status TEXT DEFAULT 'active',
-                recipient_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                activated_at TIMESTAMP,
-                remnawave_user_uuid TEXT,
-                FOREIGN KEY (buyer_id) REFERENCES bot_users(telegram_id),
-                FOREIGN KEY (recipient_id) REFERENCES bot_users(telegram_id)
+            migrate(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, name) VALUES (?, ?)",
+                (version, name)
             )
-        """)
-        
-        # Индекс для быстрого поиска по коду
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_gift_codes_code ON gift_codes(code)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_gift_codes_buyer ON gift_codes(buyer_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_gift_codes_status ON gift_codes(status)")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+def init_database():
+    """Инициализирует базу данных и применяет миграции схемы."""
+    with get_db_connection() as conn:
+        # Режим журнала сохраняется в файле БД, поэтому выставляется один раз при старте
+        conn.execute(f"PRAGMA journal_mode = {_profile.journal_mode}")
+        return run_migrations(conn)
 
 
 class BotUser:
@@ -176,13 +720,20 @@ class BotUser:
                 (telegram_id,)
             )
             user = cursor.fetchone()
-            
-            if user:
-                return dict(user)
-            
-            # Создаем нового пользователя
+        
+        if user:
+            return dict(user)
+        return BotUser.create_if_missing(telegram_id, username)
+    
+    @staticmethod
+    @db_write
+    def create_if_missing(telegram_id: int, username: Optional[str] = None) -> dict:
+        """Создает пользователя, если его ещё нет, и возвращает запись."""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            # OR IGNORE — на случай параллельного создания
             cursor.execute("""
-                INSERT INTO bot_users (telegram_id, username)
+                INSERT OR IGNORE INTO bot_users (telegram_id, username)
                 VALUES (?, ?)
             """, (telegram_id, username))
             
@@ -193,6 +744,7 @@ class BotUser:
             return dict(cursor.fetchone())
     
     @staticmethod
+    @db_write
     def update_language(telegram_id: int, language: str):
         """Обновляет язык пользователя."""
         with get_db_connection() as conn:
@@ -202,6 +754,7 @@ class BotUser:
             )
     
     @staticmethod
+    @db_write
     def set_trial_used(telegram_id: int):
         """Отмечает пробную подписку как использованную."""
         with get_db_connection() as conn:
@@ -211,6 +764,7 @@ class BotUser:
             )
     
     @staticmethod
+    @db_write
     def set_referrer(telegram_id: int, referrer_id: int):
         """Устанавливает реферера для пользователя."""
         with get_db_connection() as conn:
@@ -220,6 +774,7 @@ class BotUser:
             )
     
     @staticmethod
+    @db_write
     def set_remnawave_uuid(telegram_id: int, uuid: str):
         """Сохраняет UUID пользователя в Remnawave."""
         with get_db_connection() as conn:
@@ -229,6 +784,7 @@ class BotUser:
             )
     
     @staticmethod
+    @db_write
     def set_auto_renewal(telegram_id: int, enabled: bool):
         """Включает или выключает автопродление."""
         with get_db_connection() as conn:
@@ -248,8 +804,55 @@ class BotUser:
             )
             row = cursor.fetchone()
             return bool(row.get('auto_renewal')) if row and row.get('auto_renewal') is not None else False
+
+    @staticmethod
+    def get_mini_app_data(telegram_id: int, payments_limit: int = 20) -> Optional[dict]:
+        """
+        Данные пользователя для Mini App одним чтением (в одной транзакции).
+
+        Возвращает строку bot_users, завершённые платежи, купленные и
+        полученные подарки и shortUuid из индекса пользователей панели.
+        None, если пользователя ещё нет.
+        """
+        with get_db_connection() as conn:
+            conn.execute("BEGIN")
+            user = conn.execute(
+                "SELECT * FROM bot_users WHERE telegram_id = ?", (telegram_id,)
+            ).fetchone()
+            if not user:
+                return None
+            payments = conn.execute("""
+                SELECT id, stars, amount_rub, status, subscription_days,
+                       payment_method, created_at, completed_at
+                FROM payments
+                WHERE user_id = ? AND status = 'completed'
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (telegram_id, payments_limit)).fetchall()
+            purchased_gifts = conn.execute(
+                "SELECT * FROM gift_codes WHERE buyer_id = ? ORDER BY created_at DESC", (telegram_id,)
+            ).fetchall()
+            received_gifts = conn.execute(
+                "SELECT * FROM gift_codes WHERE recipient_id = ? AND status = 'used' ORDER BY activated_at DESC",
+                (telegram_id,)
+            ).fetchall()
+            short_uuid = None
+            if user.get('remnawave_user_uuid'):
+                panel_user = conn.execute(
+                    "SELECT data FROM panel_users WHERE uuid = ?", (user['remnawave_user_uuid'],)
+                ).fetchone()
+                if panel_user:
+                    short_uuid = json.loads(panel_user['data']).get('shortUuid')
+            return {
+                'user': dict(user),
+                'payments': [dict(row) for row in payments],
+                'purchased_gifts': [dict(row) for row in purchased_gifts],
+                'received_gifts': [dict(row) for row in received_gifts],
+                'short_uuid': short_uuid,
+            }
     
     @staticmethod
+    @db_write
     def update_last_renewal_notification(telegram_id: int):
         """Обновляет время последнего напоминания об автопродлении."""
         with get_db_connection() as conn:
@@ -270,7 +873,20 @@ class BotUser:
             """)
             rows = cursor.fetchall()
             return [dict(row) for row in rows]
-    
+
+    @staticmethod
+    def get_renewal_schedule() -> list[dict]:
+        """Пользователи с автопродлением вместе с expireAt/status из локального индекса панели."""
+        with get_db_connection() as conn:
+            rows = conn.execute("""
+                SELECT b.telegram_id, b.language, b.remnawave_user_uuid, b.last_renewal_notification,
+                       p.expire_at, p.status
+                FROM bot_users b
+                LEFT JOIN panel_users p ON p.uuid = b.remnawave_user_uuid
+                WHERE b.remnawave_user_uuid IS NOT NULL AND b.auto_renewal = 1
+            """).fetchall()
+            return [dict(row) for row in rows]
+
     @staticmethod
     def get_all_user_ids() -> list[int]:
         """Получает ID всех пользователей бота."""
@@ -323,6 +939,7 @@ class Referral:
     """Модель реферальной программы."""
     
     @staticmethod
+    @db_write
     def create(referrer_id: int, referred_id: int, bonus_days: int = 0):
         """Создает реферальную запись."""
         with get_db_connection() as conn:
@@ -360,17 +977,30 @@ class Referral:
             return result if result else 0
     
     @staticmethod
+    def get_referral_bonus(referrer_id: int, referred_id: int) -> Optional[int]:
+        """Бонусные дни, начисленные за конкретного реферала; None, если связи нет."""
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT bonus_days FROM referrals WHERE referrer_id = ? AND referred_id = ?",
+                (referrer_id, referred_id)
+            ).fetchone()
+            return None if row is None else (row["bonus_days"] or 0)
+    
+    @staticmethod
+    @db_write
     def grant_bonus(referrer_id: int, referred_id: int, bonus_days: int) -> bool:
         """Начисляет бонусные дни за реферала (обновляет запись)."""
         with get_db_connection() as conn:
-            conn.execute("""
+            cursor = conn.execute("""
                 UPDATE referrals 
                 SET bonus_days = bonus_days + ?
                 WHERE referrer_id = ? AND referred_id = ?
             """, (bonus_days, referrer_id, referred_id))
-            return conn.total_changes > 0
+            # total_changes у долгоживущего соединения накопительный — смотрим rowcount
+            return cursor.rowcount > 0
     
     @staticmethod
+    @db_write
     def update_bonus_days(referrer_id: int, referred_id: int, bonus_days: int):
         """Обновляет количество бонусных дней за реферала."""
         with get_db_connection() as conn:
@@ -385,6 +1015,7 @@ class Payment:
     """Модель платежа."""
     
     @staticmethod
+    @db_write
     def create(
         user_id: int, 
         stars: int = 0,
@@ -417,6 +1048,7 @@ class Payment:
             return dict(row) if row else None
     
     @staticmethod
+    @db_write
     def update_status(payment_id: int, status: str, remnawave_uuid: Optional[str] = None):
         """Обновляет статус платежа."""
         with get_db_connection() as conn:
@@ -433,7 +1065,67 @@ class Payment:
                     SET status = ?, completed_at = ?
                     WHERE id = ?
                 """, (status, completed_at, payment_id))
-    
+
+    @staticmethod
+    @db_write
+    def complete(payment_id: int, remnawave_uuid: Optional[str] = None) -> bool:
+        """
+        Помечает платеж завершённым одним атомарным UPDATE.
+        Возвращает False, если платеж уже был завершён (повторная обработка).
+        """
+        with get_db_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE payments
+                SET status = 'completed', completed_at = ?,
+                    remnawave_user_uuid = COALESCE(?, remnawave_user_uuid)
+                WHERE id = ? AND status != 'completed'
+            """, (datetime.now().isoformat(), remnawave_uuid, payment_id))
+            return cursor.rowcount == 1
+
+    @staticmethod
+    @db_write
+    def close_pending(payment_id: int, status: str) -> bool:
+        """
+        Переводит ожидающий платеж в status (failed, expired) одним атомарным UPDATE.
+        Возвращает False, если платеж уже не ожидает (например, его завершил вебхук).
+        """
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                "UPDATE payments SET status = ? WHERE id = ? AND status = 'pending'",
+                (status, payment_id)
+            )
+            return cursor.rowcount == 1
+
+    @staticmethod
+    @db_write
+    def claim(payment_id: int) -> bool:
+        """
+        Захватывает ожидающий платеж для выдачи подписки (pending → processing).
+        Возвращает False, если платеж уже обрабатывается, завершён или закрыт.
+        Если процесс упадёт во время выдачи, платеж останется в processing и не
+        будет выдан повторно автоматически: его нужно проверить вручную.
+        """
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                "UPDATE payments SET status = 'processing' WHERE id = ? AND status = 'pending'",
+                (payment_id,)
+            )
+            return cursor.rowcount == 1
+
+    @staticmethod
+    @db_write
+    def release(payment_id: int, status: str = "pending") -> bool:
+        """
+        Снимает захват платежа (processing → status): pending для повторной попытки
+        после временной ошибки, failed — после постоянной.
+        """
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                "UPDATE payments SET status = ? WHERE id = ? AND status = 'processing'",
+                (status, payment_id)
+            )
+            return cursor.rowcount == 1
+
     @staticmethod
     def get(payment_id: int) -> Optional[dict]:
         """Получает платеж по ID."""
@@ -453,6 +1145,52 @@ class Payment:
             return dict(row) if row else None
     
     @staticmethod
+    def get_pending_yookassa(min_age_seconds: int, tiers: tuple, limit: int = 500) -> list:
+        """
+        Ожидающие платежи YooKassa старше min_age_seconds, которым пора в проверку.
+
+        tiers — ступени (платёж моложе N секунд или None, проверять не чаще раза
+        в M секунд). Срок проверки считается в SQL, чтобы LIMIT отсекал только
+        подошедшие платежи: сначала ни разу не проверенные, затем давно проверенные.
+        age_seconds — возраст платежа.
+        """
+        cases = []
+        params: list = []
+        for max_age, interval in tiers:
+            if max_age is None:
+                cases.append("ELSE ?")
+                params.append(f"-{int(interval)} seconds")
+                break
+            cases.append("WHEN created_at > datetime('now', ?) THEN ?")
+            params += [f"-{int(max_age)} seconds", f"-{int(interval)} seconds"]
+        with get_db_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT id, user_id, invoice_payload, yookassa_payment_id,
+                       CAST((julianday('now') - julianday(created_at)) * 86400 AS INTEGER) AS age_seconds
+                FROM payments
+                WHERE status = 'pending' AND yookassa_payment_id IS NOT NULL
+                  AND created_at <= datetime('now', ?)
+                  AND (checked_at IS NULL
+                       OR checked_at <= datetime('now', CASE {' '.join(cases)} END))
+                ORDER BY checked_at IS NOT NULL, checked_at, created_at
+                LIMIT ?
+            """, (f"-{int(min_age_seconds)} seconds", *params, limit)).fetchall()
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    @db_write
+    def mark_checked(payment_ids: list[int]) -> None:
+        """Запоминает время проверки платежей в YooKassa."""
+        if not payment_ids:
+            return
+        with get_db_connection() as conn:
+            conn.executemany(
+                "UPDATE payments SET checked_at = CURRENT_TIMESTAMP WHERE id = ?",
+                [(payment_id,) for payment_id in payment_ids]
+            )
+    
+    @staticmethod
+    @db_write
     def update_yookassa_payment(payment_id: int, yookassa_payment_id: str, yookassa_payment_url: str):
         """Обновляет информацию о платеже YooKassa."""
         with get_db_connection() as conn:
@@ -516,6 +1254,32 @@ class GiftCode:
         return f"GIFT-{part1}-{part2}"
     
     @staticmethod
+    def _insert(
+        cursor: sqlite3.Cursor,
+        buyer_id: int,
+        subscription_days: int,
+        stars: int,
+        amount_rub: int,
+        payment_method: str
+    ) -> Optional[dict]:
+        """Вставляет код с уникальным значением; None, если не удалось подобрать код."""
+        for _ in range(10):  # Максимум 10 попыток
+            code = GiftCode.generate_code()
+            try:
+                cursor.execute("""
+                    INSERT INTO gift_codes (code, buyer_id, subscription_days, stars, amount_rub, payment_method)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (code, buyer_id, subscription_days, stars, amount_rub, payment_method))
+                
+                cursor.execute("SELECT * FROM gift_codes WHERE id = ?", (cursor.lastrowid,))
+                return dict(cursor.fetchone())
+            except sqlite3.IntegrityError:
+                continue  # Код уже существует, генерируем новый
+        
+        return None  # Не удалось создать код
+
+    @staticmethod
+    @db_write
     def create(
         buyer_id: int,
         subscription_days: int,
@@ -524,24 +1288,36 @@ class GiftCode:
         payment_method: str = "stars"
     ) -> Optional[dict]:
         """Создает подарочный код после успешной оплаты."""
+        with get_db_connection() as conn:
+            return GiftCode._insert(conn.cursor(), buyer_id, subscription_days, stars, amount_rub, payment_method)
+
+    @staticmethod
+    @db_write
+    def create_for_payment(
+        payment_id: int,
+        buyer_id: int,
+        subscription_days: int,
+        stars: int = 0,
+        amount_rub: int = 0,
+        payment_method: str = "stars"
+    ) -> Optional[dict]:
+        """
+        Завершает платеж и создает по нему подарочный код в одной транзакции.
+        Возвращает None, если платеж уже был завершён: второй код не создаётся.
+        """
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            
-            # Генерируем уникальный код
-            for _ in range(10):  # Максимум 10 попыток
-                code = GiftCode.generate_code()
-                try:
-                    cursor.execute("""
-                        INSERT INTO gift_codes (code, buyer_id, subscription_days, stars, amount_rub, payment_method)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (code, buyer_id, subscription_days, stars, amount_rub, payment_method))
-                    
-                    cursor.execute("SELECT * FROM gift_codes WHERE id = ?", (cursor.lastrowid,))
-                    return dict(cursor.fetchone())
-                except sqlite3.IntegrityError:
-                    continue  # Код уже существует, генерируем новый
-            
-            return None  # Не удалось создать код
+            cursor.execute("""
+                UPDATE payments SET status = 'completed', completed_at = ?
+                WHERE id = ? AND status != 'completed'
+            """, (datetime.now().isoformat(), payment_id))
+            if cursor.rowcount != 1:
+                return None
+            gift = GiftCode._insert(cursor, buyer_id, subscription_days, stars, amount_rub, payment_method)
+            if gift is None:
+                # Откатываем завершение платежа вместе с транзакцией
+                raise RuntimeError(f"Failed to generate a unique gift code for payment {payment_id}")
+            return gift
     
     @staticmethod
     def get_by_code(code: str) -> Optional[dict]:
@@ -555,6 +1331,7 @@ class GiftCode:
             return dict(row) if row else None
     
     @staticmethod
+    @db_write
     def activate(code: str, recipient_id: int, remnawave_uuid: str) -> bool:
         """Активирует подарочный код для получателя."""
         with get_db_connection() as conn:
@@ -665,6 +1442,7 @@ class Loyalty:
             return {'points': 0, 'status': 'bronze', 'total_spent': 0}
     
     @staticmethod
+    @db_write
     def add_points(telegram_id: int, amount_rub: int) -> dict:
         """Добавляет баллы за покупку и обновляет статус."""
         with get_db_connection() as conn:
@@ -697,7 +1475,6 @@ class Loyalty:
                 SET loyalty_points = ?, loyalty_status = ?, total_spent = ?
                 WHERE telegram_id = ?
             """, (new_points, new_status, new_total_spent, telegram_id))
-            conn.commit()
             
             return {
                 'points': new_points,
@@ -710,7 +1487,13 @@ class Loyalty:
     def get_discount(telegram_id: int, days: int) -> int:
         """Получает скидку в рублях для пользователя на указанный период."""
         loyalty = Loyalty.get_user_loyalty(telegram_id)
-        status = loyalty['status']
+        return Loyalty.get_status_discount(loyalty['status'], days)
+    
+    @staticmethod
+    def get_status_discount(status: str, days: int) -> int:
+        """Скидка в рублях для статуса на указанный период (без обращения к БД)."""
+        if status not in Loyalty.DISCOUNTS:
+            status = 'bronze'
         
         # Находим ближайший подходящий период
         available_days = sorted(Loyalty.DISCOUNTS[status].keys())
@@ -758,3 +1541,385 @@ class Loyalty:
         """Возвращает название статуса с эмодзи."""
         return Loyalty.STATUS_NAMES.get(status, '🥉 Bronze')
 
+
+class PanelUser:
+    """Локальный индекс пользователей панели Remnawave (для поиска без обхода API)."""
+
+    # Минимальная длина запроса для триграммного индекса
+    FTS_MIN_QUERY = 3
+
+    @staticmethod
+    def _row_from_api(user: dict) -> Optional[tuple]:
+        """Преобразует пользователя из ответа API в строку panel_users."""
+        info = user.get("response", user)
+        uuid = info.get("uuid")
+        if not uuid:
+            return None
+        username = (info.get("username") or "").lstrip("@") or None
+        return (
+            uuid,
+            username,
+            info.get("telegramId"),
+            info.get("email"),
+            info.get("description"),
+            info.get("status"),
+            info.get("expireAt"),
+            info.get("updatedAt"),
+            json.dumps(info, ensure_ascii=False),
+        )
+
+    @staticmethod
+    @db_write
+    def upsert_many(users: list[dict]) -> int:
+        """Добавляет или обновляет пользователей из ответов API. Возвращает число записей."""
+        rows = [row for row in map(PanelUser._row_from_api, users) if row]
+        if not rows:
+            return 0
+        with get_db_connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO panel_users
+                    (uuid, username, telegram_id, email, description, status, expire_at, updated_at, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(uuid) DO UPDATE SET
+                    username = excluded.username,
+                    telegram_id = excluded.telegram_id,
+                    email = excluded.email,
+                    description = excluded.description,
+                    status = excluded.status,
+                    expire_at = excluded.expire_at,
+                    updated_at = excluded.updated_at,
+                    data = excluded.data
+                """,
+                rows
+            )
+        return len(rows)
+
+    @staticmethod
+    @db_write
+    def delete_many(uuids: list[str]) -> int:
+        """Удаляет пользователей из индекса."""
+        if not uuids:
+            return 0
+        with get_db_connection() as conn:
+            cursor = conn.executemany("DELETE FROM panel_users WHERE uuid = ?", [(uuid,) for uuid in uuids])
+            return cursor.rowcount
+
+    @staticmethod
+    def get_versions() -> dict[str, Optional[str]]:
+        """Возвращает {uuid: updatedAt} для всех пользователей в индексе."""
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT uuid, updated_at FROM panel_users").fetchall()
+            return {row["uuid"]: row["updated_at"] for row in rows}
+
+    @staticmethod
+    def count() -> int:
+        """Количество пользователей в индексе."""
+        with get_db_connection() as conn:
+            return conn.execute("SELECT COUNT(*) AS cnt FROM panel_users").fetchone()["cnt"]
+
+    @staticmethod
+    def get_many(uuids: list[str]) -> dict[str, dict]:
+        """Возвращает {uuid: данные пользователя} для найденных в индексе uuid."""
+        result: dict[str, dict] = {}
+        with get_db_connection() as conn:
+            # Порциями, чтобы не упереться в лимит параметров SQLite
+            for i in range(0, len(uuids), 500):
+                chunk = uuids[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT uuid, data FROM panel_users WHERE uuid IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                result.update((row["uuid"], json.loads(row["data"])) for row in rows)
+        return result
+
+    @staticmethod
+    def get_by_status(status: str) -> list[dict]:
+        """Пользователи панели с указанным статусом (ACTIVE, DISABLED, ...)."""
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT data FROM panel_users WHERE status = ?", (status,)).fetchall()
+            return [json.loads(row["data"]) for row in rows]
+
+    @staticmethod
+    def _has_fts(conn: sqlite3.Connection) -> bool:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'panel_users_fts'"
+        ).fetchone()
+        return row is not None
+
+    @staticmethod
+    def search(query: str, limit: int = 200) -> list[dict]:
+        """Ищет пользователей по username, email, описанию или Telegram ID (подстрока)."""
+        needle = query.strip().lstrip("@")
+        if not needle:
+            return []
+        with get_db_connection() as conn:
+            if len(needle) >= PanelUser.FTS_MIN_QUERY and PanelUser._has_fts(conn):
+                phrase = '"' + needle.replace('"', '""') + '"'
+                rows = conn.execute(
+                    """
+                    SELECT p.data FROM panel_users_fts f
+                    JOIN panel_users p ON p.rowid = f.rowid
+                    WHERE panel_users_fts MATCH ?
+                    ORDER BY p.username COLLATE NOCASE
+                    LIMIT ?
+                    """,
+                    (phrase, limit)
+                ).fetchall()
+            else:
+                pattern = "%" + needle.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                rows = conn.execute(
+                    """
+                    SELECT data FROM panel_users
+                    WHERE username LIKE ?1 ESCAPE '\\' OR email LIKE ?1 ESCAPE '\\'
+                       OR description LIKE ?1 ESCAPE '\\' OR CAST(telegram_id AS TEXT) LIKE ?1 ESCAPE '\\'
+                    ORDER BY username COLLATE NOCASE
+                    LIMIT ?2
+                    """,
+                    (pattern, limit)
+                ).fetchall()
+            return [json.loads(row["data"]) for row in rows]
+
+
+class Broadcast:
+    """Модель рассылки и её получателей."""
+
+    # Условия выборки получателей по типу аудитории
+    TARGETS = {
+        'all': "1 = 1",
+        'active': "remnawave_user_uuid IS NOT NULL",
+        'inactive': "remnawave_user_uuid IS NULL",
+    }
+
+    @staticmethod
+    @db_write
+    def create(
+        admin_id: int,
+        target_type: str,
+        message_text: Optional[str],
+        photo_id: Optional[str] = None,
+        source_chat_id: Optional[int] = None,
+        source_message_id: Optional[int] = None,
+        locale: str = 'ru'
+    ) -> int:
+        """Создаёт рассылку и список получателей. Возвращает ID рассылки."""
+        condition = Broadcast.TARGETS.get(target_type, Broadcast.TARGETS['inactive'])
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO broadcast_jobs
+                    (admin_id, locale, target_type, message_text, photo_id, source_chat_id, source_message_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (admin_id, locale, target_type, message_text, photo_id, source_chat_id, source_message_id)
+            )
+            job_id = cursor.lastrowid
+            cursor = conn.execute(
+                f"INSERT INTO broadcast_recipients (job_id, user_id) SELECT ?, telegram_id FROM bot_users WHERE {condition}",
+                (job_id,)
+            )
+            conn.execute("UPDATE broadcast_jobs SET total = ? WHERE id = ?", (cursor.rowcount, job_id))
+            return job_id
+
+    @staticmethod
+    def get(job_id: int) -> Optional[dict]:
+        """Получает рассылку по ID."""
+        with get_db_connection() as conn:
+            row = conn.execute("SELECT * FROM broadcast_jobs WHERE id = ?", (job_id,)).fetchone()
+            return dict(row) if row else None
+
+    @staticmethod
+    def get_running() -> list[dict]:
+        """Незавершённые рассылки (для продолжения после перезапуска)."""
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id").fetchall()
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    def get_pending_recipients(job_id: int, after_user_id: int = -1, limit: int = 1000) -> list[int]:
+        """Следующая порция получателей, которым сообщение ещё не отправлено."""
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                """
+                SELECT user_id FROM broadcast_recipients
+                WHERE job_id = ? AND status = 'pending' AND user_id > ?
+                ORDER BY user_id
+                LIMIT ?
+                """,
+                (job_id, after_user_id, limit)
+            ).fetchall()
+            return [row['user_id'] for row in rows]
+
+    @staticmethod
+    @db_write
+    def set_status_message(job_id: int, chat_id: int, message_id: int):
+        """Сохраняет сообщение админа, в котором показывается прогресс."""
+        with get_db_connection() as conn:
+            conn.execute(
+                "UPDATE broadcast_jobs SET status_chat_id = ?, status_message_id = ? WHERE id = ?",
+                (chat_id, message_id, job_id)
+            )
+
+    @staticmethod
+    @db_write
+    def record_results(job_id: int, sent_ids: list[int], failed: list[tuple[int, str]]):
+        """Отмечает результаты отправки и обновляет счётчики рассылки."""
+        with get_db_connection() as conn:
+            conn.executemany(
+                "UPDATE broadcast_recipients SET status = 'sent' WHERE job_id = ? AND user_id = ?",
+                [(job_id, user_id) for user_id in sent_ids]
+            )
+            conn.executemany(
+                "UPDATE broadcast_recipients SET status = 'failed', error = ? WHERE job_id = ? AND user_id = ?",
+                [(error, job_id, user_id) for user_id, error in failed]
+            )
+            conn.execute(
+                "UPDATE broadcast_jobs SET sent = sent + ?, errors = errors + ? WHERE id = ?",
+                (len(sent_ids), len(failed), job_id)
+            )
+
+    @staticmethod
+    @db_write
+    def finish(job_id: int, status: str = 'completed'):
+        """Завершает рассылку (completed, cancelled или failed)."""
+        with get_db_connection() as conn:
+            conn.execute(
+                "UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                (status, datetime.now().isoformat(), job_id)
+            )
+
+
+class OutboxMessage:
+    """Критичные уведомления, ожидающие отправки (см. src/services/notification_outbox.py)."""
+
+    @staticmethod
+    @db_write
+    def create(
+        chat_id: int,
+        text: str,
+        parse_mode: Optional[str] = None,
+        thread_id: Optional[int] = None,
+        reply_markup: Optional[str] = None,
+        kind: Optional[str] = None,
+        summary: Optional[str] = None
+    ) -> int:
+        """Сохраняет уведомление. reply_markup — клавиатура в JSON."""
+        with get_db_connection() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO notification_outbox (chat_id, thread_id, text, parse_mode, reply_markup, kind, summary)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (chat_id, thread_id, text, parse_mode, reply_markup, kind, summary)
+            )
+            return cursor.lastrowid
+
+    @staticmethod
+    def get_all() -> list[dict]:
+        """Все неотправленные уведомления в порядке создания."""
+        with get_db_connection() as conn:
+            rows = conn.execute("SELECT * FROM notification_outbox ORDER BY id").fetchall()
+            return [dict(row) for row in rows]
+
+    @staticmethod
+    @db_write
+    def delete_many(message_ids: list[int]) -> None:
+        """Удаляет отправленные уведомления."""
+        if not message_ids:
+            return
+        with get_db_connection() as conn:
+            conn.executemany(
+                "DELETE FROM notification_outbox WHERE id = ?", [(message_id,) for message_id in message_ids]
+            )
+
+
+class StateEntry:
+    """Хранилище состояния диалогов: значение в JSON со сроком жизни."""
+
+    @staticmethod
+    def get(namespace: str, key: str) -> Optional[tuple[str, float]]:
+        """(JSON-значение, expires_at) или None, если записи нет или она истекла."""
+        with get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT value, expires_at FROM bot_state WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time())
+            ).fetchone()
+            return (row["value"], row["expires_at"]) if row else None
+
+    @staticmethod
+    def get_many(namespace: str, keys: list[str]) -> dict[str, tuple[str, float]]:
+        """{ключ: (JSON-значение, expires_at)} для неистёкших записей из keys."""
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                f"SELECT key, value, expires_at FROM bot_state "
+                f"WHERE namespace = ? AND key IN ({placeholders}) AND expires_at > ?",
+                (namespace, *keys, time.time())
+            ).fetchall()
+            return {row["key"]: (row["value"], row["expires_at"]) for row in rows}
+
+    @staticmethod
+    def get_recent(namespace: str, limit: int) -> list[tuple[str, str, float]]:
+        """До limit неистёкших записей (ключ, JSON-значение, expires_at), последние изменённые первыми."""
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                "SELECT key, value, expires_at FROM bot_state WHERE namespace = ? AND expires_at > ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (namespace, time.time(), limit)
+            ).fetchall()
+            return [(row["key"], row["value"], row["expires_at"]) for row in rows]
+
+    @staticmethod
+    def get_keys(namespace: str) -> list[str]:
+        """Ключи неистёкших записей пространства имён."""
+        with get_db_connection() as conn:
+            rows = conn.execute(
+                "SELECT key FROM bot_state WHERE namespace = ? AND expires_at > ?", (namespace, time.time())
+            ).fetchall()
+            return [row["key"] for row in rows]
+
+    @staticmethod
+    @db_write
+    def save_many(rows: list[tuple[str, str, str, float]]) -> None:
+        """Сохраняет записи (namespace, key, value, expires_at)."""
+        if not rows:
+            return
+        with get_db_connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO bot_state (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at
+                """,
+                rows
+            )
+
+    @staticmethod
+    @db_write
+    def delete_many(namespace: str, keys: list[str]) -> None:
+        if not keys:
+            return
+        with get_db_connection() as conn:
+            conn.executemany(
+                "DELETE FROM bot_state WHERE namespace = ? AND key = ?", [(namespace, key) for key in keys]
+            )
+
+    @staticmethod
+    @db_write
+    def purge_expired() -> int:
+        """Удаляет истёкшие записи. Возвращает их количество."""
+        with get_db_connection() as conn:
+            return conn.execute("DELETE FROM bot_state WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+# Awaitable-версии всех методов моделей для использования из корутин
+BotUser.aio = AsyncModel(BotUser)
+Referral.aio = AsyncModel(Referral)
+Payment.aio = AsyncModel(Payment)
+GiftCode.aio = AsyncModel(GiftCode)
+Loyalty.aio = AsyncModel(Loyalty)
+PanelUser.aio = AsyncModel(PanelUser)
+Broadcast.aio = AsyncModel(Broadcast)
+OutboxMessage.aio = AsyncModel(OutboxMessage)
+StateEntry.aio = AsyncModel(StateEntry)
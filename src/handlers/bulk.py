@@ -6,12 +6,13 @@ from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMar
 from aiogram.utils.i18n import gettext as _
 
 from src.handlers.common import _edit_text_safe, _not_admin, _send_clean_message
-from src.handlers.state import PENDING_INPUT, SEARCH_PAGE_SIZE
+from src.handlers.state import PENDING_INPUT
 from src.keyboards.bulk_hosts import bulk_hosts_keyboard
 from src.keyboards.bulk_users import bulk_users_keyboard
 from src.services.api_client import ApiClientError, UnauthorizedError, api_client
+from src.services.user_index_service import fetch_users, get_users_by_status
 from src.utils.logger import logger
-from src.utils.notifications import send_user_notification
+from src.utils.notifications import send_bulk_user_notification
 
 # Временные импорты из других модулей
 # TODO: Импортировать _fetch_hosts_text из hosts.py после завершения рефакторинга
@@ -43,60 +44,16 @@ async def _run_bulk_action(
         if action == "reset":
             await api_client.bulk_reset_traffic_users(uuids or [])
         elif action == "delete":
-            # Получаем информацию о пользователях перед удалением для уведомлений
-            users_to_notify = []
-            if uuids:
-                for user_uuid in uuids:
-                    try:
-                        user = await api_client.get_user_by_uuid(user_uuid)
-                        users_to_notify.append(user)
-                    except Exception:
-                        logger.debug("Failed to get user data for notification user_uuid=%s", user_uuid)
-            
+            # Данные для уведомления: из локального индекса, недостающие — параллельно из панели
+            users_to_notify = await fetch_users(uuids or [])
             await api_client.bulk_delete_users(uuids or [])
-            
-            # Отправляем уведомления о удалении
-            try:
-                bot = target.message.bot if isinstance(target, CallbackQuery) else target.bot
-                for user in users_to_notify:
-                    await send_user_notification(bot, "deleted", user)
-            except Exception:
-                logger.exception("Failed to send user deletion notifications")
+            await _notify_deleted(target, users_to_notify)
         elif action == "delete_status":
             if status not in ALLOWED_STATUSES:
                 await _reply(target, _("bulk.usage_delete_status"))
                 return
-            
-            # Получаем информацию о пользователях перед удалением для уведомлений
-            users_to_notify = []
-            try:
-                start = 0
-                while True:
-                    users_data = await api_client.get_users(start=start, size=SEARCH_PAGE_SIZE)
-                    payload = users_data.get("response", users_data)
-                    users = payload.get("users", [])
-                    total = payload.get("total", len(users))
-                    
-                    for user in users:
-                        user_info = user.get("response", user)
-                        if user_info.get("status") == status and user_info.get("uuid"):
-                            users_to_notify.append(user)
-                    
-                    start += SEARCH_PAGE_SIZE
-                    if start >= total or not users:
-                        break
-            except Exception:
-                logger.exception("Failed to get users for deletion notifications")
-            
-            await api_client.bulk_delete_users_by_status(status)
-            
-            # Отправляем уведомления о удалении
-            try:
-                bot = target.message.bot if isinstance(target, CallbackQuery) else target.bot
-                for user in users_to_notify:
-                    await send_user_notification(bot, "deleted", user)
-            except Exception:
-                logger.exception("Failed to send user deletion notifications")
+
+            await _delete_by_status(target, status)
         elif action == "revoke":
             await api_client.bulk_revoke_subscriptions(uuids or [])
         elif action == "extend":
@@ -125,6 +82,26 @@ async def _run_bulk_action(
         await _reply(target, _("bulk.error"))
 
 
+async def _delete_by_status(target: Message | CallbackQuery, status: str) -> None:
+    """Удаляет пользователей с указанным статусом и отправляет сводное уведомление."""
+    # Список для уведомления берём из локального индекса — без обхода всей панели
+    try:
+        users_to_notify = await get_users_by_status(status)
+    except Exception:
+        # Уведомление необязательно: сбой индекса (в т.ч. ошибка SQLite) не должен отменять удаление
+        logger.exception("Failed to get users for deletion notifications")
+        users_to_notify = []
+
+    await api_client.bulk_delete_users_by_status(status)
+    await _notify_deleted(target, users_to_notify, status)
+
+
+async def _notify_deleted(target: Message | CallbackQuery, users: list[dict], status: str | None = None) -> None:
+    """Одно сводное уведомление в топик об удалённых пользователях."""
+    bot = target.message.bot if isinstance(target, CallbackQuery) else target.bot
+    await send_bulk_user_notification(bot, "deleted", users, status)
+
+
 async def _reply(target: Message | CallbackQuery, text: str, back: bool = False) -> None:
     """Отправляет ответ на массовую операцию."""
     markup = bulk_users_keyboard() if back else None
@@ -155,24 +132,9 @@ async def _handle_bulk_users_input(message: Message, ctx: dict) -> None:
             return
 
         try:
-            # Получаем всех активных пользователей с пагинацией
-            active_uuids: list[str] = []
-            start = 0
-            while True:
-                users_data = await api_client.get_users(start=start, size=SEARCH_PAGE_SIZE)
-                payload = users_data.get("response", users_data)
-                users = payload.get("users", [])
-                total = payload.get("total", len(users))
-
-                # Фильтруем активных пользователей
-                for user in users:
-                    user_info = user.get("response", user)
-                    if user_info.get("status") == "ACTIVE" and user_info.get("uuid"):
-                        active_uuids.append(user_info.get("uuid"))
-
-                start += SEARCH_PAGE_SIZE
-                if start >= total or not users:
-                    break
+            # Статус берём из панели, а не из индекса: продление не должно зависеть от его свежести
+            active_users = await get_users_by_status("ACTIVE", fresh=True)
+            active_uuids = [user["uuid"] for user in active_users]
 
             if not active_uuids:
                 await _send_clean_message(message, _("bulk.no_active_users"), reply_markup=bulk_users_keyboard())
@@ -218,39 +180,7 @@ async def cb_bulk_users_actions(callback: CallbackQuery) -> None:
             await api_client.bulk_reset_traffic_all_users()
             await _edit_text_safe(callback.message, _("bulk.done"), reply_markup=bulk_users_keyboard())
         elif action == "delete" and len(parts) > 3:
-            status = parts[3]
-            
-            # Получаем информацию о пользователях перед удалением для уведомлений
-            users_to_notify = []
-            try:
-                start = 0
-                while True:
-                    users_data = await api_client.get_users(start=start, size=SEARCH_PAGE_SIZE)
-                    payload = users_data.get("response", users_data)
-                    users = payload.get("users", [])
-                    total = payload.get("total", len(users))
-                    
-                    for user in users:
-                        user_info = user.get("response", user)
-                        if user_info.get("status") == status and user_info.get("uuid"):
-                            users_to_notify.append(user)
-                    
-                    start += SEARCH_PAGE_SIZE
-                    if start >= total or not users:
-                        break
-            except Exception:
-                logger.exception("Failed to get users for deletion notifications")
-            
-            await api_client.bulk_delete_users_by_status(status)
-            
-            # Отправляем уведомления о удалении
-            try:
-                bot = callback.message.bot
-                for user in users_to_notify:
-                    await send_user_notification(bot, "deleted", user)
-            except Exception:
-                logger.exception("Failed to send user deletion notifications")
-            
+            await _delete_by_status(callback, parts[3])
             await _edit_text_safe(callback.message, _("bulk.done"), reply_markup=bulk_users_keyboard())
         elif action == "extend_all" and len(parts) > 3:
             try:
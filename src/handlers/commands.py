@@ -1,4 +1,6 @@
 """Обработчики команд бота."""
+import asyncio
+
 from aiogram import F, Router
 from aiogram.filters import Command
 from aiogram.types import Message
@@ -12,6 +14,7 @@ from src.keyboards.hosts_menu import hosts_menu_keyboard
 from src.keyboards.main_menu import bulk_menu_keyboard, main_menu_keyboard, nodes_menu_keyboard, resources_menu_keyboard, system_menu_keyboard
 from src.keyboards.providers_menu import providers_menu_keyboard
 from src.keyboards.stats_menu import stats_menu_keyboard
+from src.utils.i18n import reload_i18n
 
 # Импорты из соответствующих модулей
 from src.handlers.billing import _fetch_billing_nodes_text, _fetch_billing_text, _fetch_providers_text
@@ -103,6 +106,18 @@ async def cmd_help(message: Message) -> None:
     await _send_clean_message(message, _("bot.help"))
 
 
+@router.message(Command("reload_i18n"))
+async def cmd_reload_i18n(message: Message) -> None:
+    """Обработчик команды /reload_i18n — перечитывает файлы локализации без перезапуска."""
+    if await _not_admin(message):
+        return
+    counts = await asyncio.to_thread(reload_i18n)
+    await _send_clean_message(
+        message,
+        _("bot.i18n_reloaded").format(locales=", ".join(sorted(counts)), keys=sum(counts.values())),
+    )
+
+
 @router.message(Command("health"))
 async def cmd_health(message: Message) -> None:
     """Обработчик команды /health."""
@@ -8,7 +8,7 @@ from aiogram.types import Message
 from aiogram.utils.i18n import gettext as _
 
 from src.config import get_settings
-from src.database import BotUser, get_db_connection
+from src.database import BotUser, get_db_connection, run_db
 from src.handlers.common import _not_admin, _send_clean_message
 from src.services.api_client import api_client
 from src.utils.logger import logger
@@ -16,6 +16,15 @@ from src.utils.logger import logger
 router = Router(name="migration")
 
 
+def _select_users(only_with_subscription: bool = False) -> list[dict]:
+    """Возвращает telegram_id и username пользователей бота."""
+    query = "SELECT telegram_id, username FROM bot_users"
+    if only_with_subscription:
+        query += " WHERE remnawave_user_uuid IS NOT NULL"
+    with get_db_connection() as conn:
+        return conn.execute(query).fetchall()
+
+
 @router.message(Command("migrate_notify"))
 async def cmd_migrate_notify(message: Message) -> None:
     """
@@ -27,15 +36,7 @@ async def cmd_migrate_notify(message: Message) -> None:
         return
     
     # Получаем всех пользователей с UUID
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT telegram_id, username 
-        FROM bot_users 
-        WHERE remnawave_user_uuid IS NOT NULL
-    """)
-    users = cursor.fetchall()
-    conn.close()
+    users = await run_db(_select_users, only_with_subscription=True)
     
     if not users:
         await _send_clean_message(message, "❌ Нет пользователей с активной подпиской")
@@ -65,15 +66,7 @@ async def cmd_migrate_notify_confirm(message: Message) -> None:
         return
     
     # Получаем всех пользователей с UUID
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT telegram_id, username 
-        FROM bot_users 
-        WHERE remnawave_user_uuid IS NOT NULL
-    """)
-    users = cursor.fetchall()
-    conn.close()
+    users = await run_db(_select_users, only_with_subscription=True)
     
     notification_text = (
         "🔔 <b>Важное обновление!</b>\n\n"
@@ -152,11 +145,7 @@ async def cmd_grant_migration(message: Message) -> None:
             return
     
     # Получаем всех пользователей
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id, username FROM bot_users")
-    users = cursor.fetchall()
-    conn.close()
+    users = await run_db(_select_users)
     
     if not users:
         await _send_clean_message(message, "❌ Нет пользователей в базе данных")
@@ -196,11 +185,7 @@ async def cmd_grant_migration_confirm(message: Message) -> None:
             return
     
     # Получаем всех пользователей
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT telegram_id, username FROM bot_users")
-    users = cursor.fetchall()
-    conn.close()
+    users = await run_db(_select_users)
     
     settings = get_settings()
     expire_date = (datetime.utcnow() + timedelta(days=days)).isoformat() + "Z"
@@ -220,7 +205,7 @@ async def cmd_grant_migration_confirm(message: Message) -> None:
         
         try:
             # Проверяем, есть ли уже UUID
-            bot_user = BotUser.get_or_create(user_id, username)
+            bot_user = await BotUser.aio.get_or_create(user_id, username)
             existing_uuid = bot_user.get('remnawave_user_uuid')
             
             if existing_uuid:
@@ -247,7 +232,7 @@ async def cmd_grant_migration_confirm(message: Message) -> None:
                 user_uuid = user_info.get("uuid")
                 
                 if user_uuid:
-                    BotUser.set_remnawave_uuid(user_id, user_uuid)
+                    await BotUser.aio.set_remnawave_uuid(user_id, user_uuid)
                     granted += 1
                     logger.info(f"✅ Granted {days} days to {username} ({user_id})")
                 else:
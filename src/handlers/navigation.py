@@ -27,6 +27,7 @@ from src.keyboards.main_menu import (
 from src.keyboards.navigation import NavTarget, nav_keyboard, nav_row
 from src.keyboards.providers_menu import providers_menu_keyboard
 from src.services.api_client import ApiClientError, NotFoundError, UnauthorizedError, api_client
+from src.services.dashboard_service import get_snapshot
 from src.utils.logger import logger
 
 # Импорты из соответствующих модулей
@@ -36,53 +37,24 @@ from src.handlers.nodes import _fetch_nodes_text
 from src.handlers.resources import _fetch_configs_text, _fetch_snippets_text, _send_templates, _show_tokens
 from src.handlers.users import _format_user_choice, _send_user_summary, _show_user_search_results, _start_user_search_flow
 from src.keyboards.subscription_actions import subscription_keyboard
-from src.utils.formatters import build_subscription_summary
+from src.utils.formatters import build_subscription_summary, format_count
 
 async def _fetch_main_menu_text() -> str:
     """Получает текст для главного меню с краткой статистикой."""
     try:
-        # Получаем основную статистику системы
-        data = await api_client.get_stats()
-        res = data.get("response", {})
-        users = res.get("users", {})
-        online = res.get("onlineStats", {})
-        nodes = res.get("nodes", {})
-
-        total_users = users.get("totalUsers", 0)
-        online_now = online.get("onlineNow", 0)
-        nodes_online = nodes.get("totalOnline", 0)
-
-        # Получаем количество хостов
-        try:
-            hosts_data = await api_client.get_hosts()
-            hosts = hosts_data.get("response", [])
-            total_hosts = len(hosts)
-            enabled_hosts = sum(1 for h in hosts if not h.get("isDisabled"))
-        except Exception:
-            total_hosts = "—"
-            enabled_hosts = "—"
-
-        # Получаем количество нод
-        try:
-            nodes_data = await api_client.get_nodes()
-            nodes_list = nodes_data.get("response", [])
-            total_nodes = len(nodes_list)
-            enabled_nodes = sum(1 for n in nodes_list if not n.get("isDisabled"))
-        except Exception:
-            total_nodes = "—"
-            enabled_nodes = "—"
-
+        snapshot = await get_snapshot()
+        stats = snapshot.stats
         lines = [
             _("bot.menu"),
             "",
             _("bot.menu_stats").format(
-                users=total_users,
-                online=online_now,
-                nodes=total_nodes,
-                nodes_enabled=enabled_nodes,
-                nodes_online=nodes_online,
-                hosts=total_hosts,
-                hosts_enabled=enabled_hosts,
+                users=stats.get("users", {}).get("totalUsers", 0),
+                online=stats.get("onlineStats", {}).get("onlineNow", 0),
+                nodes=format_count(snapshot.nodes_total),
+                nodes_enabled=format_count(snapshot.nodes_enabled),
+                nodes_online=stats.get("nodes", {}).get("totalOnline", 0),
+                hosts=format_count(snapshot.hosts_total),
+                hosts_enabled=format_count(snapshot.hosts_enabled),
             ),
         ]
 
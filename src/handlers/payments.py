@@ -18,7 +18,7 @@ async def process_pre_checkout(pre_checkout_query: PreCheckoutQuery) -> None:
     
     try:
         # Проверяем платеж в БД
-        payment = Payment.get_by_payload(invoice_payload)
+        payment = await Payment.aio.get_by_payload(invoice_payload)
         
         if not payment:
             await pre_checkout_query.bot.answer_pre_checkout_query(
@@ -68,7 +68,7 @@ async def process_successful_payment_message(message: Message) -> None:
     invoice_payload = payment_info.invoice_payload
     total_amount = payment_info.total_amount
     
-    user = BotUser.get_or_create(user_id, message.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, message.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -1,28 +1,35 @@
-"""Глобальное состояние бота для хранения данных между запросами."""
+"""Глобальное состояние бота для хранения данных между запросами.
+
+Словари ограничены по размеру, записи истекают и сохраняются в SQLite,
+поэтому начатые диалоги переживают перезапуск (см. src/utils/state_store.py).
+"""
+from src.utils.state_store import PersistentDict
 
 # Словарь для хранения ожидаемого ввода от пользователей
 # Ключ: user_id, Значение: dict с информацией о текущем действии
-PENDING_INPUT: dict[int, dict] = {}
+PENDING_INPUT: PersistentDict = PersistentDict("pending_input")
 
 # Словарь для хранения ID последних сообщений бота в каждом чате
 # Ключ: chat_id, Значение: message_id
-LAST_BOT_MESSAGES: dict[int, int] = {}
+# Telegram не даёт удалять сообщения старше 48 часов — дольше хранить незачем
+LAST_BOT_MESSAGES: PersistentDict = PersistentDict("last_bot_messages", ttl=48 * 3600)
 
 # Словарь для хранения контекста поиска пользователей
 # Ключ: user_id, Значение: dict с query и results
-USER_SEARCH_CONTEXT: dict[int, dict] = {}
+# Результаты поиска объёмные и быстро устаревают
+USER_SEARCH_CONTEXT: PersistentDict = PersistentDict("user_search_context", ttl=3600, max_entries=1000)
 
 # Словарь для хранения целевого меню для возврата из детального просмотра пользователя
 # Ключ: user_id, Значение: NavTarget строка
-USER_DETAIL_BACK_TARGET: dict[int, str] = {}
+USER_DETAIL_BACK_TARGET: PersistentDict = PersistentDict("user_detail_back_target")
 
 # Словарь для хранения текущей страницы подписок для каждого пользователя
 # Ключ: user_id, Значение: номер страницы (int)
-SUBS_PAGE_BY_USER: dict[int, int] = {}
+SUBS_PAGE_BY_USER: PersistentDict = PersistentDict("subs_page_by_user")
 
 # Словарь для хранения состояния пользователя (например, ожидание ввода кода)
 # Ключ: user_id, Значение: строка состояния
-USER_STATE: dict[int, str] = {}
+USER_STATE: PersistentDict = PersistentDict("user_state")
 
 # Константы состояний
 GIFT_ACTIVATE_STATE = "gift_activate"
@@ -30,7 +37,7 @@ BROADCAST_MESSAGE_STATE = "broadcast_message"
 
 # Словарь для хранения данных рассылки
 # Ключ: admin_id, Значение: dict с target_type, message_text, photo_id
-BROADCAST_DATA: dict[int, dict] = {}
+BROADCAST_DATA: PersistentDict = PersistentDict("broadcast_data")
 
 # Константы
 ADMIN_COMMAND_DELETE_DELAY = 2.0
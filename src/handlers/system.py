@@ -1,5 +1,6 @@
 """Обработчики системных операций (health, stats, system nodes)."""
 from aiogram import F, Router
+from aiogram.exceptions import TelegramAPIError
 from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.utils.i18n import gettext as _
 
@@ -9,8 +10,10 @@ from src.keyboards.main_menu import system_menu_keyboard
 from src.keyboards.navigation import NavTarget, nav_row
 from src.keyboards.stats_menu import stats_menu_keyboard, stats_period_keyboard
 from src.keyboards.system_nodes import system_nodes_keyboard
-from src.services.api_client import ApiClientError, UnauthorizedError, api_client
-from src.utils.formatters import build_bandwidth_stats, format_bytes, format_datetime, format_uptime
+from src.services.api_client import ApiClientError, NotFoundError, UnauthorizedError, api_client
+from src.services.dashboard_service import DashboardSnapshot, get_snapshot
+from src.services.fanout import FANOUT_RETRIES, FanOutReport, fan_out
+from src.utils.formatters import build_bandwidth_stats, format_bytes, format_count, format_datetime, format_uptime
 from src.utils.logger import logger
 
 # Временные импорты из других модулей
@@ -19,6 +22,9 @@ from src.handlers.nodes import _fetch_nodes_text
 
 router = Router(name="system")
 
+# Сколько нод с ошибкой перечислять в итоге массовой операции
+FAILED_NODES_SHOWN = 20
+
 
 def _system_nodes_profiles_keyboard(profiles: list[dict]) -> InlineKeyboardMarkup:
     """Клавиатура для выбора профиля конфигурации для системных нод."""
@@ -53,19 +59,31 @@ async def _fetch_health_text() -> str:
         return _("errors.generic")
 
 
+def _infrastructure_lines(snapshot: DashboardSnapshot) -> list[str]:
+    """Строки о хостах, нодах и ресурсах панели из снимка."""
+    return [
+        f"  {_('stats.hosts').format(total=format_count(snapshot.hosts_total), enabled=format_count(snapshot.hosts_enabled), disabled=format_count(snapshot.hosts_disabled))}",
+        f"  {_('stats.nodes_detailed').format(total=format_count(snapshot.nodes_total), enabled=format_count(snapshot.nodes_enabled), disabled=format_count(snapshot.nodes_disabled), online=format_count(snapshot.nodes_online))}",
+        "",
+        f"*{_('stats.resources_section')}*",
+        f"  {_('stats.templates').format(count=format_count(snapshot.templates))}",
+        f"  {_('stats.tokens').format(count=format_count(snapshot.tokens))}",
+        f"  {_('stats.snippets').format(count=format_count(snapshot.snippets))}",
+    ]
+
+
 async def _fetch_panel_stats_text() -> str:
     """Статистика панели (пользователи, ноды, хосты, ресурсы)."""
     try:
-        # Получаем основную статистику системы
-        data = await api_client.get_stats()
-        res = data.get("response", {})
+        snapshot = await get_snapshot()
+        res = snapshot.stats
         users = res.get("users", {})
         online = res.get("onlineStats", {})
         nodes = res.get("nodes", {})
         status_counts = users.get("statusCounts", {}) or {}
         status_str = ", ".join(f"`{k}`: *{v}*" for k, v in status_counts.items()) if status_counts else "—"
 
-        lines = [
+        return "\n".join([
             f"*{_('stats.panel_title')}*",
             "",
             f"*{_('stats.users_section')}*",
@@ -75,58 +93,8 @@ async def _fetch_panel_stats_text() -> str:
             "",
             f"*{_('stats.infrastructure_section')}*",
             f"  {_('stats.nodes').format(online=nodes.get('totalOnline', '—'))}",
-        ]
-
-        # Добавляем статистику по хостам
-        try:
-            hosts_data = await api_client.get_hosts()
-            hosts = hosts_data.get("response", [])
-            total_hosts = len(hosts)
-            enabled_hosts = sum(1 for h in hosts if not h.get("isDisabled"))
-            disabled_hosts = total_hosts - enabled_hosts
-            lines.append(f"  {_('stats.hosts').format(total=total_hosts, enabled=enabled_hosts, disabled=disabled_hosts)}")
-        except Exception:
-            lines.append(f"  {_('stats.hosts').format(total='—', enabled='—', disabled='—')}")
-
-        # Добавляем статистику по нодам
-        try:
-            nodes_data = await api_client.get_nodes()
-            nodes_list = nodes_data.get("response", [])
-            total_nodes = len(nodes_list)
-            enabled_nodes = sum(1 for n in nodes_list if not n.get("isDisabled"))
-            disabled_nodes = total_nodes - enabled_nodes
-            online_nodes = sum(1 for n in nodes_list if n.get("isConnected"))
-            lines.append(
-                f"  {_('stats.nodes_detailed').format(total=total_nodes, enabled=enabled_nodes, disabled=disabled_nodes, online=online_nodes)}"
-            )
-        except Exception:
-            lines.append(f"  {_('stats.nodes_detailed').format(total='—', enabled='—', disabled='—', online='—')}")
-
-        # Добавляем статистику по ресурсам
-        lines.append("")
-        lines.append(f"*{_('stats.resources_section')}*")
-        try:
-            templates_data = await api_client.get_templates()
-            templates = templates_data.get("response", {}).get("templates", [])
-            lines.append(f"  {_('stats.templates').format(count=len(templates))}")
-        except Exception:
-            lines.append(f"  {_('stats.templates').format(count='—')}")
-
-        try:
-            tokens_data = await api_client.get_tokens()
-            tokens = tokens_data.get("response", {}).get("apiKeys", [])
-            lines.append(f"  {_('stats.tokens').format(count=len(tokens))}")
-        except Exception:
-            lines.append(f"  {_('stats.tokens').format(count='—')}")
-
-        try:
-            snippets_data = await api_client.get_snippets()
-            snippets = snippets_data.get("response", {}).get("snippets", [])
-            lines.append(f"  {_('stats.snippets').format(count=len(snippets))}")
-        except Exception:
-            lines.append(f"  {_('stats.snippets').format(count='—')}")
-
-        return "\n".join(lines)
+            *_infrastructure_lines(snapshot),
+        ])
     except UnauthorizedError:
         return _("errors.unauthorized")
     except ApiClientError:
@@ -203,9 +171,8 @@ async def _fetch_server_stats_text() -> str:
 async def _fetch_stats_text() -> str:
     """Получает общую статистику системы."""
     try:
-        # Получаем основную статистику системы
-        data = await api_client.get_stats()
-        res = data.get("response", {})
+        snapshot = await get_snapshot()
+        res = snapshot.stats
         mem = res.get("memory", {})
         cpu = res.get("cpu", {})
         users = res.get("users", {})
@@ -214,7 +181,7 @@ async def _fetch_stats_text() -> str:
         status_counts = users.get("statusCounts", {}) or {}
         status_str = ", ".join(f"`{k}`: *{v}*" for k, v in status_counts.items()) if status_counts else "—"
 
-        lines = [
+        return "\n".join([
             f"*{_('stats.title')}*",
             "",
             f"*{_('stats.system_section')}*",
@@ -229,58 +196,8 @@ async def _fetch_stats_text() -> str:
             "",
             f"*{_('stats.infrastructure_section')}*",
             f"  {_('stats.nodes').format(online=nodes.get('totalOnline', '—'))}",
-        ]
-
-        # Добавляем статистику по хостам
-        try:
-            hosts_data = await api_client.get_hosts()
-            hosts = hosts_data.get("response", [])
-            total_hosts = len(hosts)
-            enabled_hosts = sum(1 for h in hosts if not h.get("isDisabled"))
-            disabled_hosts = total_hosts - enabled_hosts
-            lines.append(f"  {_('stats.hosts').format(total=total_hosts, enabled=enabled_hosts, disabled=disabled_hosts)}")
-        except Exception:
-            lines.append(f"  {_('stats.hosts').format(total='—', enabled='—', disabled='—')}")
-
-        # Добавляем статистику по нодам
-        try:
-            nodes_data = await api_client.get_nodes()
-            nodes_list = nodes_data.get("response", [])
-            total_nodes = len(nodes_list)
-            enabled_nodes = sum(1 for n in nodes_list if not n.get("isDisabled"))
-            disabled_nodes = total_nodes - enabled_nodes
-            online_nodes = sum(1 for n in nodes_list if n.get("isConnected"))
-            lines.append(
-                f"  {_('stats.nodes_detailed').format(total=total_nodes, enabled=enabled_nodes, disabled=disabled_nodes, online=online_nodes)}"
-            )
-        except Exception:
-            lines.append(f"  {_('stats.nodes_detailed').format(total='—', enabled='—', disabled='—', online='—')}")
-
-        # Добавляем статистику по ресурсам
-        lines.append("")
-        lines.append(f"*{_('stats.resources_section')}*")
-        try:
-            templates_data = await api_client.get_templates()
-            templates = templates_data.get("response", {}).get("templates", [])
-            lines.append(f"  {_('stats.templates').format(count=len(templates))}")
-        except Exception:
-            lines.append(f"  {_('stats.templates').format(count='—')}")
-
-        try:
-            tokens_data = await api_client.get_tokens()
-            tokens = tokens_data.get("response", {}).get("apiKeys", [])
-            lines.append(f"  {_('stats.tokens').format(count=len(tokens))}")
-        except Exception:
-            lines.append(f"  {_('stats.tokens').format(count='—')}")
-
-        try:
-            snippets_data = await api_client.get_snippets()
-            snippets = snippets_data.get("response", {}).get("snippets", [])
-            lines.append(f"  {_('stats.snippets').format(count=len(snippets))}")
-        except Exception:
-            lines.append(f"  {_('stats.snippets').format(count='—')}")
-
-        return "\n".join(lines)
+            *_infrastructure_lines(snapshot),
+        ])
     except UnauthorizedError:
         return _("errors.unauthorized")
     except ApiClientError:
@@ -351,6 +268,18 @@ async def cb_system_nodes(callback: CallbackQuery) -> None:
     await _edit_text_safe(callback.message, _("system_nodes.overview"), reply_markup=system_nodes_keyboard())
 
 
+def _format_fan_out_report(report: FanOutReport) -> str:
+    """Итог массовой операции над нодами со списком нод, где она не выполнилась."""
+    if not report.failed:
+        return _("system_nodes.done").format(count=len(report.succeeded))
+    lines = [_("system_nodes.done_partial").format(success=len(report.succeeded), errors=len(report.failed)), ""]
+    for node, error in report.failed[:FAILED_NODES_SHOWN]:
+        lines.append(f"• {node.get('name') or node['uuid']}: {error}")
+    if len(report.failed) > FAILED_NODES_SHOWN:
+        lines.append(_("system_nodes.failed_more").format(count=len(report.failed) - FAILED_NODES_SHOWN))
+    return "\n".join(lines)
+
+
 @router.callback_query(F.data.startswith("system:nodes:"))
 async def cb_system_nodes_actions(callback: CallbackQuery) -> None:
     """Обработчик действий с системными нодами."""
@@ -413,58 +342,50 @@ async def cb_system_nodes_actions(callback: CallbackQuery) -> None:
             await _edit_text_safe(callback.message, _("system_nodes.error"), reply_markup=system_nodes_keyboard())
         return
 
+    node_actions = {
+        "enable_all": api_client.enable_node,
+        "disable_all": api_client.disable_node,
+        "restart_all": api_client.restart_node,
+        "reset_traffic_all": api_client.reset_node_traffic,
+    }
+    # Повтор после таймаута может выполнить действие второй раз (нода уже перезапускается)
+    retries = 0 if action in ("restart_all", "reset_traffic_all") else FANOUT_RETRIES
+    node_action = node_actions.get(action)
+    if node_action is None:
+        await callback.answer(_("errors.generic"), show_alert=True)
+        return
+
     try:
         # Получаем все ноды
         nodes_data = await api_client.get_nodes()
-        nodes = nodes_data.get("response", [])
-        uuids = [n.get("uuid") for n in nodes if n.get("uuid")]
+        nodes = [n for n in nodes_data.get("response", []) if n.get("uuid")]
 
-        if not uuids:
+        if not nodes:
             await _edit_text_safe(callback.message, _("system_nodes.no_nodes"), reply_markup=system_nodes_keyboard())
             return
 
-        # Выполняем операцию для каждой ноды
-        success_count = 0
-        error_count = 0
-
-        if action == "enable_all":
-            for uuid in uuids:
-                try:
-                    await api_client.enable_node(uuid)
-                    success_count += 1
-                except ApiClientError:
-                    error_count += 1
-        elif action == "disable_all":
-            for uuid in uuids:
-                try:
-                    await api_client.disable_node(uuid)
-                    success_count += 1
-                except ApiClientError:
-                    error_count += 1
-        elif action == "restart_all":
-            for uuid in uuids:
-                try:
-                    await api_client.restart_node(uuid)
-                    success_count += 1
-                except ApiClientError:
-                    error_count += 1
-        elif action == "reset_traffic_all":
-            for uuid in uuids:
-                try:
-                    await api_client.reset_node_traffic(uuid)
-                    success_count += 1
-                except ApiClientError:
-                    error_count += 1
-        else:
-            await callback.answer(_("errors.generic"), show_alert=True)
-            return
-
-        if error_count > 0:
-            result_text = _("system_nodes.done_partial").format(success=success_count, errors=error_count)
-        else:
-            result_text = _("system_nodes.done").format(count=success_count)
+        async def show_progress(report: FanOutReport) -> None:
+            try:
+                await callback.message.edit_text(
+                    _("system_nodes.in_progress").format(done=report.done, total=report.total)
+                )
+            except TelegramAPIError:
+                pass
 
-        await _edit_text_safe(callback.message, result_text, reply_markup=system_nodes_keyboard())
+        # Выполняем операцию для всех нод параллельно
+        report = await fan_out(
+            nodes,
+            lambda node: node_action(node["uuid"]),
+            retries=retries,
+            no_retry=(NotFoundError,),
+            abort_on=(UnauthorizedError,),
+            on_progress=show_progress,
+        )
+        logger.info(
+            "System nodes action=%s: success=%d errors=%d in %.1fs",
+            action, len(report.succeeded), len(report.failed), report.elapsed
+        )
+        await _edit_text_safe(callback.message, _format_fan_out_report(report), reply_markup=system_nodes_keyboard())
     except UnauthorizedError:
         await _edit_text_safe(callback.message, _("errors.unauthorized"), reply_markup=system_nodes_keyboard())
     except ApiClientError:
@@ -4,12 +4,14 @@ from typing import Optional
 
 from aiogram import F, Router
 from aiogram.filters import Command
-from aiogram.types import BufferedInputFile, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from aiogram.utils.i18n import gettext as _
 
-from src.database import BotUser, GiftCode, Payment, Referral
+from src.database import BotUser, Broadcast, GiftCode, Payment, Referral
 from src.services.api_client import NotFoundError, api_client
-from src.utils.i18n import get_i18n
+from src.services.bootstrap_cache import invalidate_user_cache
+from src.services.loyalty_service import resolve_loyalty_status
+from src.utils.i18n import get_i18n, t
 from src.utils.logger import logger
 
 router = Router(name="user_public")
@@ -99,7 +101,7 @@ async def cmd_start(message: Message) -> None:
     username = message.from_user.username
 
     # Получаем или создаем пользователя
-    user = BotUser.get_or_create(user_id, username)
+    user = await BotUser.aio.get_or_create(user_id, username)
     locale = user.get("language", "ru")
     
     # Устанавливаем локализацию
@@ -115,8 +117,8 @@ async def cmd_start(message: Message) -> None:
             try:
                 referrer_id = int(args[0])
                 if referrer_id != user_id:
-                    BotUser.set_referrer(user_id, referrer_id)
-                    Referral.create(referrer_id, user_id)
+                    await BotUser.aio.set_referrer(user_id, referrer_id)
+                    await Referral.aio.create(referrer_id, user_id)
                     welcome_text = _("user.welcome_with_referral")
             except (ValueError, IndexError):
                 # welcome_text уже инициализирован выше
@@ -152,7 +154,7 @@ async def cb_user_menu(callback: CallbackQuery) -> None:
     """Показывает главное меню пользователя."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -170,7 +172,7 @@ async def cb_language(callback: CallbackQuery) -> None:
     """Обработчик выбора языка."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -200,7 +202,7 @@ async def cb_set_language(callback: CallbackQuery) -> None:
     language = callback.data.split(":")[1]
     user_id = callback.from_user.id
     
-    BotUser.update_language(user_id, language)
+    await BotUser.aio.update_language(user_id, language)
     
     i18n = get_i18n()
     with i18n.use_locale(language):
@@ -235,7 +237,7 @@ async def cb_connect(callback: CallbackQuery) -> None:
     """Обработчик 'Подключить доступ'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -281,13 +283,13 @@ async def cb_my_access(callback: CallbackQuery) -> None:
     """Обработчик 'Мой доступ' - показывает статус подписки."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
         # Показываем сообщение "Проверяем статус доступа…"
-        await callback.message.edit_text(_("my_access.checking_status"))
+        await callback.message.edit_text(t("my_access.checking_status", locale))
         
         remnawave_uuid = user.get("remnawave_user_uuid")
         
@@ -295,19 +297,19 @@ async def cb_my_access(callback: CallbackQuery) -> None:
             buttons = [
                 [
                     InlineKeyboardButton(
-                        text=_("user_menu.connect"),
+                        text=t("user_menu.connect", locale),
                         callback_data="user:connect"
                     )
                 ],
                 [
                     InlineKeyboardButton(
-                        text=_("user_menu.back"),
+                        text=t("user_menu.back", locale),
                         callback_data="user:menu"
                     )
                 ]
             ]
             await callback.message.edit_text(
-                _("my_access.no_access"),
+                t("my_access.no_access", locale),
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
             )
             return
@@ -337,10 +339,10 @@ async def cb_my_access(callback: CallbackQuery) -> None:
             traffic_limit = info.get("trafficLimitBytes", 0)
             
             status_text = {
-                "ACTIVE": _("my_access.status_active", locale=locale),
-                "DISABLED": _("my_access.status_disabled", locale=locale),
-                "LIMITED": _("my_access.status_limited", locale=locale),
-                "EXPIRED": _("my_access.status_expired", locale=locale),
+                "ACTIVE": t("my_access.status_active", locale),
+                "DISABLED": t("my_access.status_disabled", locale),
+                "LIMITED": t("my_access.status_limited", locale),
+                "EXPIRED": t("my_access.status_expired", locale),
             }.get(status, status)
             
             expire_text = ""
@@ -354,11 +356,13 @@ async def cb_my_access(callback: CallbackQuery) -> None:
             from src.utils.formatters import format_bytes
             traffic_text = f"{format_bytes(traffic_used)} / {format_bytes(traffic_limit)}"
             
-            text = _("user.subscription_info", locale=locale).format(
+            text = t(
+                "user.subscription_info",
+                locale,
                 status=status_text,
-                expire=expire_text or _("user.no_expire", locale=locale),
+                expire=expire_text or t("user.no_expire", locale),
                 traffic=traffic_text,
-                url=subscription_url or _("user.no_url", locale=locale)
+                url=subscription_url or t("user.no_url", locale)
             )
             
             keyboard_buttons = []
@@ -366,14 +370,14 @@ async def cb_my_access(callback: CallbackQuery) -> None:
             if subscription_url:
                 keyboard_buttons.append([
                     InlineKeyboardButton(
-                        text=_("user.get_config", locale=locale),
+                        text=t("user.get_config", locale),
                         url=subscription_url
                     )
                 ])
             
             keyboard_buttons.append([
                 InlineKeyboardButton(
-                    text=_("user_menu.back", locale=locale),
+                    text=t("user_menu.back", locale),
                     callback_data="user:menu"
                 )
             ])
@@ -387,33 +391,33 @@ async def cb_my_access(callback: CallbackQuery) -> None:
             buttons = [
                 [
                     InlineKeyboardButton(
-                        text=_("user_menu.connect", locale=locale),
+                        text=t("user_menu.connect", locale),
                         callback_data="user:connect"
                     )
                 ],
                 [
                     InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
+                        text=t("user_menu.back", locale),
                         callback_data="user:menu"
                     )
                 ]
             ]
             await callback.message.edit_text(
-                _("my_access.no_access", locale=locale),
+                t("my_access.no_access", locale),
                 reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
             )
         except Exception as e:
             logger.exception(f"Error getting subscription info for user {user_id}, uuid {remnawave_uuid}: {e}")
             error_msg = str(e)
             if "404" in error_msg or "not found" in error_msg.lower():
-                error_text = _("my_access.no_access", locale=locale)
+                error_text = t("my_access.no_access", locale)
             else:
-                error_text = _("errors.generic", locale=locale) + f"\n\nОшибка: {error_msg[:100]}"
+                error_text = t("errors.generic", locale) + f"\n\nОшибка: {error_msg[:100]}"
             
             buttons = [
                 [
                     InlineKeyboardButton(
-                        text=_("user_menu.back", locale=locale),
+                        text=t("user_menu.back", locale),
                         callback_data="user:menu"
                     )
                 ]
@@ -429,9 +433,9 @@ async def cb_settings(callback: CallbackQuery) -> None:
     """Обработчик 'Настройки'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
-    auto_renewal = BotUser.get_auto_renewal(user_id)
+    auto_renewal = await BotUser.aio.get_auto_renewal(user_id)
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
@@ -481,7 +485,7 @@ async def cb_support(callback: CallbackQuery) -> None:
     """Обработчик 'Поддержка'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -523,7 +527,7 @@ async def cb_profile(callback: CallbackQuery) -> None:
     """Обработчик 'Мой профиль' — показывает статус лояльности."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     from src.database import Loyalty
@@ -613,14 +617,14 @@ async def cb_payment_history(callback: CallbackQuery) -> None:
     """Обработчик истории платежей."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
         # Получаем платежи и статистику
-        payments = Payment.get_user_payments(user_id, limit=10)
-        stats = Payment.get_user_stats(user_id)
+        payments = await Payment.aio.get_user_payments(user_id, limit=10)
+        stats = await Payment.aio.get_user_stats(user_id)
         
         if not payments:
             text = f"<b>{_('payment_history.title')}</b>\n\n"
@@ -687,7 +691,7 @@ async def cb_profile_howto(callback: CallbackQuery) -> None:
     """Показывает информацию о системе лояльности."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -712,7 +716,7 @@ async def cb_documents(callback: CallbackQuery) -> None:
     """Обработчик 'Документы'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -754,7 +758,7 @@ async def cb_documents_privacy(callback: CallbackQuery) -> None:
     """Обработчик 'Политика конфиденциальности'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -779,7 +783,7 @@ async def cb_documents_offer(callback: CallbackQuery) -> None:
     """Обработчик 'Публичная оферта'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -804,7 +808,7 @@ async def cb_documents_rules(callback: CallbackQuery) -> None:
     """Обработчик 'Правила использования сервиса'."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -829,7 +833,7 @@ async def cb_subscription(callback: CallbackQuery) -> None:
     """Показывает информацию о подписке пользователя."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -952,7 +956,7 @@ async def cb_trial(callback: CallbackQuery) -> None:
     """Обработчик пробной подписки."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -991,7 +995,7 @@ async def cb_trial_activate(callback: CallbackQuery) -> None:
     """Активация пробной подписки (создаёт пользователя в Remnawave)."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -1067,8 +1071,8 @@ async def cb_trial_activate(callback: CallbackQuery) -> None:
         info = created.get("response", created)
         user_uuid = info.get("uuid")
         if user_uuid:
-            BotUser.set_remnawave_uuid(user_id, user_uuid)
-        BotUser.set_trial_used(user_id)
+            await BotUser.aio.set_remnawave_uuid(user_id, user_uuid)
+        await BotUser.aio.set_trial_used(user_id)
         
         # Начисляем бонус рефереру (если есть)
         from src.services.referral_service import grant_referral_bonus
@@ -1149,23 +1153,23 @@ async def cb_auto_renewal(callback: CallbackQuery) -> None:
     """Обработчик настройки автопродления."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        current_status = BotUser.get_auto_renewal(user_id)
+        current_status = await BotUser.aio.get_auto_renewal(user_id)
         
         if current_status:
             # Выключаем автопродление
-            BotUser.set_auto_renewal(user_id, False)
+            await BotUser.aio.set_auto_renewal(user_id, False)
             status_text = _("settings.auto_renewal_disabled")
         else:
             # Включаем автопродление
-            BotUser.set_auto_renewal(user_id, True)
+            await BotUser.aio.set_auto_renewal(user_id, True)
             status_text = _("settings.auto_renewal_enabled")
         
-        auto_renewal = BotUser.get_auto_renewal(user_id)
+        auto_renewal = await BotUser.aio.get_auto_renewal(user_id)
         auto_renewal_text = _("settings.auto_renewal_on") if auto_renewal else _("settings.auto_renewal_off")
         
         buttons = [
@@ -1200,12 +1204,12 @@ async def cb_auto_renewal_info(callback: CallbackQuery) -> None:
     """Показывает подробную информацию об автопродлении."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        auto_renewal = BotUser.get_auto_renewal(user_id)
+        auto_renewal = await BotUser.aio.get_auto_renewal(user_id)
         auto_renewal_text = _("settings.auto_renewal_on") if auto_renewal else _("settings.auto_renewal_off")
         
         buttons = [
@@ -1235,13 +1239,13 @@ async def cb_referral(callback: CallbackQuery) -> None:
     """Показывает реферальную информацию."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        referrals_count = Referral.get_referrals_count(user_id)
-        bonus_days = Referral.get_bonus_days(user_id)
+        referrals_count = await Referral.aio.get_referrals_count(user_id)
+        bonus_days = await Referral.aio.get_bonus_days(user_id)
         
         # Создаем реферальную ссылку
         try:
@@ -1283,7 +1287,7 @@ async def cb_renew(callback: CallbackQuery) -> None:
     """Обработчик 'Продлить доступ' - создает invoice для продления."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -1299,7 +1303,8 @@ async def cb_renew(callback: CallbackQuery) -> None:
             invoice_link = await create_subscription_invoice(
                 bot=callback.message.bot,
                 user_id=user_id,
-                subscription_months=subscription_months
+                subscription_months=subscription_months,
+                status=resolve_loyalty_status(user_id, user)
             )
             
             buttons = [
@@ -1339,7 +1344,7 @@ async def cb_resume(callback: CallbackQuery) -> None:
     """Обработчик 'Возобновить доступ' после окончания подписки."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -1374,25 +1379,32 @@ async def cb_buy(callback: CallbackQuery) -> None:
     """Обработчик покупки подписки."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
         # Получаем цены с учётом скидки лояльности
-        from src.services.loyalty_service import get_price_with_discount
+        from src.services.loyalty_service import get_prices_with_discount
         
         # Периоды и их названия
         periods = [
-            (1, 30, _("payment.subscription_1month")),
-            (3, 90, _("payment.subscription_3months")),
-            (6, 180, _("payment.subscription_6months")),
-            (12, 365, _("payment.subscription_12months")),
+            (1, 30, t("payment.subscription_1month", locale)),
+            (3, 90, t("payment.subscription_3months", locale)),
+            (6, 180, t("payment.subscription_6months", locale)),
+            (12, 365, t("payment.subscription_12months", locale)),
         ]
         
+        # Статус уже есть в строке пользователя — все цены без обращений к БД
+        prices = get_prices_with_discount(
+            user_id,
+            [days for _months, days, _label in periods],
+            status=resolve_loyalty_status(user_id, user),
+        )
+        
         buttons = []
         for months, days, label in periods:
-            price_info = get_price_with_discount(user_id, days)
+            price_info = prices[days]
             
             if price_info['discount'] > 0:
                 # Есть скидка - показываем её
@@ -1409,13 +1421,13 @@ async def cb_buy(callback: CallbackQuery) -> None:
         
         buttons.append([
                 InlineKeyboardButton(
-                    text=_("user_menu.back"),
+                    text=t("user_menu.back", locale),
                     callback_data="user:connect"
                 )
         ])
         
         await callback.message.edit_text(
-            _("payment.choose_subscription"),
+            t("payment.choose_subscription", locale),
             reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
         )
 
@@ -1425,7 +1437,7 @@ async def cb_buy_subscription(callback: CallbackQuery) -> None:
     """Обрабатывает покупку подписки - показывает ввод промокода или создает invoice."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -1536,7 +1548,7 @@ async def cb_choose_payment_method(callback: CallbackQuery) -> None:
     """Обработчик выбора способа оплаты после выбора тарифа."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -1558,7 +1570,8 @@ async def cb_choose_payment_method(callback: CallbackQuery) -> None:
                 invoice_link = await create_subscription_invoice(
                     bot=callback.message.bot,
                     user_id=user_id,
-                    subscription_months=subscription_months
+                    subscription_months=subscription_months,
+                    status=resolve_loyalty_status(user_id, user)
                 )
                 
                 buttons = [
@@ -1597,7 +1610,8 @@ async def cb_choose_payment_method(callback: CallbackQuery) -> None:
                 payment_data = await create_yookassa_payment(
                     user_id=user_id,
                     subscription_months=subscription_months,
-                    payment_method=payment_method
+                    payment_method=payment_method,
+                    status=resolve_loyalty_status(user_id, user)
                 )
                 
                 payment_url = payment_data["payment_url"]
@@ -1606,9 +1620,8 @@ async def cb_choose_payment_method(callback: CallbackQuery) -> None:
                 qr_data = payment_data.get("qr_data", payment_url)
                 
                 # Генерируем QR-код
-                from src.services.yookassa_service import generate_qr_code_image
-                qr_image = generate_qr_code_image(qr_data)
-                qr_file = BufferedInputFile(qr_image.read(), filename="qr_code.png")
+                from src.services.qr_service import qr_service
+                qr_file = await qr_service.get_photo(qr_data)
                 
                 # Формируем текст сообщения в зависимости от метода оплаты
                 yookassa_payment_id = payment_data.get("payment_id", "")
@@ -1711,7 +1724,7 @@ async def cb_yookassa_pay(callback: CallbackQuery) -> None:
     """Создает платеж YooKassa без промокода."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -1728,7 +1741,8 @@ async def cb_yookassa_pay(callback: CallbackQuery) -> None:
                 payment_data = await create_yookassa_payment(
                     user_id=user_id,
                     subscription_months=subscription_months,
-                    payment_method=payment_method
+                    payment_method=payment_method,
+                    status=resolve_loyalty_status(user_id, user)
                 )
                 
                 payment_url = payment_data["payment_url"]
@@ -1738,9 +1752,8 @@ async def cb_yookassa_pay(callback: CallbackQuery) -> None:
                 yookassa_payment_id = payment_data.get("payment_id", "")
                 
                 # Для СБП показываем QR-код, для карты тоже (из URL)
-                from src.services.yookassa_service import generate_qr_code_image
-                qr_image = generate_qr_code_image(qr_data)
-                qr_file = BufferedInputFile(qr_image.read(), filename="qr_code.png")
+                from src.services.qr_service import qr_service
+                qr_file = await qr_service.get_photo(qr_data)
                 
                 # Формируем текст сообщения в зависимости от метода оплаты
                 if payment_method == "sbp":
@@ -1841,7 +1854,7 @@ async def cb_check_payment_status(callback: CallbackQuery) -> None:
     """Проверяет статус платежа YooKassa."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -1850,7 +1863,7 @@ async def cb_check_payment_status(callback: CallbackQuery) -> None:
         payment_db_id = int(parts[1])
         
         # Получаем платеж из БД
-        payment = Payment.get(payment_db_id)
+        payment = await Payment.aio.get(payment_db_id)
         if not payment:
             i18n = get_i18n()
             with i18n.use_locale(locale):
@@ -1933,7 +1946,7 @@ async def cb_check_payment_status(callback: CallbackQuery) -> None:
             with i18n.use_locale(locale):
                 if status == "succeeded" and paid:
                     # Платеж успешен - обрабатываем его
-                    result = await process_yookassa_payment(yookassa_payment_id, callback.message.bot)
+                    result = await process_yookassa_payment(yookassa_payment_id, callback.message.bot, verified=True)
                     
                     if result.get("success"):
                         buttons = []
@@ -2092,7 +2105,7 @@ async def cb_gift_menu(callback: CallbackQuery) -> None:
     """Меню подарочных подписок."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -2137,7 +2150,7 @@ async def cb_gift_buy(callback: CallbackQuery) -> None:
     """Выбор срока подарочной подписки."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -2191,7 +2204,7 @@ async def cb_gift_period(callback: CallbackQuery) -> None:
     """Выбор способа оплаты для подарка."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -2261,7 +2274,7 @@ async def cb_gift_pay(callback: CallbackQuery) -> None:
     """Обработка оплаты подарочной подписки."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -2331,13 +2344,15 @@ async def cb_gift_pay(callback: CallbackQuery) -> None:
         
         elif payment_method in ("sbp", "card"):
             # Создаем платеж через YooKassa для подарка
-            from src.services.yookassa_service import create_yookassa_gift_payment, generate_qr_code_image
+            from src.services.qr_service import qr_service
+            from src.services.yookassa_service import create_yookassa_gift_payment
             
             try:
                 payment_data = await create_yookassa_gift_payment(
                     user_id=user_id,
                     subscription_months=months,
-                    payment_method=payment_method
+                    payment_method=payment_method,
+                    status=resolve_loyalty_status(user_id, user)
                 )
                 
                 payment_url = payment_data["payment_url"]
@@ -2347,8 +2362,7 @@ async def cb_gift_pay(callback: CallbackQuery) -> None:
                 yookassa_payment_id = payment_data.get("payment_id", "")
                 
                 # Генерируем QR-код
-                qr_image = generate_qr_code_image(qr_data)
-                qr_file = BufferedInputFile(qr_image.read(), filename="qr_code.png")
+                qr_file = await qr_service.get_photo(qr_data)
                 
                 if payment_method == "sbp":
                     payment_text = _("payment.yookassa_invoice_created_with_qr").format(
@@ -2413,7 +2427,7 @@ async def cb_check_gift_payment_status(callback: CallbackQuery) -> None:
     """Проверяет статус подарочного платежа YooKassa."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     try:
@@ -2424,7 +2438,7 @@ async def cb_check_gift_payment_status(callback: CallbackQuery) -> None:
     i18n = get_i18n()
     with i18n.use_locale(locale):
         # Получаем платеж из БД
-        payment = Payment.get(payment_db_id)
+        payment = await Payment.aio.get(payment_db_id)
         
         if not payment:
             await _safe_edit_or_send(
@@ -2490,7 +2504,7 @@ async def cb_check_gift_payment_status(callback: CallbackQuery) -> None:
             
             if status == "succeeded" and yookassa_status.get("paid"):
                 # Обрабатываем успешный платеж
-                result = await process_yookassa_gift_payment(yookassa_payment_id, callback.message.bot)
+                result = await process_yookassa_gift_payment(yookassa_payment_id, callback.message.bot, verified=True)
                 
                 if result.get("success"):
                     gift_code = result.get("gift_code", "")
@@ -2604,12 +2618,12 @@ async def cb_gift_my(callback: CallbackQuery) -> None:
     """Показать мои подарочные коды."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        gifts = GiftCode.get_user_gifts(user_id)
+        gifts = await GiftCode.aio.get_user_gifts(user_id)
         
         if not gifts:
             text = _("gift.my_gifts_empty")
@@ -2655,7 +2669,7 @@ async def cb_gift_activate(callback: CallbackQuery) -> None:
     """Начало активации подарочного кода."""
     await callback.answer()
     user_id = callback.from_user.id
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -2686,7 +2700,7 @@ async def cb_gift_activate(callback: CallbackQuery) -> None:
 async def msg_activate_gift_code(message: Message) -> None:
     """Обработка ввода подарочного кода."""
     user_id = message.from_user.id
-    user = BotUser.get_or_create(user_id, message.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, message.from_user.username)
     locale = user.get("language", "ru")
     
     code = message.text.strip().upper()
@@ -2694,7 +2708,7 @@ async def msg_activate_gift_code(message: Message) -> None:
     i18n = get_i18n()
     with i18n.use_locale(locale):
         # Проверяем код
-        gift = GiftCode.get_by_code(code)
+        gift = await GiftCode.aio.get_by_code(code)
         
         if not gift:
             await message.answer(
@@ -2768,7 +2782,9 @@ async def msg_activate_gift_code(message: Message) -> None:
                         await api_client.update_user(existing_uuid, expireAt=expire_str)
                         
                         # Отмечаем код как использованный
-                        GiftCode.activate(code, user_id, existing_uuid)
+                        await GiftCode.aio.activate(code, user_id, existing_uuid)
+                        invalidate_user_cache(user_id)
+                        invalidate_user_cache(gift.get("buyer_id"))
                         
                         await message.answer(
                             _("gift.activation_success").format(expire_date=expire_str[:10]),
@@ -2810,8 +2826,10 @@ async def msg_activate_gift_code(message: Message) -> None:
             result_data = result.get("response", result) if result else {}
             if result_data and result_data.get("uuid"):
                 new_uuid = result_data["uuid"]
-                BotUser.set_remnawave_uuid(user_id, new_uuid)
-                GiftCode.activate(code, user_id, new_uuid)
+                await BotUser.aio.set_remnawave_uuid(user_id, new_uuid)
+                await GiftCode.aio.activate(code, user_id, new_uuid)
+                invalidate_user_cache(user_id)
+                invalidate_user_cache(gift.get("buyer_id"))
                 
                 # На всякий случай применяем сквады через update
                 if settings.default_external_squad_uuid or internal_squads:
@@ -2910,6 +2928,18 @@ def _broadcast_confirm_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+def _broadcast_source(message: Message, text: Optional[str]) -> tuple[Optional[int], Optional[int]]:
+    """
+    Исходное сообщение админа для рассылки через copy_message.
+
+    Если в тексте HTML-разметка, набранная вручную, сообщение отправляется
+    заново с parse_mode=HTML, иначе копируется (с форматированием Telegram).
+    """
+    if text and "<" in text:
+        return None, None
+    return message.chat.id, message.message_id
+
+
 def _is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь админом."""
     from src.utils.auth import is_admin
@@ -2925,7 +2955,7 @@ async def cb_broadcast_menu(callback: CallbackQuery) -> None:
     if not _is_admin(user_id):
         return
     
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     i18n = get_i18n()
@@ -2934,7 +2964,7 @@ async def cb_broadcast_menu(callback: CallbackQuery) -> None:
         BROADCAST_DATA.pop(user_id, None)
         clear_user_state(user_id)
         
-        user_counts = BotUser.get_user_count()
+        user_counts = await BotUser.aio.get_user_count()
         text = f"<b>{_('broadcast.title')}</b>\n\n{_('broadcast.select_target')}"
         
         await _safe_edit_or_send(
@@ -2954,7 +2984,7 @@ async def cb_broadcast_target(callback: CallbackQuery) -> None:
     if not _is_admin(user_id):
         return
     
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     target_type = callback.data.split(":")[-1]
     
@@ -2986,7 +3016,7 @@ async def cb_broadcast_cancel(callback: CallbackQuery) -> None:
     if not _is_admin(user_id):
         return
     
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     
     clear_user_state(user_id)
@@ -2994,7 +3024,7 @@ async def cb_broadcast_cancel(callback: CallbackQuery) -> None:
     
     i18n = get_i18n()
     with i18n.use_locale(locale):
-        user_counts = BotUser.get_user_count()
+        user_counts = await BotUser.aio.get_user_count()
         await _safe_edit_or_send(
             callback,
             _("broadcast.cancelled"),
@@ -3012,7 +3042,7 @@ async def cb_broadcast_test(callback: CallbackQuery) -> None:
     if not _is_admin(user_id):
         return
     
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     data = BROADCAST_DATA.get(user_id, {})
     
@@ -3074,7 +3104,7 @@ async def cb_broadcast_confirm(callback: CallbackQuery) -> None:
     if not _is_admin(user_id):
         return
     
-    user = BotUser.get_or_create(user_id, callback.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, callback.from_user.username)
     locale = user.get("language", "ru")
     data = BROADCAST_DATA.get(user_id, {})
     
@@ -3084,87 +3114,52 @@ async def cb_broadcast_confirm(callback: CallbackQuery) -> None:
             await callback.answer(_("broadcast.no_message"), show_alert=True)
             return
         
-        target_type = data.get('target_type', 'all')
-        message_text = data.get('message_text', '')
-        photo_id = data.get('photo_id')
-        
-        # Получаем список получателей
-        if target_type == 'all':
-            recipients = BotUser.get_all_user_ids()
-        elif target_type == 'active':
-            recipients = BotUser.get_users_with_subscription()
-        else:
-            recipients = BotUser.get_users_without_subscription()
-        
-        total = len(recipients)
-        sent = 0
-        errors = 0
+        source = data.get('source') or (None, None)
+        job_id = await Broadcast.aio.create(
+            admin_id=user_id,
+            target_type=data.get('target_type', 'all'),
+            message_text=data.get('message_text', ''),
+            photo_id=data.get('photo_id'),
+            source_chat_id=source[0],
+            source_message_id=source[1],
+            locale=locale
+        )
+        job = await Broadcast.aio.get(job_id)
         
         # Очищаем состояние
         clear_user_state(user_id)
         BROADCAST_DATA.pop(user_id, None)
         
-        # Обновляем сообщение на статус отправки
-        status_msg = await callback.message.edit_text(
-            _("broadcast.sending").format(sent=0, total=total),
-            parse_mode="HTML"
-        )
-        
-        bot = callback.message.bot
-        
-        import asyncio
-        # Отправляем сообщения с задержкой
-        for i, recipient_id in enumerate(recipients):
-            try:
-                if photo_id:
-                    await bot.send_photo(
-                        chat_id=recipient_id,
-                        photo=photo_id,
-                        caption=message_text,
-                        parse_mode="HTML"
-                    )
-                else:
-                    await bot.send_message(
-                        chat_id=recipient_id,
-                        text=message_text,
-                        parse_mode="HTML"
-                    )
-                sent += 1
-            except Exception as e:
-                errors += 1
-                logger.debug(f"Broadcast error for user {recipient_id}: {e}")
-            
-            # Обновляем статус каждые 10 сообщений
-            if (i + 1) % 10 == 0:
-                try:
-                    await status_msg.edit_text(
-                        _("broadcast.sending").format(sent=sent, total=total),
-                        parse_mode="HTML"
-                    )
-                except Exception:
-                    pass
-            
-            # Задержка между сообщениями
-            await asyncio.sleep(0.05)
-        
-        result_text = _("broadcast.completed").format(
-            sent=sent,
-            errors=errors,
-            total=total
-        )
-        
+        # Прогресс показывается в этом сообщении, рассылка идёт в фоне и переживает перезапуск
+        status_text = _("broadcast.sending").format(sent=0, total=job['total'])
+        stop_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=_("broadcast.btn_stop"), callback_data=f"broadcast:stop:{job_id}")]
+        ])
         try:
-            await status_msg.edit_text(
-                result_text,
-                reply_markup=_get_user_menu_keyboard(user_id),
-                parse_mode="HTML"
-            )
+            status_msg = await callback.message.edit_text(status_text, reply_markup=stop_keyboard, parse_mode="HTML")
         except Exception:
-            await callback.message.answer(
-                result_text,
-                reply_markup=_get_user_menu_keyboard(user_id),
-                parse_mode="HTML"
-            )
+            # Превью с фото нельзя превратить в текстовое сообщение
+            status_msg = await callback.message.answer(status_text, reply_markup=stop_keyboard, parse_mode="HTML")
+        if isinstance(status_msg, Message):
+            await Broadcast.aio.set_status_message(job_id, status_msg.chat.id, status_msg.message_id)
+        
+        from src.services.broadcast_service import broadcast_engine
+        broadcast_engine.start_job(callback.message.bot, job_id)
+
+
+@router.callback_query(F.data.startswith("broadcast:stop:"))
+async def cb_broadcast_stop(callback: CallbackQuery) -> None:
+    """Остановка запущенной рассылки."""
+    user_id = callback.from_user.id
+    
+    if not _is_admin(user_id):
+        await callback.answer()
+        return
+    
+    from src.services.broadcast_service import broadcast_engine
+    job_id = int(callback.data.split(":")[-1])
+    broadcast_engine.cancel(job_id)
+    await callback.answer()
 
 
 @router.message(F.photo)
@@ -3182,12 +3177,13 @@ async def msg_broadcast_photo(message: Message) -> None:
     if user_id not in BROADCAST_DATA:
         return
     
-    user = BotUser.get_or_create(user_id, message.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, message.from_user.username)
     locale = user.get("language", "ru")
     
     # Сохраняем фото и подпись
     BROADCAST_DATA[user_id]['photo_id'] = message.photo[-1].file_id
     BROADCAST_DATA[user_id]['message_text'] = message.caption or ""
+    BROADCAST_DATA[user_id]['source'] = _broadcast_source(message, message.caption)
     
     # Показываем превью
     i18n = get_i18n()
@@ -3214,11 +3210,12 @@ async def msg_broadcast_text(message: Message) -> None:
     if message.text.startswith('/'):
         return
     
-    user = BotUser.get_or_create(user_id, message.from_user.username)
+    user = await BotUser.aio.get_or_create(user_id, message.from_user.username)
     locale = user.get("language", "ru")
     
     # Сохраняем текст
     BROADCAST_DATA[user_id]['message_text'] = message.text
+    BROADCAST_DATA[user_id]['source'] = _broadcast_source(message, message.text)
     
     # Показываем превью
     i18n = get_i18n()
@@ -3241,11 +3238,11 @@ async def _show_broadcast_preview(message: Message, admin_id: int) -> None:
     
     # Получаем количество получателей
     if target_type == 'all':
-        recipients = BotUser.get_all_user_ids()
+        recipients = await BotUser.aio.get_all_user_ids()
     elif target_type == 'active':
-        recipients = BotUser.get_users_with_subscription()
+        recipients = await BotUser.aio.get_users_with_subscription()
     else:
-        recipients = BotUser.get_users_without_subscription()
+        recipients = await BotUser.aio.get_users_without_subscription()
     
     count = len(recipients)
     
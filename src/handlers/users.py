@@ -33,6 +33,7 @@ from src.keyboards.user_create import (
 from src.keyboards.user_stats import user_stats_keyboard
 from src.keyboards.hwid_devices import hwid_devices_keyboard
 from src.services.api_client import ApiClientError, NotFoundError, UnauthorizedError, api_client
+from src.services.user_index_service import forget_users, search_users
 from src.utils.formatters import (
     _esc,
     build_created_user,
@@ -122,25 +123,28 @@ async def _fetch_user(query: str) -> dict:
 
 
 async def _search_users(query: str) -> list[dict]:
-    """Ищет пользователей по запросу."""
+    """Ищет пользователей по запросу (через локальный индекс, пока он не готов — обходом панели)."""
     search_term = query.strip()
     if not search_term:
         return []
+    indexed = await search_users(search_term)
+    if indexed is not None:
+        if len(indexed) == 1 and indexed[0].get("uuid"):
+            # Единственный результат сразу открывается карточкой — берём актуальные данные из панели
+            try:
+                return [await api_client.get_user_by_uuid(indexed[0]["uuid"])]
+            except NotFoundError:
+                await forget_users([indexed[0]["uuid"]])
+                return []
+        return indexed
     normalized = search_term.lower()
-    matches: list[dict] = []
-    start = 0
-    while True:
-        data = await api_client.get_users(start=start, size=SEARCH_PAGE_SIZE)
-        payload = data.get("response", data)
-        users = payload.get("users") or []
-        total = payload.get("total", len(users))
-        for user in users:
-            if _user_matches_query(user, normalized):
-                matches.append(user)
-        start += SEARCH_PAGE_SIZE
-        if start >= total or not users:
-            break
-    return matches
+    # Столько же совпадений, сколько отдаёт поиск по индексу
+    return [
+        user
+        async for user in api_client.iter_users(
+            page_size=SEARCH_PAGE_SIZE, where=lambda user: _user_matches_query(user, normalized), limit=200
+        )
+    ]
 
 
 async def _send_user_detail(
@@ -2,15 +2,19 @@ import asyncio
 import sys
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from src.config import get_settings
 from src.services.api_client import api_client
+from src.services.yookassa_client import yookassa_client
 from src.utils.auth import AdminMiddleware
+from src.utils.fsm_storage import SQLiteStorage
 from src.utils.i18n import get_i18n_middleware
 from src.utils.logger import logger
+from src.utils.metrics import start_loop_lag_monitor
+from src.utils.metrics_middleware import MetricsMiddleware
+from src.utils.state_middleware import StatePrefetchMiddleware
 from src.handlers import register_handlers
-from src.database import init_database
+from src.database import close_database, init_database
 
 
 async def check_api_connection() -> bool:
@@ -93,8 +97,8 @@ async def main() -> None:
         logger.warning("📢 Notifications disabled: NOTIFICATIONS_CHAT_ID not set or invalid")
 
     # Инициализируем базу данных
-    init_database()
-    logger.info("✅ Database initialized")
+    applied_migrations = init_database()
+    logger.info("✅ Database initialized (applied migrations: %s)", applied_migrations or "none")
     
     # Проверяем подключение к API перед стартом
     if not await check_api_connection():
@@ -107,9 +111,16 @@ async def main() -> None:
 
     # parse_mode is left as default (None) to avoid HTML parsing issues with plain text translations
     bot = Bot(token=settings.bot_token)
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=SQLiteStorage())
 
     # middlewares
+    # Состояние диалогов пользователя подгружается из SQLite до фильтров и обработчиков
+    dp.message.outer_middleware(StatePrefetchMiddleware())
+    dp.callback_query.outer_middleware(StatePrefetchMiddleware())
+    # Метрики — первыми, чтобы учитывать время остальных middleware
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+    dp.pre_checkout_query.middleware(MetricsMiddleware())
     # Сначала проверка администратора (блокирует неавторизованных пользователей)
     dp.message.middleware(AdminMiddleware())
     dp.callback_query.middleware(AdminMiddleware())
@@ -119,25 +130,75 @@ async def main() -> None:
 
     register_handlers(dp)
     dp.shutdown.register(api_client.close)
+    dp.shutdown.register(yookassa_client.close)
+
+    # Очередь уведомлений: отправка в фоне, недоставленные критичные — из БД
+    from src.services.notification_outbox import notification_outbox
+    await notification_outbox.start(bot)
 
     # Запускаем фоновую задачу для проверки автопродления
     from src.services.renewal_service import start_renewal_checker
-    renewal_task = asyncio.create_task(start_renewal_checker(bot, interval_hours=6))
-    logger.info("🔄 Renewal checker started (interval: 6 hours)")
+    renewal_rescan = int(os.getenv('RENEWAL_RESCAN_MINUTES', '30'))
+    renewal_task = asyncio.create_task(start_renewal_checker(bot, rescan_minutes=renewal_rescan))
+    logger.info("🔄 Renewal checker started (rescan: %d minutes)", renewal_rescan)
+
+    # Запускаем синхронизацию локального индекса пользователей панели (поиск в админке)
+    from src.services.user_index_service import start_user_index_sync
+    user_index_interval = int(os.getenv('USER_INDEX_SYNC_MINUTES', '15'))
+    user_index_task = asyncio.create_task(start_user_index_sync(interval_minutes=user_index_interval))
+
+    # Держим прогретым снимок статистики для главного меню
+    from src.services.dashboard_service import REFRESH_INTERVAL, start_dashboard_refresher
+    dashboard_task = asyncio.create_task(start_dashboard_refresher(REFRESH_INTERVAL))
+
+    # Фоновая проверка платежей YooKassa, статус которых ждёт Mini App
+    from src.services.payment_status_hub import start_payment_status_reconciler
+    payment_status_task = asyncio.create_task(start_payment_status_reconciler(bot))
+
+    # Сверка зависших платежей YooKassa (пропущенный вебхук)
+    from src.services.payment_reconciler import start_payment_reconciler
+    reconciler_task = asyncio.create_task(start_payment_reconciler(bot))
+
+    # Сохранённое состояние диалогов и отложенная запись изменений в SQLite
+    from src.utils.state_store import load_all, start_state_flusher
+    await load_all()
+    state_task = asyncio.create_task(start_state_flusher())
+
+    # Задержка event loop для /metrics
+    loop_lag_task = asyncio.create_task(start_loop_lag_monitor())
+
+    # Продолжаем рассылки, прерванные перезапуском
+    from src.services.broadcast_service import broadcast_engine
+    await broadcast_engine.resume(bot)
+
+    # Webhook-режим: обновления принимает тот же HTTP сервер, что и Mini App
+    webhook_url = os.getenv('WEBHOOK_URL', '').rstrip('/')
+    update_dispatcher = None
+    if webhook_url:
+        from src.webapp.webhook import UpdateDispatcher
+        update_dispatcher = UpdateDispatcher(dp, bot, secret_token=os.getenv('WEBHOOK_SECRET') or None)
 
     # Запускаем Mini App API сервер
     webapp_server = None
     webapp_port = int(os.getenv('WEBAPP_PORT', '8080'))
-    if os.getenv('WEBAPP_ENABLED', 'false').lower() == 'true':
+    if update_dispatcher or os.getenv('WEBAPP_ENABLED', 'false').lower() == 'true':
         try:
             from src.webapp.server import start_webapp_server
-            webapp_server = await start_webapp_server(settings.bot_token, bot, webapp_port)
+            webapp_server = await start_webapp_server(settings.bot_token, bot, webapp_port, webhook=update_dispatcher)
         except Exception as e:
             logger.error(f"Failed to start Mini App server: {e}")
 
     logger.info("Starting bot")
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if update_dispatcher and webapp_server:
+            from src.webapp.webhook import run_webhook
+            await run_webhook(update_dispatcher, webhook_url + update_dispatcher.path)
+        else:
+            if update_dispatcher:
+                logger.warning("Webhook server is not running, falling back to long polling")
+            # Polling не работает, пока у бота установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
         # Отменяем фоновую задачу при остановке
         renewal_task.cancel()
@@ -145,11 +206,54 @@ async def main() -> None:
             await renewal_task
         except asyncio.CancelledError:
             logger.info("🔄 Renewal checker stopped")
+        user_index_task.cancel()
+        try:
+            await user_index_task
+        except asyncio.CancelledError:
+            logger.info("🔎 Panel user index sync stopped")
+        dashboard_task.cancel()
+        try:
+            await dashboard_task
+        except asyncio.CancelledError:
+            logger.info("📊 Dashboard refresher stopped")
+        payment_status_task.cancel()
+        try:
+            await payment_status_task
+        except asyncio.CancelledError:
+            pass
+        reconciler_task.cancel()
+        try:
+            await reconciler_task
+        except asyncio.CancelledError:
+            logger.info("💳 Payment reconciler stopped")
+        loop_lag_task.cancel()
+        try:
+            await loop_lag_task
+        except asyncio.CancelledError:
+            pass
+        await broadcast_engine.stop()
+        
+        # Останавливаем процессы рендера QR-кодов
+        from src.services.qr_service import qr_service
+        qr_service.close()
         
         # Останавливаем Mini App сервер
         if webapp_server:
             from src.webapp.server import stop_webapp_server
             await stop_webapp_server()
+        
+        # Дописываем очередь уведомлений (неотправленные критичные останутся в БД)
+        await notification_outbox.stop()
+        
+        # Сохраняем состояние диалогов до закрытия БД
+        state_task.cancel()
+        try:
+            await state_task
+        except asyncio.CancelledError:
+            logger.info("💾 Dialog state saved")
+
+        # Закрываем пул соединений с БД
+        await close_database()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+"""TTL-кеш ответов Remnawave API с объединением одинаковых запросов (single-flight)."""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+
+
+class ResponseCache:
+    """
+    Кеш ответов GET по ключу (обычно — путь запроса).
+
+    Пока значение не устарело, оно отдаётся из кеша. Если ключ уже
+    запрашивается, остальные вызовы ждут этот же запрос, а не отправляют свой.
+    invalidate() удаляет записи по префиксу и не даёт сохранить ответ
+    запроса, начатого до инвалидации. Устаревшие записи остаются до
+    перезаписи: get_stale() отдаёт их, когда панель недоступна.
+    """
+
+    def __init__(self) -> None:
+        self._entries: dict[str, tuple[float, Any, float]] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+
+    async def get_or_fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        # Ошибку заберут ожидающие; если их нет — не пишем "exception was never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.set_exception(RuntimeError(f"Request for {key} was cancelled"))
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            if generation == self._generation:
+                now = time.monotonic()
+                self._entries[key] = (now + ttl, value, now)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def get_stale(self, key: str, max_age: float) -> tuple[bool, Any]:
+        """Последнее сохранённое значение не старше max_age секунд, даже если TTL истёк."""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[2] > max_age:
+            return False, None
+        self.stale_hits += 1
+        return True, entry[1]
+
+    def invalidate(self, *prefixes: str) -> None:
+        """Удаляет записи, ключи которых начинаются с одного из префиксов."""
+        self._generation += 1
+        self.invalidations += 1
+        for key in [key for key in self._entries if key.startswith(prefixes)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Счётчики попаданий/промахов для мониторинга."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "stale_hits": self.stale_hits,
+            "entries": len(self._entries),
+        }
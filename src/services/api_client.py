@@ -1,10 +1,93 @@
 import asyncio
+import functools
+import inspect
+import os
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
 
 import httpx
 from httpx import HTTPStatusError
 
 from src.config import get_settings
+from src.services.api_cache import ResponseCache
+from src.services.api_resilience import CircuitBreaker, RetryBudget, decorrelated_jitter
 from src.utils.logger import logger
+from src.utils.metrics import API_DURATION, API_RETRIES, current_api_method
+
+# Время жизни кешированных ответов (секунды) для справочников, которые
+# запрашиваются при каждой отрисовке меню
+CACHE_TTLS = {
+    "/api/system/stats": 10,
+    "/api/system/health": 10,
+    "/api/system/stats/bandwidth": 30,
+    "/api/nodes": 15,
+    "/api/hosts": 30,
+    "/api/internal-squads": 300,
+    "/api/external-squads": 300,
+    "/api/config-profiles": 300,
+}
+CACHE_ENABLED = os.getenv("API_CACHE_ENABLED", "true").lower() == "true"
+
+# Что сбрасывать после изменений
+NODES_CACHE = ("/api/nodes", "/api/system")
+HOSTS_CACHE = ("/api/hosts",)
+USERS_CACHE = ("/api/system",)
+# Не кешируются, но их количество показывает снимок дашборда
+RESOURCES_CACHE = ("/api/tokens", "/api/subscription-templates", "/api/snippets")
+# Сколько секунд отдавать устаревший кеш, пока панель недоступна
+STALE_MAX_AGE = float(os.getenv("API_STALE_MAX_AGE", "600"))
+
+# Классы таймаутов: сколько ждать ответа (секунды) для разных эндпоинтов
+TIMEOUT_CLASSES = {
+    "fast": httpx.Timeout(float(os.getenv("API_TIMEOUT_FAST", "5")), connect=5.0, pool=5.0),
+    "default": httpx.Timeout(float(os.getenv("API_TIMEOUT_DEFAULT", "15")), connect=10.0, pool=10.0),
+    "slow": httpx.Timeout(float(os.getenv("API_TIMEOUT_SLOW", "60")), connect=10.0, pool=10.0),
+}
+# Префикс пути -> класс таймаута; остальные эндпоинты — "default"
+ENDPOINT_TIMEOUTS = (
+    ("/api/system/", "fast"),
+    ("/api/users/bulk/", "slow"),
+    ("/api/hosts/bulk/", "slow"),
+    ("/api/nodes/bulk-actions/", "slow"),
+    ("/api/internal-squads", "slow"),
+    ("/api/external-squads", "slow"),
+    ("/api/bandwidth-stats/", "slow"),
+)
+
+# Повторы: сколько попыток, в какие сроки и после каких ответов
+MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", "3"))
+# Повтор не начинается, если с начала запроса прошло бы больше этого (секунды)
+REQUEST_DEADLINE = float(os.getenv("API_REQUEST_DEADLINE", "30"))
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 5.0
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ("GET", "PUT", "PATCH", "DELETE")
+# Запрос не дошёл до панели — безопасно повторить любой метод
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# Circuit breaker: после скольких неудач подряд перестать ходить в панель и на сколько
+CIRCUIT_FAILURES = int(os.getenv("API_CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("API_CIRCUIT_RESET_SECONDS", "30"))
+
+
+def _timeout_class(url: str) -> str:
+    for prefix, name in ENDPOINT_TIMEOUTS:
+        if url.startswith(prefix):
+            return name
+    return "default"
+
+
+def invalidates(*prefixes: str):
+    """Сбрасывает кешированные ответы по префиксам после успешного изменяющего запроса."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            result = await func(self, *args, **kwargs)
+            self.invalidate_cache(*prefixes)
+            return result
+        return wrapper
+    return decorator
 
 
 class ApiClientError(Exception):
@@ -19,29 +102,106 @@ class UnauthorizedError(ApiClientError):
     """401 error."""
 
 
+class PanelUnavailableError(ApiClientError):
+    """Панель не отвечает: цепь разомкнута или повторы исчерпаны."""
+
+
+def _status_label(exc: BaseException) -> str:
+    """Метка статуса для метрик: HTTP-код, если он известен."""
+    if isinstance(exc, UnauthorizedError):
+        return "401"
+    if isinstance(exc, NotFoundError):
+        return "404"
+    if isinstance(exc, PanelUnavailableError) and exc.__cause__ is None:
+        return "circuit_open"
+    if isinstance(exc.__cause__, HTTPStatusError):
+        return str(exc.__cause__.response.status_code)
+    if isinstance(exc, asyncio.CancelledError):
+        return "cancelled"
+    return "error"
+
+
+def measured(func):
+    """Записывает длительность и статус вызова метода клиента в метрики."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        token = current_api_method.set(name)
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await func(self, *args, **kwargs)
+        except BaseException as exc:
+            status = _status_label(exc)
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, method=name, status=status)
+            current_api_method.reset(token)
+    return wrapper
+
+
 class RemnawaveApiClient:
     def __init__(self) -> None:
         self.settings = get_settings()
-        # Увеличиваем таймауты для стабильности соединения
-        # connect - таймаут на установку соединения
-        # read - таймаут на чтение ответа
-        # write - таймаут на отправку запроса
-        # pool - таймаут на получение соединения из пула
-        timeout_config = httpx.Timeout(
-            connect=15.0,  # Увеличен с 20 до 15 для connect
-            read=30.0,     # Увеличен до 30 для read
-            write=15.0,    # Таймаут на запись
-            pool=10.0      # Таймаут на получение из пула
-        )
         # Убираем завершающий слеш из base_url, чтобы избежать двойного слеша при объединении с URL
         base_url = str(self.settings.api_base_url).rstrip("/")
         self._client = httpx.AsyncClient(
             base_url=base_url,
             headers=self._build_headers(),
-            timeout=timeout_config,
+            timeout=TIMEOUT_CLASSES["default"],
             limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
             follow_redirects=True,  # Автоматически следовать редиректам (HTTP -> HTTPS)
         )
+        self.cache = ResponseCache()
+        self._breaker = CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_RESET_SECONDS)
+        self._retry_budget = RetryBudget()
+
+    async def _cached(self, url: str, fetch) -> dict:
+        """
+        GET через TTL-кеш: одинаковые одновременные запросы объединяются в один.
+        Если панель недоступна, отдаётся последний ответ не старше STALE_MAX_AGE.
+        """
+        if not CACHE_ENABLED:
+            return await fetch()
+        try:
+            return await self.cache.get_or_fetch(url, CACHE_TTLS[url], fetch)
+        except PanelUnavailableError:
+            found, value = self.cache.get_stale(url, STALE_MAX_AGE)
+            if not found:
+                raise
+            logger.warning("Remnawave API unavailable, serving stale cached %s", url)
+            return value
+
+    def invalidate_cache(self, *prefixes: str) -> None:
+        """Сбрасывает кеш после изменений (ноды, хосты, пользователи)."""
+        self.cache.invalidate(*prefixes)
+
+    def cache_stats(self) -> dict:
+        return self.cache.stats()
+
+    def resilience_stats(self) -> dict:
+        """Состояние circuit breaker и бюджета повторов для мониторинга."""
+        stats = self._breaker.stats()
+        stats["retry_budget"] = self._retry_budget.tokens
+        stats["retry_budget_exhausted"] = self._retry_budget.exhausted
+        return stats
+
+    @staticmethod
+    async def _remember_user(result: dict) -> dict:
+        """Обновляет локальный индекс пользователей ответом панели."""
+        from src.services.user_index_service import remember_users
+
+        await remember_users(result)
+        return result
+
+    @staticmethod
+    def _request_index_refresh(result: dict) -> dict:
+        """Просит пересинхронизировать индекс после массовой операции."""
+        from src.services.user_index_service import request_refresh
+
+        request_refresh()
+        return result
 
     def _build_headers(self) -> dict[str, str]:
         headers = {"Content-Type": "application/json"}
@@ -49,18 +209,38 @@ class RemnawaveApiClient:
             headers["Authorization"] = f"Bearer {self.settings.api_token}"
         return headers
 
-    async def _get(self, url: str, max_retries: int = 3) -> dict:
-        """Выполняет GET запрос с retry для сетевых ошибок."""
+    async def _request(self, method: str, url: str, json: dict | None = None, max_retries: int = MAX_RETRIES) -> dict:
+        """
+        Единый исполнитель запросов к панели.
+
+        Таймаут берётся из класса эндпоинта (ENDPOINT_TIMEOUTS). Сетевые ошибки
+        и ответы 502/503/504 повторяются с decorrelated jitter, пока есть
+        попытки, общий бюджет повторов и время до REQUEST_DEADLINE. POST после
+        отправки не повторяется: панель могла его уже выполнить. Пока цепь
+        разомкнута, запрос сразу завершается PanelUnavailableError.
+        """
         full_url = f"{self._client.base_url}{url}"
+        timeout = TIMEOUT_CLASSES[_timeout_class(url)]
+        idempotent = method in IDEMPOTENT_METHODS
+        started = time.monotonic()
+        delay = RETRY_BASE_DELAY
         last_exc = None
-        for attempt in range(max_retries):
+        self._retry_budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            if not self._breaker.allow():
+                raise PanelUnavailableError(f"Remnawave API is unavailable, {method} {url} rejected") from last_exc
             try:
-                logger.debug("GET request to %s (attempt %d/%d)", full_url, attempt + 1, max_retries)
-                response = await self._client.get(url)
+                logger.debug("%s request to %s (attempt %d/%d)", method, full_url, attempt, max_retries)
+                response = await self._client.request(method, url, json=json, timeout=timeout)
                 response.raise_for_status()
-                return response.json()
             except HTTPStatusError as exc:
                 status = exc.response.status_code
+                if status >= 500:
+                    self._breaker.record_failure()
+                else:
+                    self._breaker.record_success()
                 if status in (401, 403):
                     raise UnauthorizedError from exc
                 if status == 404:
@@ -74,115 +254,53 @@ class RemnawaveApiClient:
                         "Current: %s -> Should be: %s",
                         full_url, https_url
                     )
-                logger.warning("API error %s on GET %s: %s", status, full_url, exc.response.text)
-                raise ApiClientError from exc
-            except (httpx.RemoteProtocolError, httpx.ConnectError, httpx.ReadTimeout) as exc:
+                logger.warning("API error %s on %s %s: %s", status, method, full_url, exc.response.text)
+                if status not in RETRY_STATUSES or not idempotent:
+                    raise ApiClientError from exc
                 last_exc = exc
-                error_type = type(exc).__name__
-                if attempt < max_retries - 1:
-                    delay = 0.5 * (2 ** attempt)  # Экспоненциальная задержка: 0.5s, 1s, 2s
-                    logger.warning(
-                        "HTTP client error on GET %s: %s (%s), retrying in %.1fs (attempt %d/%d)",
-                        full_url, exc, error_type, delay, attempt + 1, max_retries
-                    )
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(
-                        "HTTP client error on GET %s: %s (%s) - max retries reached. "
-                        "Server may be overloaded or network unstable.",
-                        full_url, exc, error_type
-                    )
-            except httpx.HTTPError as exc:
-                error_type = type(exc).__name__
-                logger.warning("HTTP client error on GET %s: %s (%s)", full_url, exc, error_type)
-                raise ApiClientError from exc
-        
-        # Если все попытки исчерпаны, выбрасываем последнюю ошибку
-        raise ApiClientError(f"Failed to get {full_url} after {max_retries} attempts") from last_exc
-
-    async def _post(self, url: str, json: dict | None = None, max_retries: int = 3) -> dict:
-        """Выполняет POST запрос с retry для сетевых ошибок."""
-        full_url = f"{self._client.base_url}{url}"
-        last_exc = None
-        for attempt in range(max_retries):
-            try:
-                logger.debug("POST request to %s (attempt %d/%d)", full_url, attempt + 1, max_retries)
-                response = await self._client.post(url, json=json)
-                response.raise_for_status()
-                return response.json()
-            except HTTPStatusError as exc:
-                status = exc.response.status_code
-                if status in (401, 403):
-                    raise UnauthorizedError from exc
-                if status == 404:
-                    raise NotFoundError from exc
-                logger.warning("API error %s on POST %s: %s", status, full_url, exc.response.text)
-                raise ApiClientError from exc
-            except (httpx.RemoteProtocolError, httpx.ConnectError, httpx.ReadTimeout) as exc:
+            except httpx.TransportError as exc:
+                self._breaker.record_failure()
+                if not idempotent and not isinstance(exc, NOT_SENT_ERRORS):
+                    logger.warning("HTTP client error on %s %s: %s (%s)", method, full_url, exc, type(exc).__name__)
+                    raise ApiClientError from exc
                 last_exc = exc
-                error_type = type(exc).__name__
-                if attempt < max_retries - 1:
-                    delay = 0.5 * (2 ** attempt)  # Экспоненциальная задержка: 0.5s, 1s, 2s
-                    logger.warning(
-                        "HTTP client error on POST %s: %s (%s), retrying in %.1fs (attempt %d/%d)",
-                        full_url, exc, error_type, delay, attempt + 1, max_retries
-                    )
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(
-                        "HTTP client error on POST %s: %s (%s) - max retries reached. "
-                        "Server may be overloaded or network unstable.",
-                        full_url, exc, error_type
-                    )
             except httpx.HTTPError as exc:
-                error_type = type(exc).__name__
-                logger.warning("HTTP client error on POST %s: %s (%s)", full_url, exc, error_type)
+                logger.warning("HTTP client error on %s %s: %s (%s)", method, full_url, exc, type(exc).__name__)
                 raise ApiClientError from exc
-        
-        # Если все попытки исчерпаны, выбрасываем последнюю ошибку
-        raise ApiClientError(f"Failed to post {full_url} after {max_retries} attempts") from last_exc
-
-    async def _patch(self, url: str, json: dict | None = None, max_retries: int = 3) -> dict:
-        """Выполняет PATCH запрос с retry для сетевых ошибок."""
-        full_url = f"{self._client.base_url}{url}"
-        last_exc = None
-        for attempt in range(max_retries):
-            try:
-                logger.debug("PATCH request to %s (attempt %d/%d)", full_url, attempt + 1, max_retries)
-                response = await self._client.patch(url, json=json)
-                response.raise_for_status()
+            else:
+                self._breaker.record_success()
                 return response.json()
-            except HTTPStatusError as exc:
-                status = exc.response.status_code
-                if status in (401, 403):
-                    raise UnauthorizedError from exc
-                if status == 404:
-                    raise NotFoundError from exc
-                logger.warning("API error %s on PATCH %s: %s", status, full_url, exc.response.text)
-                raise ApiClientError from exc
-            except (httpx.RemoteProtocolError, httpx.ConnectError, httpx.ReadTimeout) as exc:
-                last_exc = exc
-                error_type = type(exc).__name__
-                if attempt < max_retries - 1:
-                    delay = 0.5 * (2 ** attempt)  # Экспоненциальная задержка: 0.5s, 1s, 2s
-                    logger.warning(
-                        "HTTP client error on PATCH %s: %s (%s), retrying in %.1fs (attempt %d/%d)",
-                        full_url, exc, error_type, delay, attempt + 1, max_retries
-                    )
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(
-                        "HTTP client error on PATCH %s: %s (%s) - max retries reached. "
-                        "Server may be overloaded or network unstable.",
-                        full_url, exc, error_type
-                    )
-            except httpx.HTTPError as exc:
-                error_type = type(exc).__name__
-                logger.warning("HTTP client error on PATCH %s: %s (%s)", full_url, exc, error_type)
-                raise ApiClientError from exc
-        
-        # Если все попытки исчерпаны, выбрасываем последнюю ошибку
-        raise ApiClientError(f"Failed to patch {full_url} after {max_retries} attempts") from last_exc
+
+            delay = decorrelated_jitter(delay, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+            if (
+                attempt >= max_retries
+                or time.monotonic() - started + delay > REQUEST_DEADLINE
+                or not self._retry_budget.try_spend()
+            ):
+                logger.error(
+                    "Error on %s %s: %s (%s) - giving up after %d attempts. "
+                    "Server may be overloaded or network unstable.",
+                    method, full_url, last_exc, type(last_exc).__name__, attempt
+                )
+                raise PanelUnavailableError(f"Failed to {method} {full_url} after {attempt} attempts") from last_exc
+            logger.warning(
+                "Error on %s %s: %s (%s), retrying in %.1fs (attempt %d/%d)",
+                method, full_url, last_exc, type(last_exc).__name__, delay, attempt, max_retries
+            )
+            API_RETRIES.inc(method=current_api_method.get())
+            await asyncio.sleep(delay)
+
+    async def _get(self, url: str, max_retries: int = MAX_RETRIES) -> dict:
+        return await self._request("GET", url, max_retries=max_retries)
+
+    async def _post(self, url: str, json: dict | None = None, max_retries: int = MAX_RETRIES) -> dict:
+        return await self._request("POST", url, json=json, max_retries=max_retries)
+
+    async def _patch(self, url: str, json: dict | None = None, max_retries: int = MAX_RETRIES) -> dict:
+        return await self._request("PATCH", url, json=json, max_retries=max_retries)
+
+    async def _delete(self, url: str, json: dict | None = None, max_retries: int = MAX_RETRIES) -> dict:
+        return await self._request("DELETE", url, json=json, max_retries=max_retries)
 
     # --- Settings ---
     async def get_settings(self) -> dict:
@@ -202,6 +320,52 @@ class RemnawaveApiClient:
     async def get_users(self, start: int = 0, size: int = 100) -> dict:
         return await self._get(f"/api/users?start={start}&size={size}")
 
+    async def iter_users(
+        self,
+        page_size: int = 500,
+        prefetch: int = 2,
+        where: Optional[Callable[[dict], bool]] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Обходит всех пользователей панели постранично, не собирая их в список.
+
+        Пока обрабатывается текущая страница, следующие prefetch страниц уже
+        запрашиваются. where отбирает пользователей, после limit совпадений
+        обход останавливается. Если цикл прерывается раньше, оборачивайте
+        вызов в contextlib.aclosing, чтобы отменить запрошенные страницы.
+        """
+        def fetch(start: int) -> asyncio.Task:
+            return asyncio.create_task(self.get_users(start=start, size=page_size))
+
+        pending: deque[asyncio.Task] = deque([fetch(0)])
+        next_start = page_size
+        total: Optional[int] = None
+        found = 0
+        try:
+            while pending:
+                data = await pending.popleft()
+                payload = data.get("response", data)
+                users = payload.get("users") or []
+                total = payload.get("total", len(users))
+                if not users:
+                    break
+                while len(pending) < prefetch and next_start < total:
+                    pending.append(fetch(next_start))
+                    next_start += page_size
+                for user in users:
+                    if where is not None and not where(user):
+                        continue
+                    yield user
+                    found += 1
+                    if limit is not None and found >= limit:
+                        return
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    @invalidates(*USERS_CACHE)
     async def update_user(self, user_uuid: str, **fields) -> dict:
         payload = {"uuid": user_uuid}
         payload.update({k: v for k, v in fields.items() if v is not None})
@@ -209,76 +373,41 @@ class RemnawaveApiClient:
         # Логируем payload для отладки
         logger.info("🔵 API: Updating user %s with payload: %s", user_uuid, payload)
         
-        return await self._patch("/api/users", json=payload)
+        return await self._remember_user(await self._patch("/api/users", json=payload))
 
+    @invalidates(*USERS_CACHE)
     async def disable_user(self, user_uuid: str) -> dict:
-        return await self._post(f"/api/users/{user_uuid}/actions/disable")
+        return await self._remember_user(await self._post(f"/api/users/{user_uuid}/actions/disable"))
 
+    @invalidates(*USERS_CACHE)
     async def enable_user(self, user_uuid: str) -> dict:
-        return await self._post(f"/api/users/{user_uuid}/actions/enable")
+        return await self._remember_user(await self._post(f"/api/users/{user_uuid}/actions/enable"))
 
+    @invalidates(*USERS_CACHE)
     async def reset_user_traffic(self, user_uuid: str) -> dict:
-        return await self._post(f"/api/users/{user_uuid}/actions/reset-traffic")
+        return await self._remember_user(await self._post(f"/api/users/{user_uuid}/actions/reset-traffic"))
 
+    @invalidates(*USERS_CACHE)
     async def revoke_user_subscription(self, user_uuid: str, short_uuid: str | None = None) -> dict:
         """Отзывает подписку пользователя. short_uuid опционален - если не указан, будет сгенерирован автоматически."""
         payload: dict[str, object] = {}
         if short_uuid:
             payload["shortUuid"] = short_uuid
-        return await self._post(f"/api/users/{user_uuid}/actions/revoke", json=payload)
+        return await self._remember_user(await self._post(f"/api/users/{user_uuid}/actions/revoke", json=payload))
 
     async def get_internal_squads(self) -> dict:
         """Получает список внутренних squads с увеличенным таймаутом и retry."""
-        return await self._get_with_timeout("/api/internal-squads", timeout=30.0, max_retries=3)
+        return await self._cached(
+            "/api/internal-squads", lambda: self._get("/api/internal-squads")
+        )
 
     async def get_external_squads(self) -> dict:
         """Получает список внешних squads с увеличенным таймаутом и retry."""
-        return await self._get_with_timeout("/api/external-squads", timeout=30.0, max_retries=3)
-
-    async def _get_with_timeout(self, url: str, timeout: float = 30.0, max_retries: int = 3) -> dict:
-        """Выполняет GET запрос с кастомным таймаутом и retry для сетевых ошибок."""
-        full_url = f"{self._client.base_url}{url}"
-        last_exc = None
-        custom_timeout = httpx.Timeout(timeout, connect=15.0, read=timeout, write=15.0, pool=10.0)
-        
-        for attempt in range(max_retries):
-            try:
-                logger.debug("GET request to %s with timeout %.1fs (attempt %d/%d)", full_url, timeout, attempt + 1, max_retries)
-                response = await self._client.get(url, timeout=custom_timeout)
-                response.raise_for_status()
-                return response.json()
-            except HTTPStatusError as exc:
-                status = exc.response.status_code
-                if status in (401, 403):
-                    raise UnauthorizedError from exc
-                if status == 404:
-                    raise NotFoundError from exc
-                logger.warning("API error %s on GET %s: %s", status, full_url, exc.response.text)
-                raise ApiClientError from exc
-            except (httpx.RemoteProtocolError, httpx.ConnectError, httpx.ReadTimeout) as exc:
-                last_exc = exc
-                error_type = type(exc).__name__
-                if attempt < max_retries - 1:
-                    delay = 0.5 * (2 ** attempt)  # Экспоненциальная задержка: 0.5s, 1s, 2s
-                    logger.warning(
-                        "HTTP client error on GET %s: %s (%s), retrying in %.1fs (attempt %d/%d)",
-                        full_url, exc, error_type, delay, attempt + 1, max_retries
-                    )
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(
-                        "HTTP client error on GET %s: %s (%s) - max retries reached. "
-                        "Server may be overloaded or network unstable.",
-                        full_url, exc, error_type
-                    )
-            except httpx.HTTPError as exc:
-                error_type = type(exc).__name__
-                logger.warning("HTTP client error on GET %s: %s (%s)", full_url, exc, error_type)
-                raise ApiClientError from exc
-        
-        # Если все попытки исчерпаны, выбрасываем последнюю ошибку
-        raise ApiClientError(f"Failed to get {full_url} after {max_retries} attempts") from last_exc
+        return await self._cached(
+            "/api/external-squads", lambda: self._get("/api/external-squads")
+        )
 
+    @invalidates(*USERS_CACHE)
     async def create_user(
         self,
         username: str,
@@ -310,25 +439,26 @@ class RemnawaveApiClient:
         # Логируем payload для отладки
         logger.info("🔵 API: Creating user with payload: %s", payload)
         
-        return await self._post("/api/users", json=payload)
+        return await self._remember_user(await self._post("/api/users", json=payload))
 
     # --- System ---
     async def get_health(self) -> dict:
-        return await self._get("/api/system/health")
+        return await self._cached("/api/system/health", lambda: self._get("/api/system/health"))
 
     async def get_stats(self) -> dict:
-        return await self._get("/api/system/stats")
+        return await self._cached("/api/system/stats", lambda: self._get("/api/system/stats"))
 
     async def get_bandwidth_stats(self) -> dict:
-        return await self._get("/api/system/stats/bandwidth")
+        return await self._cached("/api/system/stats/bandwidth", lambda: self._get("/api/system/stats/bandwidth"))
 
     # --- Nodes ---
     async def get_nodes(self) -> dict:
-        return await self._get("/api/nodes")
+        return await self._cached("/api/nodes", lambda: self._get("/api/nodes"))
 
     async def get_node(self, node_uuid: str) -> dict:
         return await self._get(f"/api/nodes/{node_uuid}")
 
+    @invalidates(*NODES_CACHE)
     async def create_node(
         self,
         name: str,
@@ -374,18 +504,23 @@ class RemnawaveApiClient:
             payload["tags"] = tags
         return await self._post("/api/nodes", json=payload)
 
+    @invalidates(*NODES_CACHE)
     async def enable_node(self, node_uuid: str) -> dict:
         return await self._post(f"/api/nodes/{node_uuid}/actions/enable")
 
+    @invalidates(*NODES_CACHE)
     async def disable_node(self, node_uuid: str) -> dict:
         return await self._post(f"/api/nodes/{node_uuid}/actions/disable")
 
+    @invalidates(*NODES_CACHE)
     async def restart_node(self, node_uuid: str) -> dict:
         return await self._post(f"/api/nodes/{node_uuid}/actions/restart")
 
+    @invalidates(*NODES_CACHE)
     async def reset_node_traffic(self, node_uuid: str) -> dict:
         return await self._post(f"/api/nodes/{node_uuid}/actions/reset-traffic")
 
+    @invalidates(*NODES_CACHE)
     async def update_node(
         self,
         node_uuid: str,
@@ -434,24 +569,10 @@ class RemnawaveApiClient:
             payload["tags"] = tags
         return await self._patch("/api/nodes", json=payload)
 
+    @invalidates(*NODES_CACHE)
     async def delete_node(self, node_uuid: str) -> dict:
         """Удаление ноды."""
-        try:
-            response = await self._client.delete(f"/api/nodes/{node_uuid}")
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status in (401, 403):
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning("API error %s on DELETE /api/nodes/%s: %s", status, node_uuid, exc.response.text)
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/nodes/%s: %s (%s)", node_uuid, exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete(f"/api/nodes/{node_uuid}")
 
     async def get_nodes_realtime_usage(self) -> dict:
         return await self._get("/api/bandwidth-stats/nodes/realtime")
@@ -461,17 +582,20 @@ class RemnawaveApiClient:
 
     # --- Hosts ---
     async def get_hosts(self) -> dict:
-        return await self._get("/api/hosts")
+        return await self._cached("/api/hosts", lambda: self._get("/api/hosts"))
 
     async def get_host(self, host_uuid: str) -> dict:
         return await self._get(f"/api/hosts/{host_uuid}")
 
+    @invalidates(*HOSTS_CACHE)
     async def enable_hosts(self, host_uuids: list[str]) -> dict:
         return await self._post("/api/hosts/bulk/enable", json={"uuids": host_uuids})
 
+    @invalidates(*HOSTS_CACHE)
     async def disable_hosts(self, host_uuids: list[str]) -> dict:
         return await self._post("/api/hosts/bulk/disable", json={"uuids": host_uuids})
 
+    @invalidates(*HOSTS_CACHE)
     async def create_host(
         self,
         remark: str,
@@ -495,6 +619,7 @@ class RemnawaveApiClient:
             payload["tag"] = tag
         return await self._post("/api/hosts", json=payload)
 
+    @invalidates(*HOSTS_CACHE)
     async def update_host(
         self,
         host_uuid: str,
@@ -579,26 +704,13 @@ class RemnawaveApiClient:
     async def get_tokens(self) -> dict:
         return await self._get("/api/tokens")
 
+    @invalidates(*RESOURCES_CACHE)
     async def create_token(self, token_name: str) -> dict:
         return await self._post("/api/tokens", json={"tokenName": token_name})
 
+    @invalidates(*RESOURCES_CACHE)
     async def delete_token(self, token_uuid: str) -> dict:
-        try:
-            response = await self._client.delete(f"/api/tokens/{token_uuid}")
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status in (401, 403):
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning("API error %s on DELETE %s: %s", status, response.url, exc.response.text)
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/tokens/%s: %s (%s)", token_uuid, exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete(f"/api/tokens/{token_uuid}")
 
     # --- Subscription templates ---
     async def get_templates(self) -> dict:
@@ -607,23 +719,11 @@ class RemnawaveApiClient:
     async def get_template(self, template_uuid: str) -> dict:
         return await self._get(f"/api/subscription-templates/{template_uuid}")
 
+    @invalidates(*RESOURCES_CACHE)
     async def delete_template(self, template_uuid: str) -> dict:
-        try:
-            response = await self._client.delete(f"/api/subscription-templates/{template_uuid}")
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status == 401:
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning("API error %s on DELETE %s: %s", status, response.url, exc.response.text)
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/subscription-templates/%s: %s (%s)", template_uuid, exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete(f"/api/subscription-templates/{template_uuid}")
+
+    @invalidates(*RESOURCES_CACHE)
     async def create_template(self, name: str, template_type: str) -> dict:
         return await self._post(
             "/api/subscription-templates", json={"name": name, "templateType": template_type}
@@ -647,33 +747,20 @@ class RemnawaveApiClient:
     async def get_snippets(self) -> dict:
         return await self._get("/api/snippets")
 
+    @invalidates(*RESOURCES_CACHE)
     async def create_snippet(self, name: str, snippet: list[dict] | dict) -> dict:
         return await self._post("/api/snippets", json={"name": name, "snippet": snippet})
 
     async def update_snippet(self, name: str, snippet: list[dict] | dict) -> dict:
         return await self._patch("/api/snippets", json={"name": name, "snippet": snippet})
 
+    @invalidates(*RESOURCES_CACHE)
     async def delete_snippet(self, name: str) -> dict:
-        try:
-            response = await self._client.delete("/api/snippets", json={"name": name})
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status == 401:
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning("API error %s on DELETE /api/snippets: %s", status, exc.response.text)
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/snippets: %s (%s)", exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete("/api/snippets", json={"name": name})
 
     # --- Config profiles ---
     async def get_config_profiles(self) -> dict:
-        return await self._get("/api/config-profiles")
+        return await self._cached("/api/config-profiles", lambda: self._get("/api/config-profiles"))
 
     async def get_config_profile_computed(self, profile_uuid: str) -> dict:
         return await self._get(f"/api/config-profiles/{profile_uuid}/computed-config")
@@ -715,22 +802,7 @@ class RemnawaveApiClient:
         return await self._patch("/api/infra-billing/providers", json=payload)
 
     async def delete_infra_provider(self, provider_uuid: str) -> dict:
-        try:
-            response = await self._client.delete(f"/api/infra-billing/providers/{provider_uuid}")
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status == 401:
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning("API error %s on DELETE /api/infra-billing/providers/%s: %s", status, provider_uuid, exc.response.text)
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/infra-billing/providers/%s: %s (%s)", provider_uuid, exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete(f"/api/infra-billing/providers/{provider_uuid}")
 
     async def create_infra_billing_record(self, provider_uuid: str, amount: float, billed_at: str) -> dict:
         return await self._post(
@@ -738,24 +810,7 @@ class RemnawaveApiClient:
         )
 
     async def delete_infra_billing_record(self, record_uuid: str) -> dict:
-        try:
-            response = await self._client.delete(f"/api/infra-billing/history/{record_uuid}")
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status == 401:
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning(
-                "API error %s on DELETE /api/infra-billing/history/%s: %s", status, record_uuid, exc.response.text
-            )
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/infra-billing/history/%s: %s (%s)", record_uuid, exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete(f"/api/infra-billing/history/{record_uuid}")
 
     async def create_infra_billing_node(
         self, provider_uuid: str, node_uuid: str, next_billing_at: str | None = None
@@ -769,65 +824,64 @@ class RemnawaveApiClient:
         return await self._patch("/api/infra-billing/nodes", json={"uuids": uuids, "nextBillingAt": next_billing_at})
 
     async def delete_infra_billing_node(self, record_uuid: str) -> dict:
-        try:
-            response = await self._client.delete(f"/api/infra-billing/nodes/{record_uuid}")
-            response.raise_for_status()
-            return response.json()
-        except HTTPStatusError as exc:
-            status = exc.response.status_code
-            if status == 401:
-                raise UnauthorizedError from exc
-            if status == 404:
-                raise NotFoundError from exc
-            logger.warning(
-                "API error %s on DELETE /api/infra-billing/nodes/%s: %s", status, record_uuid, exc.response.text
-            )
-            raise ApiClientError from exc
-        except httpx.HTTPError as exc:
-            error_type = type(exc).__name__
-            logger.warning("HTTP client error on DELETE /api/infra-billing/nodes/%s: %s (%s)", record_uuid, exc, error_type)
-            raise ApiClientError from exc
+        return await self._delete(f"/api/infra-billing/nodes/{record_uuid}")
 
     # --- Users bulk ---
+    @invalidates(*USERS_CACHE)
     async def bulk_reset_traffic_all_users(self) -> dict:
-        return await self._post("/api/users/bulk/all/reset-traffic")
+        return self._request_index_refresh(await self._post("/api/users/bulk/all/reset-traffic"))
 
+    @invalidates(*USERS_CACHE)
     async def bulk_delete_users_by_status(self, status: str) -> dict:
-        return await self._post("/api/users/bulk/delete-by-status", json={"status": status})
+        return self._request_index_refresh(await self._post("/api/users/bulk/delete-by-status", json={"status": status}))
 
+    @invalidates(*USERS_CACHE)
     async def bulk_delete_users(self, uuids: list[str]) -> dict:
-        return await self._post("/api/users/bulk/delete", json={"uuids": uuids})
+        from src.services.user_index_service import forget_users
+
+        result = await self._post("/api/users/bulk/delete", json={"uuids": uuids})
+        await forget_users(uuids)
+        return result
 
+    @invalidates(*USERS_CACHE)
     async def bulk_revoke_subscriptions(self, uuids: list[str]) -> dict:
-        return await self._post("/api/users/bulk/revoke-subscription", json={"uuids": uuids})
+        return self._request_index_refresh(await self._post("/api/users/bulk/revoke-subscription", json={"uuids": uuids}))
 
+    @invalidates(*USERS_CACHE)
     async def bulk_reset_traffic_users(self, uuids: list[str]) -> dict:
-        return await self._post("/api/users/bulk/reset-traffic", json={"uuids": uuids})
+        return self._request_index_refresh(await self._post("/api/users/bulk/reset-traffic", json={"uuids": uuids}))
 
+    @invalidates(*USERS_CACHE)
     async def bulk_extend_users(self, uuids: list[str], days: int) -> dict:
-        return await self._post("/api/users/bulk/extend-expiration-date", json={"uuids": uuids, "extendDays": days})
+        return self._request_index_refresh(await self._post("/api/users/bulk/extend-expiration-date", json={"uuids": uuids, "extendDays": days}))
 
+    @invalidates(*USERS_CACHE)
     async def bulk_extend_all_users(self, days: int) -> dict:
-        return await self._post("/api/users/bulk/all/extend-expiration-date", json={"extendDays": days})
+        return self._request_index_refresh(await self._post("/api/users/bulk/all/extend-expiration-date", json={"extendDays": days}))
 
+    @invalidates(*USERS_CACHE)
     async def bulk_update_users_status(self, uuids: list[str], status: str) -> dict:
-        return await self._post("/api/users/bulk/update", json={"uuids": uuids, "fields": {"status": status}})
+        return self._request_index_refresh(await self._post("/api/users/bulk/update", json={"uuids": uuids, "fields": {"status": status}}))
 
     # --- Infra billing nodes ---
     async def get_infra_billing_nodes(self) -> dict:
         return await self._get("/api/infra-billing/nodes")
 
     # --- Hosts bulk ---
+    @invalidates(*HOSTS_CACHE)
     async def bulk_enable_hosts(self, uuids: list[str]) -> dict:
         return await self._post("/api/hosts/bulk/enable", json={"uuids": uuids})
 
+    @invalidates(*HOSTS_CACHE)
     async def bulk_disable_hosts(self, uuids: list[str]) -> dict:
         return await self._post("/api/hosts/bulk/disable", json={"uuids": uuids})
 
+    @invalidates(*HOSTS_CACHE)
     async def bulk_delete_hosts(self, uuids: list[str]) -> dict:
         return await self._post("/api/hosts/bulk/delete", json={"uuids": uuids})
 
     # --- Nodes bulk ---
+    @invalidates(*NODES_CACHE)
     async def bulk_nodes_profile_modification(
         self, node_uuids: list[str], profile_uuid: str, inbound_uuids: list[str]
     ) -> dict:
@@ -843,5 +897,10 @@ class RemnawaveApiClient:
         await self._client.aclose()
 
 
+# Все публичные методы клиента попадают в /metrics
+for _name, _func in list(vars(RemnawaveApiClient).items()):
+    if not _name.startswith("_") and inspect.iscoroutinefunction(_func):
+        setattr(RemnawaveApiClient, _name, measured(_func))
+
 # Single shared instance
 api_client = RemnawaveApiClient()
@@ -0,0 +1,114 @@
+"""Защита от деградации Remnawave API: circuit breaker, общий бюджет повторов и задержки с jitter."""
+import random
+import time
+
+from src.utils.logger import logger
+
+
+def decorrelated_jitter(previous: float, base: float, cap: float) -> float:
+    """Следующая задержка перед повтором: случайная между base и 3 × previous, не больше cap."""
+    return min(cap, random.uniform(base, previous * 3))
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold неудач подряд (сетевые ошибки, 5xx).
+
+    Пока цепь разомкнута, запросы отклоняются сразу, не дожидаясь таймаутов.
+    Через reset_timeout секунд пропускается один пробный запрос (half-open):
+    успех замыкает цепь, неудача снова размыкает её.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас."""
+        if self._state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self._state == self.OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_started = now
+            return True
+        # Half-open: один пробный запрос; если он завис, через reset_timeout пускаем следующий
+        if now - self._probe_started >= self.reset_timeout:
+            self._probe_started = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        if self._state != self.CLOSED:
+            logger.info("Remnawave API circuit closed")
+            self._state = self.CLOSED
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                self.opened += 1
+                logger.warning(
+                    "Remnawave API circuit opened after %d failures, failing fast for %.0fs",
+                    self._failures, self.reset_timeout
+                )
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "open": int(self._state == self.OPEN),
+            "half_open": int(self._state == self.HALF_OPEN),
+            "consecutive_failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class RetryBudget:
+    """
+    Общий бюджет повторов для всех запросов клиента.
+
+    Каждый запрос добавляет ratio токена (не больше max_tokens), каждый
+    повтор тратит целый токен. Когда панель деградирует, повторы составляют
+    не больше ~ratio от потока запросов, а не max_retries на каждый запрос.
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 20.0) -> None:
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self.exhausted = 0
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+    def deposit(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
@@ -0,0 +1,40 @@
+"""Кеш ответа /api/bootstrap Mini App, который сервисы сбрасывают при изменении данных пользователя."""
+import os
+import time
+from typing import Optional
+
+# Ответ /api/bootstrap кешируется на пользователя (секунды)
+BOOTSTRAP_CACHE_SECONDS = int(os.getenv('WEBAPP_BOOTSTRAP_CACHE_SECONDS', '15'))
+BOOTSTRAP_CACHE_SIZE = 5000
+
+# {telegram_id: (expires_at, etag, тело ответа)}
+_bootstrap_cache: dict[int, tuple[float, str, bytes]] = {}
+
+
+def get_cached_bootstrap(telegram_id: int) -> Optional[tuple[str, bytes]]:
+    """Действующий ответ (etag, тело) или None."""
+    cached = _bootstrap_cache.get(telegram_id)
+    if cached is None or cached[0] <= time.monotonic():
+        return None
+    return cached[1], cached[2]
+
+
+def store_bootstrap(telegram_id: int, etag: str, body: bytes) -> None:
+    """Сохраняет ответ на BOOTSTRAP_CACHE_SECONDS."""
+    _bootstrap_cache.pop(telegram_id, None)
+    _bootstrap_cache[telegram_id] = (time.monotonic() + BOOTSTRAP_CACHE_SECONDS, etag, body)
+    if len(_bootstrap_cache) > BOOTSTRAP_CACHE_SIZE:
+        # Удаляем самую старую запись (dict сохраняет порядок вставки)
+        del _bootstrap_cache[next(iter(_bootstrap_cache))]
+
+
+def invalidate_user_cache(telegram_id: Optional[int]) -> None:
+    """
+    Сбрасывает кеш /api/bootstrap пользователя после изменения его данных.
+
+    Вызывается там, где данные меняются (платежи, подарки, лояльность,
+    рефералы), а не в маршрутах: платёж может завершить вебхук, сверка
+    или хаб статусов, и каждый путь должен сбросить кеш.
+    """
+    if telegram_id is not None:
+        _bootstrap_cache.pop(telegram_id, None)
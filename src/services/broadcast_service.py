@@ -0,0 +1,275 @@
+"""Рассылки: очередь получателей в БД, параллельная отправка с учётом лимитов Telegram."""
+import asyncio
+import os
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.utils.i18n import gettext as _
+
+from src.database import Broadcast
+from src.utils.i18n import get_i18n
+from src.utils.logger import logger
+
+# Глобальный лимит Telegram ~30 сообщений в секунду, оставляем запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+
+# Как часто сохранять результаты в БД и обновлять сообщение с прогрессом (секунды)
+FLUSH_INTERVAL = 1.0
+PROGRESS_INTERVAL = 3.0
+RECIPIENTS_CHUNK = 1000
+MAX_ATTEMPTS = 3
+
+
+class TokenBucket:
+    """Ограничитель скорости: не больше rate операций в секунду, всплеск до capacity."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Останавливает выдачу токенов (ответ RetryAfter от Telegram)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _stop_keyboard(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=_("broadcast.btn_stop"), callback_data=f"broadcast:stop:{job_id}")]
+    ])
+
+
+class BroadcastEngine:
+    """
+    Выполняет рассылки из таблицы broadcast_jobs.
+
+    Получатели читаются из БД порциями, отправляют их несколько воркеров через
+    общий token bucket. Результаты периодически сохраняются, поэтому после
+    перезапуска рассылка продолжается с неотправленных получателей.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE, workers: int = BROADCAST_WORKERS) -> None:
+        self.workers = workers
+        self._bucket = TokenBucket(rate)
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._cancelled: set[int] = set()
+
+    def is_running(self, job_id: int) -> bool:
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    def start_job(self, bot: Bot, job_id: int) -> None:
+        """Запускает (или продолжает) рассылку в фоне."""
+        if self.is_running(job_id):
+            return
+        task = asyncio.create_task(self._run_job(bot, job_id), name=f"broadcast-{job_id}")
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _task: self._tasks.pop(job_id, None))
+
+    def cancel(self, job_id: int) -> bool:
+        """Останавливает рассылку по запросу админа."""
+        if not self.is_running(job_id):
+            return False
+        self._cancelled.add(job_id)
+        return True
+
+    async def resume(self, bot: Bot) -> None:
+        """Продолжает рассылки, прерванные перезапуском бота."""
+        for job in await Broadcast.aio.get_running():
+            logger.info("Resuming broadcast %s (sent %s/%s)", job["id"], job["sent"], job["total"])
+            self.start_job(bot, job["id"])
+
+    async def stop(self) -> None:
+        """Останавливает воркеры при выключении бота (рассылки остаются в статусе running)."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _deliver(self, bot: Bot, job: dict, user_id: int) -> Optional[str]:
+        """Отправляет сообщение одному получателю. Возвращает текст ошибки или None."""
+        error = "retry limit reached"
+        for attempt in range(MAX_ATTEMPTS):
+            await self._bucket.acquire()
+            try:
+                if job["source_chat_id"] and job["source_message_id"]:
+                    # Копия исходного сообщения админа: форматирование и file_id фото сохраняются
+                    await bot.copy_message(
+                        chat_id=user_id,
+                        from_chat_id=job["source_chat_id"],
+                        message_id=job["source_message_id"],
+                    )
+                elif job["photo_id"]:
+                    await bot.send_photo(
+                        chat_id=user_id,
+                        photo=job["photo_id"],
+                        caption=job["message_text"],
+                        parse_mode="HTML"
+                    )
+                else:
+                    await bot.send_message(chat_id=user_id, text=job["message_text"], parse_mode="HTML")
+                return None
+            except TelegramRetryAfter as e:
+                logger.warning("Broadcast %s hit flood limit, pausing for %ss", job["id"], e.retry_after)
+                self._bucket.pause(e.retry_after)
+                error = f"retry after {e.retry_after}s"
+            except TelegramNetworkError as e:
+                error = str(e)
+                await asyncio.sleep(0.5 * (2 ** attempt))
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. — повтор не поможет
+                return str(e)
+        return error
+
+    async def _update_progress(self, bot: Bot, job: dict, text: str, reply_markup=None) -> None:
+        if not job.get("status_chat_id") or not job.get("status_message_id"):
+            return
+        try:
+            await bot.edit_message_text(
+                text,
+                chat_id=job["status_chat_id"],
+                message_id=job["status_message_id"],
+                reply_markup=reply_markup,
+                parse_mode="HTML"
+            )
+        except TelegramRetryAfter as e:
+            self._bucket.pause(e.retry_after)
+        except TelegramAPIError:
+            pass
+
+    async def _run_job(self, bot: Bot, job_id: int) -> None:
+        """Выполняет рассылку; при сбое помечает её failed и сообщает админу."""
+        try:
+            await self._execute_job(bot, job_id)
+        except Exception:
+            logger.exception("Broadcast %s crashed", job_id)
+            self._cancelled.discard(job_id)
+            try:
+                await Broadcast.aio.finish(job_id, "failed")
+                job = await Broadcast.aio.get(job_id)
+                if job:
+                    from src.handlers.user_public import _get_user_menu_keyboard
+
+                    with get_i18n().use_locale(job.get("locale") or "ru"):
+                        text = _("broadcast.failed").format(sent=job["sent"], errors=job["errors"], total=job["total"])
+                        await self._update_progress(bot, job, text, _get_user_menu_keyboard(job["admin_id"]))
+            except Exception:
+                logger.exception("Failed to mark broadcast %s as failed", job_id)
+
+    async def _execute_job(self, bot: Bot, job_id: int) -> None:
+        job = await Broadcast.aio.get(job_id)
+        if not job or job["status"] != "running":
+            return
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 4)
+        sent_ids: list[int] = []
+        failed: list[tuple[int, str]] = []
+        counters = {"sent": job["sent"], "errors": job["errors"]}
+
+        async def produce() -> None:
+            last_user_id = -1
+            while job_id not in self._cancelled:
+                chunk = await Broadcast.aio.get_pending_recipients(job_id, last_user_id, RECIPIENTS_CHUNK)
+                if not chunk:
+                    break
+                for user_id in chunk:
+                    if job_id in self._cancelled:
+                        break
+                    await queue.put(user_id)
+                last_user_id = chunk[-1]
+            for _worker in range(self.workers):
+                await queue.put(None)
+
+        async def work() -> None:
+            while True:
+                user_id = await queue.get()
+                if user_id is None:
+                    return
+                if job_id in self._cancelled:
+                    continue
+                try:
+                    error = await self._deliver(bot, job, user_id)
+                except Exception as e:
+                    # Неожиданная ошибка одного получателя не должна останавливать воркер
+                    logger.exception("Broadcast %s failed for user %s", job_id, user_id)
+                    error = str(e) or type(e).__name__
+                if error is None:
+                    sent_ids.append(user_id)
+                    counters["sent"] += 1
+                else:
+                    logger.debug("Broadcast %s error for user %s: %s", job_id, user_id, error)
+                    failed.append((user_id, error[:200]))
+                    counters["errors"] += 1
+
+        async def flush() -> None:
+            if sent_ids or failed:
+                batch_sent, batch_failed = sent_ids[:], failed[:]
+                sent_ids.clear()
+                failed.clear()
+                await Broadcast.aio.record_results(job_id, batch_sent, batch_failed)
+
+        locale = job.get("locale") or "ru"
+        i18n = get_i18n()
+        workers = [asyncio.create_task(work()) for _worker in range(self.workers)]
+        producer = asyncio.create_task(produce())
+        finished = asyncio.gather(producer, *workers)
+        last_progress = 0.0
+        try:
+            while not finished.done():
+                await asyncio.wait({finished}, timeout=FLUSH_INTERVAL)
+                await flush()
+                if time.monotonic() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.monotonic()
+                    with i18n.use_locale(locale):
+                        await self._update_progress(
+                            bot, job,
+                            _("broadcast.sending").format(sent=counters["sent"], total=job["total"]),
+                            _stop_keyboard(job_id)
+                        )
+            await finished
+        finally:
+            if not finished.done():
+                finished.cancel()
+                await asyncio.gather(finished, return_exceptions=True)
+            await flush()
+
+        cancelled = job_id in self._cancelled
+        self._cancelled.discard(job_id)
+        await Broadcast.aio.finish(job_id, "cancelled" if cancelled else "completed")
+        logger.info(
+            "Broadcast %s %s: sent=%s errors=%s total=%s",
+            job_id, "cancelled" if cancelled else "completed", counters["sent"], counters["errors"], job["total"]
+        )
+
+        from src.handlers.user_public import _get_user_menu_keyboard
+
+        with i18n.use_locale(locale):
+            key = "broadcast.stopped" if cancelled else "broadcast.completed"
+            text = _(key).format(sent=counters["sent"], errors=counters["errors"], total=job["total"])
+            await self._update_progress(bot, job, text, _get_user_menu_keyboard(job["admin_id"]))
+
+
+# Single shared instance
+broadcast_engine = BroadcastEngine()
@@ -0,0 +1,126 @@
+"""Снимок данных для главного меню и статистики панели (статистика, ноды, хосты, ресурсы)."""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.services.api_client import ApiClientError, api_client
+from src.utils.logger import logger
+
+# Как часто фоновая задача обновляет снимок и когда он считается устаревшим (секунды)
+REFRESH_INTERVAL = int(os.getenv("DASHBOARD_REFRESH_SECONDS", "30"))
+MAX_AGE = REFRESH_INTERVAL * 2
+
+
+@dataclass
+class DashboardSnapshot:
+    """Агрегаты, которые показывают главное меню и экраны статистики."""
+
+    stats: dict = field(default_factory=dict)
+    hosts_total: Optional[int] = None
+    hosts_enabled: Optional[int] = None
+    nodes_total: Optional[int] = None
+    nodes_enabled: Optional[int] = None
+    nodes_online: Optional[int] = None
+    templates: Optional[int] = None
+    tokens: Optional[int] = None
+    snippets: Optional[int] = None
+    fetched_at: float = 0.0
+    cache_generation: int = 0
+
+    @property
+    def hosts_disabled(self) -> Optional[int]:
+        return None if self.hosts_total is None else self.hosts_total - self.hosts_enabled
+
+    @property
+    def nodes_disabled(self) -> Optional[int]:
+        return None if self.nodes_total is None else self.nodes_total - self.nodes_enabled
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+_snapshot: Optional[DashboardSnapshot] = None
+_refreshing: Optional[asyncio.Task] = None
+
+
+def _count(result, *path: str) -> Optional[int]:
+    """Длина списка из ответа API или None, если запрос не удался."""
+    if isinstance(result, BaseException):
+        return None
+    value = result.get("response", [])
+    for key in path:
+        value = value.get(key, []) if isinstance(value, dict) else []
+    return len(value)
+
+
+async def _build_snapshot() -> DashboardSnapshot:
+    generation = api_client.cache.invalidations
+    stats, hosts, nodes, templates, tokens, snippets = await asyncio.gather(
+        api_client.get_stats(),
+        api_client.get_hosts(),
+        api_client.get_nodes(),
+        api_client.get_templates(),
+        api_client.get_tokens(),
+        api_client.get_snippets(),
+        return_exceptions=True,
+    )
+    # Без основной статистики снимок бесполезен — пробрасываем ошибку как раньше
+    if isinstance(stats, BaseException):
+        raise stats
+
+    snapshot = DashboardSnapshot(
+        stats=stats.get("response", {}),
+        templates=_count(templates, "templates"),
+        tokens=_count(tokens, "apiKeys"),
+        snippets=_count(snippets, "snippets"),
+        fetched_at=time.monotonic(),
+        cache_generation=generation,
+    )
+    if not isinstance(hosts, BaseException):
+        hosts_list = hosts.get("response", [])
+        snapshot.hosts_total = len(hosts_list)
+        snapshot.hosts_enabled = sum(1 for h in hosts_list if not h.get("isDisabled"))
+    if not isinstance(nodes, BaseException):
+        nodes_list = nodes.get("response", [])
+        snapshot.nodes_total = len(nodes_list)
+        snapshot.nodes_enabled = sum(1 for n in nodes_list if not n.get("isDisabled"))
+        snapshot.nodes_online = sum(1 for n in nodes_list if n.get("isConnected"))
+    return snapshot
+
+
+async def refresh_snapshot() -> DashboardSnapshot:
+    """Обновляет снимок; одновременные вызовы ждут одно и то же обновление."""
+    global _refreshing, _snapshot
+    if _refreshing is None or _refreshing.done():
+        _refreshing = asyncio.create_task(_build_snapshot())
+    snapshot = await asyncio.shield(_refreshing)
+    _snapshot = snapshot
+    return snapshot
+
+
+async def get_snapshot() -> DashboardSnapshot:
+    """Возвращает актуальный снимок (из памяти, если он свежий и данные не менялись)."""
+    snapshot = _snapshot
+    if (
+        snapshot is not None
+        and snapshot.age < MAX_AGE
+        and snapshot.cache_generation == api_client.cache.invalidations
+    ):
+        return snapshot
+    return await refresh_snapshot()
+
+
+async def start_dashboard_refresher(interval_seconds: int = REFRESH_INTERVAL) -> None:
+    """Фоновая задача, которая держит снимок прогретым."""
+    logger.info("Starting dashboard refresher (interval: %d seconds)", interval_seconds)
+    while True:
+        try:
+            await refresh_snapshot()
+        except ApiClientError as e:
+            logger.warning("Dashboard snapshot refresh failed: %s", e)
+        except Exception as e:
+            logger.exception("Error in dashboard refresher loop: %s", e)
+        await asyncio.sleep(interval_seconds)
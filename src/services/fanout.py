@@ -0,0 +1,102 @@
+"""Параллельное выполнение одной операции над множеством объектов (массовые действия с нодами и т.п.)."""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, Optional
+
+from src.utils.logger import logger
+
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "20"))
+FANOUT_TIMEOUT = float(os.getenv("FANOUT_TIMEOUT", "30"))
+FANOUT_RETRIES = int(os.getenv("FANOUT_RETRIES", "2"))
+
+# Как часто вызывать on_progress (секунды)
+PROGRESS_INTERVAL = 2.0
+
+
+@dataclass
+class FanOutReport:
+    """Итог массовой операции: что выполнилось, что нет и почему."""
+
+    total: int
+    succeeded: list = field(default_factory=list)
+    failed: list[tuple[Any, str]] = field(default_factory=list)
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> int:
+        return len(self.succeeded) + len(self.failed)
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+async def fan_out(
+    items: Iterable[Any],
+    action: Callable[[Any], Awaitable[Any]],
+    *,
+    concurrency: int = FANOUT_CONCURRENCY,
+    timeout: Optional[float] = FANOUT_TIMEOUT,
+    retries: int = FANOUT_RETRIES,
+    no_retry: tuple[type[BaseException], ...] = (),
+    abort_on: tuple[type[BaseException], ...] = (),
+    on_progress: Optional[Callable[[FanOutReport], Awaitable[None]]] = None,
+    progress_interval: float = PROGRESS_INTERVAL,
+) -> FanOutReport:
+    """
+    Выполняет action для каждого элемента, не больше concurrency одновременно.
+
+    Каждый вызов ограничен timeout (None — без ограничения) и повторяется до retries раз с
+    экспоненциальной задержкой; ошибки из no_retry не повторяются.
+    Ошибка из abort_on останавливает всю операцию и пробрасывается
+    (например, UnauthorizedError — остальные запросы тоже не пройдут).
+    """
+    items = list(items)
+    report = FanOutReport(total=len(items))
+    pending = iter(items)
+
+    async def run_one(item: Any) -> None:
+        error = "unknown error"
+        for attempt in range(retries + 1):
+            try:
+                await asyncio.wait_for(action(item), timeout)
+                report.succeeded.append(item)
+                return
+            except abort_on:
+                raise
+            except asyncio.TimeoutError:
+                error = f"timeout after {timeout:g}s"
+            except no_retry as exc:
+                report.failed.append((item, str(exc) or type(exc).__name__))
+                return
+            except Exception as exc:
+                error = str(exc) or type(exc).__name__
+            if attempt < retries:
+                await asyncio.sleep(0.5 * (2 ** attempt))
+        report.failed.append((item, error))
+
+    async def work() -> None:
+        for item in pending:
+            await run_one(item)
+
+    workers = [asyncio.create_task(work()) for _worker in range(max(1, min(concurrency, len(items))))]
+    finished = asyncio.gather(*workers)
+    try:
+        while not finished.done():
+            await asyncio.wait({finished}, timeout=progress_interval)
+            if on_progress and not finished.done():
+                try:
+                    await on_progress(report)
+                except Exception:
+                    logger.debug("Fan-out progress callback failed", exc_info=True)
+        await finished
+    finally:
+        # gather не отменяет остальные задачи при ошибке одной из них
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        report.finished_at = time.monotonic()
+    return report
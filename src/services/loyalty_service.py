@@ -4,7 +4,8 @@
 """
 
 from src.database import Loyalty, BotUser
-from src.utils.i18n import get_i18n
+from src.services.bootstrap_cache import invalidate_user_cache
+from src.utils.i18n import t
 
 
 # Базовые цены в рублях
@@ -26,22 +27,12 @@ STARS_PRICES = {
 }
 
 
-def get_price_with_discount(telegram_id: int, days: int) -> dict:
-    """
-    Получает цену с учётом скидки лояльности.
-    
-    Returns:
-        dict с ключами:
-        - base_price: базовая цена в рублях
-        - discounted_price: цена со скидкой в рублях
-        - discount: размер скидки в рублях
-        - stars_base: базовая цена в Stars
-        - stars_discounted: цена со скидкой в Stars
-    """
+def _compute_price(status: str, days: int) -> dict:
     base_price = BASE_PRICES.get(days, 129)
     stars_base = STARS_PRICES.get(days, 70)
     
-    discounted_price, discount = Loyalty.get_discounted_price(base_price, telegram_id, days)
+    discount = Loyalty.get_status_discount(status, days)
+    discounted_price = max(base_price - discount, 0)
     
     # Пересчитываем Stars с учётом скидки
     if discount > 0:
@@ -59,7 +50,82 @@ def get_price_with_discount(telegram_id: int, days: int) -> dict:
     }
 
 
-def process_payment_loyalty(telegram_id: int, amount_rub: int) -> dict | None:
+class PricingMatrix:
+    """
+    Цены (статус × период × валюта), посчитанные один раз из Loyalty.DISCOUNTS,
+    BASE_PRICES и STARS_PRICES. Цены не зависят от пользователя, только от
+    его статуса, поэтому статус достаточно узнать один раз на запрос.
+    """
+    
+    def __init__(self) -> None:
+        self._prices: dict[tuple[str, int], dict] = {
+            (status, days): _compute_price(status, days)
+            for status in Loyalty.DISCOUNTS
+            for days in BASE_PRICES
+        }
+    
+    def get(self, status: str, days: int) -> dict:
+        """Цены на период для статуса (копия, её можно менять)."""
+        price = self._prices.get((status, days))
+        if price is None:
+            # Нестандартный период или неизвестный статус — считаем и запоминаем
+            price = self._prices[(status, days)] = _compute_price(status, days)
+        return dict(price)
+    
+    def get_many(self, status: str, periods: list[int]) -> dict[int, dict]:
+        """Цены на несколько периодов для статуса — например, для клавиатуры покупки."""
+        return {days: self.get(status, days) for days in periods}
+
+
+# Single shared instance
+pricing_matrix = PricingMatrix()
+
+
+def resolve_loyalty_status(telegram_id: int, user: dict | None = None) -> str:
+    """
+    Статус лояльности пользователя. Если строка bot_users уже загружена
+    (BotUser.get_or_create), статус берётся из неё без обращения к БД.
+    """
+    if user is not None and 'loyalty_status' in user:
+        return user['loyalty_status'] or 'bronze'
+    return Loyalty.get_user_loyalty(telegram_id)['status']
+
+
+async def fetch_loyalty_status(telegram_id: int, user: dict | None = None) -> str:
+    """resolve_loyalty_status для корутин: без строки пользователя статус читается вне event loop."""
+    if user is not None and 'loyalty_status' in user:
+        return user['loyalty_status'] or 'bronze'
+    return (await Loyalty.aio.get_user_loyalty(telegram_id))['status']
+
+
+def get_price_with_discount(telegram_id: int, days: int, status: str | None = None) -> dict:
+    """
+    Получает цену с учётом скидки лояльности.
+    
+    Args:
+        status: статус лояльности, если уже известен (иначе читается из БД)
+    
+    Returns:
+        dict с ключами:
+        - base_price: базовая цена в рублях
+        - discounted_price: цена со скидкой в рублях
+        - discount: размер скидки в рублях
+        - stars_base: базовая цена в Stars
+        - stars_discounted: цена со скидкой в Stars
+    """
+    if status is None:
+        status = resolve_loyalty_status(telegram_id)
+    return pricing_matrix.get(status, days)
+
+
+def get_prices_with_discount(telegram_id: int, periods: list[int], status: str | None = None) -> dict[int, dict]:
+    """Цены со скидкой сразу на несколько периодов (статус читается не больше одного раза)."""
+    if status is None:
+        status = resolve_loyalty_status(telegram_id)
+    return pricing_matrix.get_many(status, periods)
+
+
+async def process_payment_loyalty(telegram_id: int, amount_rub: int) -> dict | None:
     """
     Обрабатывает платёж для системы лояльности.
     Начисляет баллы и проверяет повышение статуса.
@@ -67,7 +133,8 @@ def process_payment_loyalty(telegram_id: int, amount_rub: int) -> dict | None:
     Returns:
         dict с информацией об изменении статуса или None
     """
-    result = Loyalty.add_points(telegram_id, amount_rub)
+    result = await Loyalty.aio.add_points(telegram_id, amount_rub)
+    invalidate_user_cache(telegram_id)
     
     # Проверяем, был ли повышен статус
     if result['status'] != result['previous_status']:
@@ -116,7 +183,6 @@ def format_loyalty_profile_message(telegram_id: int, lang: str = 'ru') -> str:
     """
     Форматирует сообщение с профилем лояльности.
     """
-    i18n = get_i18n()
     profile = get_loyalty_profile(telegram_id)
     
     # Формируем текст о текущих скидках
@@ -124,23 +190,23 @@ def format_loyalty_profile_message(telegram_id: int, lang: str = 'ru') -> str:
     if profile['current_discounts']:
         discounts_text = "\n"
         for d in profile['current_discounts']:
-            period_name = i18n.t(f'period_{d["days"]}d', locale=lang)
+            period_name = t(f'period_{d["days"]}d', locale=lang)
             discounts_text += f"   • {period_name}: <s>{d['base_price']}₽</s> → <b>{d['final_price']}₽</b> (-{d['discount']}₽)\n"
     
     # Формируем текст о следующем статусе
     next_status_text = ""
     if profile['next_status_info']:
-        next_status_text = i18n.t(
+        next_status_text = t(
             'loyalty_next_status',
             locale=lang,
             next_status=profile['next_status_info']['next_status_name'],
             points_needed=profile['next_status_info']['points_needed']
         )
     else:
-        next_status_text = i18n.t('loyalty_max_status', locale=lang)
+        next_status_text = t('loyalty_max_status', locale=lang)
     
     # Собираем полное сообщение
-    message = i18n.t(
+    message = t(
         'loyalty_profile',
         locale=lang,
         status_name=profile['status_name'],
@@ -151,29 +217,3 @@ def format_loyalty_profile_message(telegram_id: int, lang: str = 'ru') -> str:
     )
     
     return message
-
-
-def get_price_display(telegram_id: int, days: int, lang: str = 'ru') -> str:
-    """
-    Возвращает отформатированную строку с ценой (со скидкой, если есть).
-    """
-    price_info = get_price_with_discount(telegram_id, days)
-    
-    if price_info['discount'] > 0:
-        # Есть скидка - показываем зачёркнутую цену и новую
-        return f"<s>{price_info['base_price']}₽</s> {price_info['discounted_price']}₽"
-    else:
-        return f"{price_info['base_price']}₽"
-
-
-def get_stars_display(telegram_id: int, days: int, lang: str = 'ru') -> str:
-    """
-    Возвращает отформатированную строку с ценой в Stars (со скидкой, если есть).
-    """
-    price_info = get_price_with_discount(telegram_id, days)
-    
-    if price_info['discount'] > 0:
-        return f"<s>{price_info['stars_base']}⭐</s> {price_info['stars_discounted']}⭐"
-    else:
-        return f"{price_info['stars_base']}⭐"
-
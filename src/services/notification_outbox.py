@@ -0,0 +1,328 @@
+"""Очередь исходящих уведомлений: отправка в фоне с лимитами Telegram и сводками при всплесках."""
+import asyncio
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from src.database import OutboxMessage
+from src.services.broadcast_service import TokenBucket
+from src.utils.logger import logger
+from src.utils.metrics import Gauge, registry
+
+# Сколько уведомлений может ждать отправки; при переполнении некритичные отбрасываются
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "1000"))
+# Сколько однотипных уведомлений, накопившихся для чата, сворачиваются в одну сводку
+NOTIFY_DIGEST_THRESHOLD = int(os.getenv("NOTIFY_DIGEST_THRESHOLD", "5"))
+# Лимит Telegram для групп — 20 сообщений в минуту
+NOTIFY_GROUP_RATE_PER_MINUTE = float(os.getenv("NOTIFY_GROUP_RATE_PER_MINUTE", "20"))
+# Сообщений в группу подряд без ожидания
+GROUP_BURST = 3
+# Одновременных отправок в разные чаты и общий лимит (рассылки ограничены отдельно)
+SENDERS = 4
+GLOBAL_RATE = 20
+MAX_ATTEMPTS = 3
+# Строк в сводке, остальные — одной строкой «и ещё N»
+DIGEST_MAX_ROWS = 30
+MESSAGE_LIMIT = 4096
+
+DIGEST_TITLES = {
+    "purchase": "💰 <b>Новые покупки: {count}</b>",
+    "gift": "🎁 <b>Подарочные подписки: {count}</b>",
+    "trial": "🎁 <b>Пробные подписки: {count}</b>",
+    "referral": "👥 <b>Реферальные бонусы: {count}</b>",
+    "user": "👤 <b>Изменения пользователей: {count}</b>",
+    "payment_failed": "⚠️ <b>Необработанные оплаты: {count}</b>",
+}
+
+
+@dataclass
+class Notification:
+    """
+    Исходящее сообщение.
+
+    kind — тип события для сводки (None — всегда отдельным сообщением),
+    summary — строка события в сводке. Критичные уведомления сохраняются
+    в notification_outbox и отправляются после перезапуска.
+    """
+
+    chat_id: int
+    text: str
+    parse_mode: Optional[str] = "HTML"
+    thread_id: Optional[int] = None
+    reply_markup: Optional[InlineKeyboardMarkup] = None
+    kind: Optional[str] = None
+    summary: Optional[str] = None
+    critical: bool = False
+    outbox_id: Optional[int] = None
+    created_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Notification":
+        markup = row.get("reply_markup")
+        return cls(
+            chat_id=row["chat_id"],
+            text=row["text"],
+            parse_mode=row.get("parse_mode"),
+            thread_id=row.get("thread_id"),
+            reply_markup=InlineKeyboardMarkup.model_validate_json(markup) if markup else None,
+            kind=row.get("kind"),
+            summary=row.get("summary"),
+            critical=True,
+            outbox_id=row["id"],
+        )
+
+
+def build_digest(batch: list[Notification]) -> str:
+    """Одно сообщение вместо нескольких однотипных: заголовок по каждому типу и строки событий."""
+    minutes = max(1, round((time.time() - batch[0].created_at) / 60))
+    groups: dict[str, list[Notification]] = {}
+    for notification in batch:
+        groups.setdefault(notification.kind, []).append(notification)
+
+    lines = [f"📬 <b>Сводка за {minutes} мин.</b>"]
+    for kind, items in groups.items():
+        title = DIGEST_TITLES.get(kind, "🔔 <b>{kind}: {count}</b>")
+        lines.append("")
+        lines.append(title.format(kind=kind, count=len(items)))
+        rows = [f"• {item.summary or '—'}" for item in items[:DIGEST_MAX_ROWS]]
+        lines.extend(rows)
+        if len(items) > DIGEST_MAX_ROWS:
+            lines.append(f"… и ещё {len(items) - DIGEST_MAX_ROWS}")
+
+    text = "\n".join(lines)
+    if len(text) > MESSAGE_LIMIT:
+        # Режем по строкам, чтобы не разорвать HTML-теги
+        text = text[:MESSAGE_LIMIT - 2].rsplit("\n", 1)[0] + "\n…"
+    return text
+
+
+def _message_kwargs(notification: Notification, text: Optional[str] = None) -> dict:
+    kwargs = {"chat_id": notification.chat_id, "text": text or notification.text}
+    if text:
+        kwargs["parse_mode"] = "HTML"
+    else:
+        kwargs["parse_mode"] = notification.parse_mode
+        if notification.reply_markup is not None:
+            kwargs["reply_markup"] = notification.reply_markup
+    if notification.thread_id:
+        kwargs["message_thread_id"] = notification.thread_id
+    return kwargs
+
+
+async def send_notification(bot: Bot, notification: Notification) -> bool:
+    """Отправляет уведомление сразу, без очереди."""
+    try:
+        await bot.send_message(**_message_kwargs(notification))
+        return True
+    except Exception as e:
+        logger.warning("Failed to send notification to chat %s: %s", notification.chat_id, e)
+        return False
+
+
+class NotificationOutbox:
+    """
+    Уведомления админам и пользователям, отправляемые в фоне.
+
+    submit только ставит сообщение в очередь своего чата и сразу
+    возвращается. Очередь каждого чата разбирает отдельная задача с учётом
+    лимитов Telegram (сообщение в секунду в личный чат, NOTIFY_GROUP_RATE_PER_MINUTE
+    в группу). Пока задача ждёт лимит, однотипные уведомления копятся; если
+    их набралось NOTIFY_DIGEST_THRESHOLD, уходит одна сводка.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = NOTIFY_QUEUE_SIZE,
+        digest_threshold: int = NOTIFY_DIGEST_THRESHOLD,
+        group_rate_per_minute: float = NOTIFY_GROUP_RATE_PER_MINUTE,
+        senders: int = SENDERS,
+    ) -> None:
+        self.queue_size = queue_size
+        self.digest_threshold = digest_threshold
+        self.group_rate = group_rate_per_minute / 60
+        self._pending: dict[int, deque[Notification]] = {}
+        self._size = 0
+        self._buckets: dict[int, TokenBucket] = {}
+        self._global = TokenBucket(GLOBAL_RATE)
+        self._senders = asyncio.Semaphore(senders)
+        self._tasks: dict[int, asyncio.Task] = {}
+        self.bot: Optional[Bot] = None
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self.bot is not None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def submit(self, notification: Notification) -> bool:
+        """Ставит уведомление в очередь. False — очередь переполнена и уведомление отброшено."""
+        if not notification.critical and self._size >= self.queue_size:
+            self.dropped += 1
+            logger.warning("Notification queue is full (%d), dropping message to chat %s", self._size, notification.chat_id)
+            return False
+        if notification.critical and notification.outbox_id is None:
+            # Критичные (оплаты) принимаются всегда и сначала сохраняются в БД
+            notification.outbox_id = await OutboxMessage.aio.create(
+                chat_id=notification.chat_id,
+                text=notification.text,
+                parse_mode=notification.parse_mode,
+                thread_id=notification.thread_id,
+                reply_markup=notification.reply_markup.model_dump_json(exclude_none=True) if notification.reply_markup else None,
+                kind=notification.kind,
+                summary=notification.summary,
+            )
+        self._put(notification)
+        return True
+
+    def _put(self, notification: Notification) -> None:
+        self._pending.setdefault(notification.chat_id, deque()).append(notification)
+        self._size += 1
+        if self.running and notification.chat_id not in self._tasks:
+            self._start_drain(notification.chat_id)
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные ID — группы и каналы
+            bucket = TokenBucket(self.group_rate, GROUP_BURST) if chat_id < 0 else TokenBucket(1.0)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _start_drain(self, chat_id: int) -> None:
+        task = asyncio.create_task(self._drain(chat_id), name=f"notify-{chat_id}")
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda _task: self._on_drained(chat_id))
+
+    def _on_drained(self, chat_id: int) -> None:
+        self._tasks.pop(chat_id, None)
+        if self._pending.get(chat_id):
+            # Сообщение пришло, пока задача завершалась
+            if self.running:
+                self._start_drain(chat_id)
+            return
+        self._pending.pop(chat_id, None)
+        if chat_id > 0:
+            # Лимиты личных чатов не храним: пользователей много, сообщений им мало
+            self._buckets.pop(chat_id, None)
+
+    def _take(self, queue: deque[Notification]) -> list[Notification]:
+        """Следующее сообщение или сводка из накопившихся однотипных уведомлений."""
+        first = queue[0]
+        digestible = 0
+        for notification in queue:
+            if notification.kind is None or notification.thread_id != first.thread_id:
+                break
+            digestible += 1
+        count = digestible if digestible >= self.digest_threshold else 1
+        return [queue.popleft() for _ in range(count)]
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._pending[chat_id]
+        bucket = self._bucket(chat_id)
+        while queue:
+            # Пока ждём лимит чата, новые уведомления копятся и уходят сводкой
+            await bucket.acquire()
+            batch = self._take(queue)
+            self._size -= len(batch)
+            async with self._senders:
+                await self._global.acquire()
+                await self._deliver(bucket, batch)
+
+    async def _deliver(self, bucket: TokenBucket, batch: list[Notification]) -> None:
+        first = batch[0]
+        kwargs = _message_kwargs(first, build_digest(batch) if len(batch) > 1 else None)
+        delivered = False
+        retryable = False
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                await self.bot.send_message(**kwargs)
+                delivered = True
+                break
+            except TelegramRetryAfter as e:
+                logger.warning("Notifications to chat %s hit flood limit, pausing for %ss", first.chat_id, e.retry_after)
+                retryable = True
+                bucket.pause(e.retry_after)
+                await bucket.acquire()
+            except TelegramNetworkError as e:
+                logger.warning("Network error sending notification to chat %s: %s", first.chat_id, e)
+                retryable = True
+                await asyncio.sleep(0.5 * (2 ** attempt))
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. — повтор не поможет
+                logger.warning("Failed to send notification to chat %s: %s", first.chat_id, e)
+                retryable = False
+                break
+            except Exception as e:
+                logger.exception("Unexpected error sending notification to chat %s: %s", first.chat_id, e)
+                retryable = False
+                break
+
+        if not delivered and retryable:
+            retry = [n for n in batch if n.critical]
+            if retry:
+                # Telegram недоступен — критичные возвращаются в начало очереди чата
+                self._pending.setdefault(first.chat_id, deque()).extendleft(reversed(retry))
+                self._size += len(retry)
+                batch = [n for n in batch if not n.critical]
+        sent_ids = [n.outbox_id for n in batch if n.outbox_id is not None]
+        if sent_ids:
+            try:
+                await OutboxMessage.aio.delete_many(sent_ids)
+            except Exception as e:
+                logger.warning("Failed to remove sent notifications from outbox: %s", e)
+
+    async def start(self, bot: Bot) -> None:
+        """Запускает отправку и возвращает в очередь критичные уведомления, не отправленные до перезапуска."""
+        self.bot = bot
+        queued = {n.outbox_id for queue in self._pending.values() for n in queue if n.outbox_id is not None}
+        restored = 0
+        for row in await OutboxMessage.aio.get_all():
+            if row["id"] not in queued:
+                self._put(Notification.from_row(row))
+                restored += 1
+        if restored:
+            logger.info("Restored %d unsent notifications from outbox", restored)
+        for chat_id, queue in self._pending.items():
+            if queue and chat_id not in self._tasks:
+                self._start_drain(chat_id)
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """
+        Даёт очереди отправиться (не дольше timeout) и останавливает отправку.
+        Неотправленные критичные уведомления остаются в БД.
+        """
+        deadline = time.monotonic() + timeout
+        while self._tasks and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        self.bot = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._size:
+            logger.warning("%d notifications were not sent before shutdown", self._size)
+
+
+# Single shared instance
+notification_outbox = NotificationOutbox()
+
+registry.register(Gauge(
+    "notification_outbox_size", "Notifications queued but not sent yet.",
+    collect=lambda: {(): notification_outbox.size},
+))
+
+
+async def enqueue_notification(bot: Bot, notification: Notification) -> bool:
+    """Ставит уведомление в очередь; если очередь не запущена (скрипты), отправляет сразу."""
+    if notification_outbox.running:
+        return await notification_outbox.submit(notification)
+    return await send_notification(bot, notification)
@@ -11,18 +11,24 @@ from src.utils.logger import logger
 async def send_admin_notification(
     bot: Bot,
     text: str,
-    parse_mode: str = "HTML"
+    parse_mode: str = "HTML",
+    kind: Optional[str] = None,
+    summary: Optional[str] = None,
+    critical: bool = False
 ) -> bool:
     """
-    Отправляет уведомление в админский канал/группу.
+    Ставит уведомление в очередь отправки в админский канал/группу.
     
     Args:
         bot: Экземпляр бота
         text: Текст уведомления
         parse_mode: Режим парсинга (HTML/Markdown)
+        kind: Тип события для сводки при всплеске (см. notification_outbox.DIGEST_TITLES)
+        summary: Строка события в сводке
+        critical: Сохранить в БД до отправки (оплаты)
     
     Returns:
-        True если отправлено, False если не настроено или ошибка
+        True если принято к отправке, False если не настроено или очередь переполнена
     """
     settings = get_settings()
     chat_id = settings.notifications_chat_id
@@ -32,20 +38,30 @@ async def send_admin_notification(
         logger.debug("Notifications disabled: NOTIFICATIONS_CHAT_ID not set")
         return False
     
-    try:
-        # Если указан topic_id, отправляем в топик (для групп с темами)
-        kwargs = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
-        if topic_id:
-            kwargs["message_thread_id"] = topic_id
-        
-        await bot.send_message(**kwargs)
-        logger.debug("Admin notification sent to chat_id=%s topic_id=%s", chat_id, topic_id)
-        return True
-        
-    except Exception as e:
-        # Не критичная ошибка - просто не настроен чат для уведомлений
-        logger.warning("Failed to send admin notification: %s", str(e))
-        return False
+    from src.services.notification_outbox import Notification, enqueue_notification
+    
+    # Если указан topic_id, отправляем в топик (для групп с темами)
+    return await enqueue_notification(bot, Notification(
+        chat_id=chat_id,
+        text=text,
+        parse_mode=parse_mode,
+        thread_id=topic_id or None,
+        kind=kind,
+        summary=summary,
+        critical=critical,
+    ))
+
+
+async def send_user_message(bot: Bot, user_id: int, text: str, keyboard=None) -> bool:
+    """Сообщение пользователю об оплате: через очередь, с сохранением до отправки."""
+    from src.services.notification_outbox import Notification, enqueue_notification
+    
+    return await enqueue_notification(bot, Notification(
+        chat_id=user_id,
+        text=text,
+        reply_markup=keyboard,
+        critical=True,
+    ))
 
 
 async def notify_trial_activation(
@@ -68,7 +84,9 @@ async def notify_trial_activation(
         f"📅 Время: {timestamp}"
     )
     
-    await send_admin_notification(bot, text)
+    await send_admin_notification(
+        bot, text, kind="trial", summary=f"{user_mention} · {trial_days} дн."
+    )
 
 
 async def notify_payment_success(
@@ -99,7 +117,10 @@ async def notify_payment_success(
         f"📅 Время: {timestamp}"
     )
     
-    await send_admin_notification(bot, admin_text)
+    await send_admin_notification(
+        bot, admin_text, kind="purchase",
+        summary=f"{user_mention} · {subscription_months} мес. · {stars}⭐", critical=True
+    )
     
     # Форматируем дату для отображения (только дата, без времени)
     expire_formatted = expire_date
@@ -125,8 +146,8 @@ async def notify_payment_success(
             [InlineKeyboardButton(text="🔐 Мой доступ", callback_data="user:my_access")]
         ])
         
-        await bot.send_message(user_id, user_text, parse_mode="HTML", reply_markup=keyboard)
-        logger.info(f"Payment success notification sent to user {user_id}")
+        await send_user_message(bot, user_id, user_text, keyboard)
+        logger.info(f"Payment success notification queued for user {user_id}")
     except Exception as e:
         logger.warning(f"Failed to send payment notification to user {user_id}: {e}")
 
@@ -159,7 +180,10 @@ async def notify_yookassa_payment_success(
         f"📅 Время: {timestamp}"
     )
     
-    await send_admin_notification(bot, admin_text)
+    await send_admin_notification(
+        bot, admin_text, kind="purchase",
+        summary=f"{user_mention} · {subscription_months} мес. · {amount_rub}₽", critical=True
+    )
     
     # Форматируем дату для отображения (только дата, без времени)
     expire_formatted = expire_date
@@ -186,8 +210,8 @@ async def notify_yookassa_payment_success(
             [InlineKeyboardButton(text="🔐 Мой доступ", callback_data="user:my_access")]
         ])
         
-        await bot.send_message(user_id, user_text, parse_mode="HTML", reply_markup=keyboard)
-        logger.info(f"YooKassa payment success notification sent to user {user_id}")
+        await send_user_message(bot, user_id, user_text, keyboard)
+        logger.info(f"YooKassa payment success notification queued for user {user_id}")
     except Exception as e:
         logger.warning(f"Failed to send YooKassa payment notification to user {user_id}: {e}")
 
@@ -217,7 +241,10 @@ async def notify_referral_bonus(
         f"📅 Время: {timestamp}"
     )
     
-    await send_admin_notification(bot, text)
+    await send_admin_notification(
+        bot, text, kind="referral",
+        summary=f"{referrer_mention} ← {referred_mention} · +{bonus_days} дн."
+    )
 
 
 
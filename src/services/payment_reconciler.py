@@ -0,0 +1,111 @@
+"""Фоновая сверка ожидающих платежей YooKassa (на случай пропущенного вебхука)."""
+import asyncio
+import os
+from typing import Optional
+
+from src.database import Payment
+from src.services.bootstrap_cache import invalidate_user_cache
+from src.services.fanout import fan_out
+from src.utils.logger import logger
+
+# Одновременных запросов к YooKassa при сверке
+RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "5"))
+# Через сколько часов неоплаченный платёж считается истёкшим
+EXPIRE_HOURS = float(os.getenv("PAYMENT_EXPIRE_HOURS", "24"))
+# Платежи моложе минуты не трогаем: пользователь ещё на странице оплаты
+MIN_AGE_SECONDS = 60
+# Ступени проверки: (платёж моложе N секунд, проверять не чаще раза в M секунд)
+RECONCILE_TIERS = (
+    (10 * 60, 60),
+    (60 * 60, 5 * 60),
+    (None, 30 * 60),
+)
+BATCH_SIZE = 500
+# Ограничение на запрос статуса в YooKassa. Выдачу подписки таймаутом не прерываем:
+# отмена между продлением в панели и Payment.complete продлила бы подписку дважды
+CHECK_TIMEOUT = 30
+
+
+class PaymentReconciler:
+    """Проверяет ожидающие платежи в YooKassa по ступеням и завершает оплаченные."""
+
+    def __init__(self, bot=None, concurrency: int = RECONCILE_CONCURRENCY, expire_hours: float = EXPIRE_HOURS) -> None:
+        self.bot = bot
+        self.concurrency = concurrency
+        self.expire_seconds = expire_hours * 3600
+
+    async def _reconcile_one(self, payment: dict) -> Optional[str]:
+        """Сверяет один платёж. Возвращает новый статус или None, если платёж ещё ожидает."""
+        from src.services.yookassa_service import check_yookassa_payment_status
+
+        yookassa_status = await asyncio.wait_for(
+            check_yookassa_payment_status(payment["yookassa_payment_id"]), CHECK_TIMEOUT
+        )
+        status = yookassa_status.get("status")
+        if status == "succeeded" and yookassa_status.get("paid"):
+            if (payment.get("invoice_payload") or "").startswith("yookassa_gift:"):
+                from src.services.yookassa_service import process_yookassa_gift_payment
+                result = await process_yookassa_gift_payment(payment["yookassa_payment_id"], self.bot, verified=True)
+            else:
+                from src.services.yookassa_service import process_yookassa_payment
+                result = await process_yookassa_payment(payment["yookassa_payment_id"], self.bot, verified=True)
+            if result.get("in_progress"):
+                # Платёж прямо сейчас выдаёт вебхук или хаб статусов
+                return None
+            if not result.get("success"):
+                raise RuntimeError(result.get("error") or "processing failed")
+            logger.info("Reconciled paid YooKassa payment %s (missed webhook)", payment["id"])
+            return "completed"
+        # Вебхук или хаб статусов мог завершить платёж, пока шёл запрос к YooKassa
+        if status == "canceled":
+            new_status = "failed"
+        elif payment["age_seconds"] >= self.expire_seconds:
+            new_status = "expired"
+        else:
+            return None
+        if not await Payment.aio.close_pending(payment["id"], new_status):
+            return None
+        invalidate_user_cache(payment["user_id"])
+        return new_status
+
+    async def run_once(self) -> dict:
+        """Один проход сверки. Возвращает количество платежей по итогам."""
+        from src.services.payment_status_hub import payment_status_hub
+
+        due = await Payment.aio.get_pending_yookassa(MIN_AGE_SECONDS, RECONCILE_TIERS, BATCH_SIZE)
+        summary = {"checked": len(due), "completed": 0, "failed": 0, "expired": 0, "errors": 0}
+        if not due:
+            return summary
+
+        async def reconcile(payment: dict) -> None:
+            new_status = await self._reconcile_one(payment)
+            if new_status:
+                summary[new_status] += 1
+                await payment_status_hub.refresh(payment["id"])
+
+        # Следующая ступень повторит проверку, поэтому здесь без повторов
+        report = await fan_out(due, reconcile, concurrency=self.concurrency, timeout=None, retries=0)
+        for payment, error in report.failed:
+            summary["errors"] += 1
+            logger.warning("Payment %s reconciliation failed: %s", payment["id"], error)
+        await Payment.aio.mark_checked([payment["id"] for payment in due])
+        return summary
+
+
+async def start_payment_reconciler(bot, interval_seconds: int = RECONCILE_TIERS[0][1]) -> None:
+    """Фоновая задача сверки ожидающих платежей YooKassa."""
+    from src.services.yookassa_service import init_yookassa
+
+    if not init_yookassa():
+        logger.info("YooKassa is not configured, payment reconciler disabled")
+        return
+    reconciler = PaymentReconciler(bot)
+    logger.info("Starting payment reconciler (interval: %d seconds)", interval_seconds)
+    while True:
+        try:
+            summary = await reconciler.run_once()
+            if summary["checked"]:
+                logger.info("Payment reconciliation: %s", summary)
+        except Exception as e:
+            logger.exception("Error in payment reconciler loop: %s", e)
+        await asyncio.sleep(interval_seconds)
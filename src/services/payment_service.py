@@ -1,21 +1,27 @@
 """Сервис для работы с платежами через Telegram Stars."""
+import asyncio
+import html
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 
 from aiogram import Bot
 from aiogram.types import LabeledPrice
 
 from src.config import get_settings
-from src.database import GiftCode, Payment
+from src.database import BotUser, GiftCode, Payment
+from src.services.bootstrap_cache import invalidate_user_cache
 from src.utils.logger import logger
 from src.utils.datetime_utils import to_utc_iso
 
 
-def get_stars_amount(subscription_months: int, user_id: int | None = None) -> int:
+def get_stars_amount(subscription_months: int, user_id: int | None = None, status: str | None = None) -> int:
     """Получить стоимость подписки в Stars с учётом скидки лояльности.
     
     Args:
         subscription_months: Количество месяцев
         user_id: ID пользователя для расчёта скидки (None — без скидки)
+        status: статус лояльности, если уже известен (иначе читается из БД)
     
     Returns:
         Цена в Stars
@@ -35,7 +41,7 @@ def get_stars_amount(subscription_months: int, user_id: int | None = None) -> in
     # Применяем скидку лояльности
     from src.services.loyalty_service import get_price_with_discount
     days = subscription_months * 30
-    price_info = get_price_with_discount(user_id, days)
+    price_info = get_price_with_discount(user_id, days, status)
     
     return price_info['stars_discounted']
 
@@ -55,7 +61,8 @@ def get_stars_amount_base(subscription_months: int) -> int:
 async def create_subscription_invoice(
     bot: Bot,
     user_id: int,
-    subscription_months: int
+    subscription_months: int,
+    status: str | None = None
 ) -> str:
     """Создает ссылку на оплату подписки через Telegram Stars.
     
@@ -81,7 +88,10 @@ async def create_subscription_invoice(
         raise ValueError(f"Invalid subscription months: {subscription_months}")
     
     # Применяем скидку лояльности
-    stars = get_stars_amount(subscription_months, user_id)
+    if status is None:
+        from src.services.loyalty_service import fetch_loyalty_status
+        status = await fetch_loyalty_status(user_id)
+    stars = get_stars_amount(subscription_months, user_id, status)
     subscription_days = subscription_months * 30
     
     if stars < base_stars:
@@ -95,12 +105,13 @@ async def create_subscription_invoice(
     invoice_payload = f"{user_id}:{subscription_months}:{stars}"
     
     # Создаем запись о платеже
-    payment_id = Payment.create(
+    payment_id = await Payment.aio.create(
         user_id=user_id,
         stars=stars,
         invoice_payload=invoice_payload,
         subscription_days=subscription_days
     )
+    invalidate_user_cache(user_id)
     
     # Описание подписки
     locale_map = {
@@ -139,321 +150,453 @@ async def create_subscription_invoice(
             subscription_months,
         )
         # Обновляем статус платежа на failed
-        Payment.update_status(payment_id, "failed")
+        await Payment.aio.update_status(payment_id, "failed")
+        invalidate_user_cache(user_id)
         raise
 
 
-async def process_successful_payment(
+@dataclass
+class _PaymentLock:
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    users: int = 0
+
+
+_payment_locks: dict[int, _PaymentLock] = {}
+
+
+@asynccontextmanager
+async def payment_lock(payment_id: int):
+    """
+    Не даёт обрабатывать один платеж параллельно: webhook YooKassa, кнопка
+    «Проверить оплату» и Mini App могут прийти одновременно.
+    """
+    entry = _payment_locks.get(payment_id)
+    if entry is None:
+        entry = _payment_locks[payment_id] = _PaymentLock()
+    entry.users += 1
+    try:
+        async with entry.lock:
+            yield
+    finally:
+        entry.users -= 1
+        if not entry.users:
+            _payment_locks.pop(payment_id, None)
+
+
+def _squad_fields(settings) -> dict:
+    """Сквады по умолчанию в формате update_user."""
+    fields = {}
+    if settings.default_external_squad_uuid:
+        fields["externalSquadUuid"] = settings.default_external_squad_uuid
+    if settings.default_internal_squads:
+        fields["activeInternalSquads"] = settings.default_internal_squads
+    return fields
+
+
+def _has_squads(user_info: dict, squad_fields: dict) -> bool:
+    """Применены ли к пользователю панели нужные сквады."""
+    external = squad_fields.get("externalSquadUuid")
+    if external and user_info.get("externalSquadUuid") != external:
+        return False
+    internal = squad_fields.get("activeInternalSquads")
+    if internal:
+        active = {
+            squad.get("uuid") if isinstance(squad, dict) else squad
+            for squad in user_info.get("activeInternalSquads") or []
+        }
+        if not set(internal) <= active:
+            return False
+    return True
+
+
+def _is_user_exists_error(create_error: Exception) -> bool:
+    """Ошибка create_user из-за того, что пользователь уже есть в панели."""
+    error_str = str(create_error).lower()
+    cause_str = ""
+    response_text = ""
+    
+    # Извлекаем информацию из оригинального исключения (HTTPStatusError)
+    if hasattr(create_error, '__cause__') and create_error.__cause__:
+        original_exc = create_error.__cause__
+        cause_str = str(original_exc).lower()
+        
+        # Пытаемся получить текст ответа API
+        if hasattr(original_exc, 'response'):
+            try:
+                if hasattr(original_exc.response, 'text'):
+                    response_text = original_exc.response.text.lower()
+                elif hasattr(original_exc.response, 'content'):
+                    try:
+                        response_text = original_exc.response.content.decode('utf-8').lower()
+                    except:
+                        pass
+            except:
+                pass
+    
+    # Проверяем различные варианты сообщения об ошибке
+    return (
+        "already exists" in error_str or 
+        "username" in error_str or 
+        "already exists" in cause_str or 
+        "username" in cause_str or
+        "already exists" in response_text or 
+        "username" in response_text or
+        "a019" in response_text  # A019 - код ошибки "User username already exists"
+    )
+
+
+def _is_transient_error(exc: Exception) -> bool:
+    """
+    Временная ошибка выдачи подписки (панель или сеть недоступны, БД занята).
+    Оплаченный платёж после неё остаётся pending, и сверка повторит выдачу.
+    """
+    import sqlite3
+
+    import httpx
+
+    from src.services.api_client import ApiClientError, PanelUnavailableError
+
+    if isinstance(exc, (PanelUnavailableError, asyncio.TimeoutError, OSError, sqlite3.OperationalError)):
+        return True
+    if isinstance(exc, ApiClientError):
+        cause = exc.__cause__
+        if isinstance(cause, httpx.TransportError):
+            return True
+        if isinstance(cause, httpx.HTTPStatusError) and cause.response.status_code >= 500:
+            return True
+    return False
+
+
+async def _provision_subscription(user_id: int, username: str, remnawave_uuid: str | None, subscription_days: int) -> tuple[str, dict, str]:
+    """
+    Создаёт или продлевает пользователя в Remnawave.
+    
+    Returns:
+        (uuid пользователя, данные пользователя из последнего ответа панели, дата истечения)
+    """
+    from src.services.api_client import api_client
+    settings = get_settings()
+    squad_fields = _squad_fields(settings)
+    
+    # Вычисляем дату истечения
+    expire_date = to_utc_iso(datetime.utcnow() + timedelta(days=subscription_days))
+    
+    if remnawave_uuid:
+        # Обновляем существующего пользователя: срок и сквады одним запросом
+        try:
+            user_data = await api_client.get_user_by_uuid(remnawave_uuid)
+            current_expire = user_data.get("response", {}).get("expireAt")
+            if current_expire:
+                # Продлеваем подписку от текущей даты
+                current_dt = datetime.fromisoformat(current_expire.replace("Z", "+00:00"))
+                if current_dt.replace(tzinfo=None) > datetime.utcnow():
+                    expire_date = to_utc_iso(current_dt.replace(tzinfo=None) + timedelta(days=subscription_days))
+            
+            try:
+                updated = await api_client.update_user(remnawave_uuid, expireAt=expire_date, **squad_fields)
+            except Exception as squad_exc:
+                if not squad_fields:
+                    raise
+                logger.warning("Failed to apply squads to existing user %s: %s", remnawave_uuid, squad_exc)
+                updated = await api_client.update_user(remnawave_uuid, expireAt=expire_date)
+            return remnawave_uuid, updated.get("response", updated), expire_date
+        except Exception as e:
+            logger.error(f"Failed to update user {remnawave_uuid}: {e}")
+    
+    # Создаем нового пользователя
+    internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
+    logger.info(
+        "Creating payment user for %d: external_squad=%s, internal_squads=%s",
+        user_id, settings.default_external_squad_uuid, internal_squads
+    )
+    try:
+        user_data = await api_client.create_user(
+            username=username,
+            expire_at=expire_date,
+            telegram_id=user_id,
+            external_squad_uuid=settings.default_external_squad_uuid,
+            active_internal_squads=internal_squads,
+        )
+        user_info = user_data.get("response", user_data)
+        user_uuid = user_info.get("uuid")
+    except Exception as create_error:
+        # Если пользователь уже существует (например, по username), находим его по telegram_id
+        if not _is_user_exists_error(create_error):
+            logger.error("User creation failed with unexpected error: %s", create_error)
+            raise
+        logger.warning("User creation failed (likely already exists), trying to find by telegram_id: %s", create_error)
+        try:
+            existing_user = await api_client.get_user_by_telegram_id(user_id)
+            user_uuid = existing_user.get("response", existing_user).get("uuid")
+            if not user_uuid:
+                logger.error("User found by telegram_id but no UUID returned")
+                raise create_error
+            logger.info("Found existing user by telegram_id: %s", user_uuid)
+            # Обновляем дату окончания подписки и сквады
+            updated = await api_client.update_user(user_uuid, expireAt=expire_date, **squad_fields)
+            user_info = updated.get("response", updated)
+        except Exception as find_error:
+            logger.error("Failed to find user by telegram_id: %s", find_error)
+            raise create_error
+    
+    await BotUser.aio.set_remnawave_uuid(user_id, user_uuid)
+    
+    # Повторно применяем сквады, только если панель проигнорировала их при создании
+    if squad_fields and not _has_squads(user_info, squad_fields):
+        try:
+            updated = await api_client.update_user(user_uuid, **squad_fields)
+            user_info = updated.get("response", updated)
+            logger.info("Applied squads on payment user %s: %s", user_uuid, squad_fields)
+        except Exception as squad_exc:
+            logger.warning("Failed to apply squads on payment user %s: %s", user_uuid, squad_exc)
+    
+    return user_uuid, user_info, expire_date
+
+
+async def complete_subscription_payment(
+    payment_id: int,
     user_id: int,
-    invoice_payload: str,
-    total_amount: int,
+    subscription_months: int,
+    subscription_days: int,
+    stars: int = 0,
     bot: Bot | None = None
 ) -> dict:
-    """Обрабатывает успешный платеж и создает пользователя в Remnawave.
+    """Выдаёт подписку по оплаченному платежу — общий путь для Stars и YooKassa.
+    
+    Перед выдачей платеж захватывается (pending → processing) одним UPDATE в БД,
+    поэтому повторный вызов для того же платежа — в том числе из другого
+    процесса — вернёт already_completed или in_progress, а не продлит
+    подписку второй раз.
     
     Args:
+        payment_id: ID платежа в БД
         user_id: ID пользователя Telegram
-        invoice_payload: Payload из invoice
-        total_amount: Общая сумма в Stars
+        subscription_months: Количество месяцев подписки
+        subscription_days: Количество дней подписки
+        stars: Сумма в Stars для уведомления (0 для YooKassa)
     
     Returns:
-        Словарь с результатом (success, user_uuid, subscription_url, error)
+        Словарь с результатом (success, user_uuid, subscription_url, expire_date, error)
     """
-    try:
-        # Парсим короткий payload формата: user_id:months:stars
-        parts = invoice_payload.split(":")
-        if len(parts) < 3:
-            logger.error(f"Invalid payload format: {invoice_payload}")
-            return {"success": False, "error": "Invalid payload format"}
-        
-        payload_user_id = int(parts[0])
-        subscription_months = int(parts[1])
-        payload_stars = int(parts[2])
-        
-        subscription_days = subscription_months * 30
-        
-        # Проверяем user_id
-        if payload_user_id != user_id:
-            logger.error(f"User ID mismatch: payload={payload_user_id}, actual={user_id}")
-            return {"success": False, "error": "User ID mismatch"}
-        
-        # Находим платеж в БД
-        payment = Payment.get_by_payload(invoice_payload)
+    async with payment_lock(payment_id):
+        payment = await Payment.aio.get(payment_id)
         if not payment:
-            logger.error(f"Payment not found for payload: {invoice_payload}")
+            logger.error(f"Payment {payment_id} not found")
             return {"success": False, "error": "Payment not found"}
         
         if payment["status"] == "completed":
-            logger.warning(f"Payment {payment['id']} already completed")
+            logger.warning(f"Payment {payment_id} already completed")
             return {
                 "success": True,
                 "user_uuid": payment["remnawave_user_uuid"],
                 "already_completed": True
             }
         
-        # Проверяем сумму (допускаем небольшую погрешность)
-        if abs(payment["stars"] - total_amount) > 1:
-            logger.error(f"Amount mismatch: expected {payment['stars']}, got {total_amount}")
-            Payment.update_status(payment["id"], "failed")
-            return {"success": False, "error": "Amount mismatch"}
-        
-        # Получаем информацию о пользователе
-        from src.database import BotUser
-        bot_user = BotUser.get_or_create(user_id, None)
-        username = bot_user.get("username") or f"user_{user_id}"
-        
-        # Вычисляем дату истечения
-        expire_date = to_utc_iso(datetime.utcnow() + timedelta(days=subscription_days))
+        if not await Payment.aio.claim(payment_id):
+            payment = await Payment.aio.get(payment_id)
+            status = payment["status"] if payment else None
+            if status == "completed":
+                logger.warning(f"Payment {payment_id} already completed")
+                return {
+                    "success": True,
+                    "user_uuid": payment["remnawave_user_uuid"],
+                    "already_completed": True
+                }
+            if status == "processing":
+                logger.warning(f"Payment {payment_id} is already being processed")
+                return {"success": False, "error": "Payment is already being processed", "in_progress": True}
+            logger.error(f"Payment {payment_id} cannot be processed in status {status}")
+            return {"success": False, "error": f"Payment is {status}"}
         
-        # Создаем пользователя в Remnawave
-        from src.services.api_client import api_client
-        settings = get_settings()
-        
-        # Проверяем, есть ли уже пользователь
-        remnawave_uuid = bot_user.get("remnawave_user_uuid")
-        
-        if remnawave_uuid:
-            # Обновляем существующего пользователя
-            try:
-                user_data = await api_client.get_user_by_uuid(remnawave_uuid)
-                current_expire = user_data.get("response", {}).get("expireAt")
-                # Убедимся, что нужные сквады применены
-                try:
-                    desired_external = settings.default_external_squad_uuid
-                    desired_internal = settings.default_internal_squads or None
-                    if desired_external or desired_internal:
-                        await api_client.update_user(
-                            remnawave_uuid,
-                            externalSquadUuid=desired_external,
-                            activeInternalSquads=desired_internal,
-                        )
-                        logger.info(
-                            "Applied squads to existing user %s: external=%s internal=%s",
-                            remnawave_uuid, desired_external, desired_internal
-                        )
-                except Exception as squad_exc:
-                    logger.warning("Failed to apply squads to existing user %s: %s", remnawave_uuid, squad_exc)
-                
-                if current_expire:
-                    # Продлеваем подписку от текущей даты
-                    current_dt = datetime.fromisoformat(current_expire.replace("Z", "+00:00"))
-                    if current_dt.replace(tzinfo=None) > datetime.utcnow():
-                        expire_date = to_utc_iso(current_dt.replace(tzinfo=None) + timedelta(days=subscription_days))
-                
-                await api_client.update_user(remnawave_uuid, expireAt=expire_date)
-                user_uuid = remnawave_uuid
-            except Exception as e:
-                logger.error(f"Failed to update user {remnawave_uuid}: {e}")
-                # Создаем нового пользователя
-                # Подготавливаем сквады
-                internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
-                
-                # Логируем, что передаем при создании пользователя
-                logger.info(
-                    "Creating payment user for %d: external_squad=%s, internal_squads=%s (type=%s, len=%s)",
-                    user_id,
-                    settings.default_external_squad_uuid,
-                    internal_squads,
-                    type(internal_squads).__name__ if internal_squads else "None",
-                    len(internal_squads) if internal_squads else 0
-                )
-                
-                user_data = await api_client.create_user(
-                    username=username,
-                    expire_at=expire_date,
-                    telegram_id=user_id,
-                    external_squad_uuid=settings.default_external_squad_uuid,
-                    active_internal_squads=internal_squads,
-                )
-                user_info = user_data.get("response", user_data)
-                user_uuid = user_info.get("uuid")
-                BotUser.set_remnawave_uuid(user_id, user_uuid)
-        else:
-            # Создаем нового пользователя
-            # Подготавливаем сквады
-            internal_squads = settings.default_internal_squads if settings.default_internal_squads else None
+        try:
+            # Получаем информацию о пользователе
+            bot_user = await BotUser.aio.get_or_create(user_id, None)
+            username = bot_user.get("username") or f"user_{user_id}"
             
-            try:
-                user_data = await api_client.create_user(
-                    username=username,
-                    expire_at=expire_date,
-                    telegram_id=user_id,
-                    external_squad_uuid=settings.default_external_squad_uuid,
-                    active_internal_squads=internal_squads,
-                )
-                user_info = user_data.get("response", user_data)
-                user_uuid = user_info.get("uuid")
-                BotUser.set_remnawave_uuid(user_id, user_uuid)
-            except Exception as create_error:
-                # Если пользователь уже существует (например, по username), находим его по telegram_id
-                # Проверяем как само исключение, так и его причину (для ApiClientError)
-                error_str = str(create_error).lower()
-                cause_str = ""
-                response_text = ""
-                
-                # Извлекаем информацию из оригинального исключения (HTTPStatusError)
-                if hasattr(create_error, '__cause__') and create_error.__cause__:
-                    original_exc = create_error.__cause__
-                    cause_str = str(original_exc).lower()
-                    
-                    # Пытаемся получить текст ответа API
-                    if hasattr(original_exc, 'response'):
-                        try:
-                            if hasattr(original_exc.response, 'text'):
-                                response_text = original_exc.response.text.lower()
-                            elif hasattr(original_exc.response, 'content'):
-                                try:
-                                    response_text = original_exc.response.content.decode('utf-8').lower()
-                                except:
-                                    pass
-                        except:
-                            pass
-                
-                # Проверяем различные варианты сообщения об ошибке
-                is_user_exists_error = (
-                    "already exists" in error_str or 
-                    "username" in error_str or 
-                    "already exists" in cause_str or 
-                    "username" in cause_str or
-                    "already exists" in response_text or 
-                    "username" in response_text or
-                    "a019" in response_text  # A019 - код ошибки "User username already exists"
-                )
-                
-                if is_user_exists_error:
-                    logger.warning(
-                        "User creation failed (likely already exists), trying to find by telegram_id. "
-                        "Error: %s, Response: %s", create_error, response_text[:200] if response_text else "N/A"
-                    )
-                    try:
-                        existing_user = await api_client.get_user_by_telegram_id(user_id)
-                        user_info = existing_user.get("response", existing_user)
-                        user_uuid = user_info.get("uuid")
-                        if user_uuid:
-                            logger.info("Found existing user by telegram_id: %s", user_uuid)
-                            BotUser.set_remnawave_uuid(user_id, user_uuid)
-                            # Обновляем дату окончания подписки и сквады
-                            update_payload = {"expireAt": expire_date}
-                            if settings.default_external_squad_uuid:
-                                update_payload["externalSquadUuid"] = settings.default_external_squad_uuid
-                            if internal_squads:
-                                update_payload["activeInternalSquads"] = internal_squads
-                            await api_client.update_user(user_uuid, **update_payload)
-                            logger.info("Updated existing user %s with new subscription", user_uuid)
-                        else:
-                            logger.error("User found by telegram_id but no UUID returned")
-                            raise create_error
-                    except Exception as find_error:
-                        logger.error("Failed to find user by telegram_id: %s", find_error)
-                        raise create_error
-                else:
-                    # Другая ошибка - пробрасываем дальше
-                    logger.error("User creation failed with unexpected error: %s", create_error)
-                    raise
-            # На всякий случай повторно применим сквады через update (если create их проигнорировал)
-            if settings.default_external_squad_uuid or internal_squads:
+            user_uuid, user_info, expire_date = await _provision_subscription(
+                user_id, username, bot_user.get("remnawave_user_uuid"), subscription_days
+            )
+            
+            # Получаем ссылку на подписку (shortUuid обычно уже есть в ответе панели)
+            from src.services.api_client import api_client
+            short_uuid = user_info.get("shortUuid")
+            if not short_uuid:
+                user_full = await api_client.get_user_by_uuid(user_uuid)
+                short_uuid = user_full.get("response", user_full).get("shortUuid")
+            
+            subscription_url = ""
+            if short_uuid:
                 try:
-                    update_payload = {}
-                    if settings.default_external_squad_uuid:
-                        update_payload["externalSquadUuid"] = settings.default_external_squad_uuid
-                    if internal_squads:
-                        update_payload["activeInternalSquads"] = internal_squads
-                    
-                    if update_payload:
-                        await api_client.update_user(user_uuid, **update_payload)
-                        logger.info(
-                            "Applied squads on payment user %s: external=%s, internal=%s (type=%s, len=%s)",
-                            user_uuid,
-                            settings.default_external_squad_uuid,
-                            internal_squads,
-                            type(internal_squads).__name__ if internal_squads else "None",
-                            len(internal_squads) if internal_squads else 0
-                        )
-                except Exception as squad_exc:
-                    logger.warning("Failed to apply squads on payment user %s: %s", user_uuid, squad_exc)
-        
-        # Получаем ссылку на подписку
-        user_full = await api_client.get_user_by_uuid(user_uuid)
-        user_full_info = user_full.get("response", user_full)
-        short_uuid = user_full_info.get("shortUuid")
-        
-        subscription_url = ""
-        if short_uuid:
-            try:
-                sub_info = await api_client.get_subscription_info(short_uuid)
-                sub_data = sub_info.get("response", sub_info)
-                subscription_url = sub_data.get("subscriptionUrl", "")
-            except:
-                pass
-        
-        # Обновляем статус платежа
-        Payment.update_status(payment["id"], "completed", user_uuid)
-        
-        # Начисляем баллы лояльности
-        from src.services.loyalty_service import process_payment_loyalty, BASE_PRICES
-        try:
-            amount_rub = BASE_PRICES.get(subscription_days, 129)  # Базовая цена в рублях
-            loyalty_result = process_payment_loyalty(user_id, amount_rub)
-            if loyalty_result and loyalty_result.get('status_upgraded'):
-                logger.info(
-                    "User %s upgraded to %s status after payment",
-                    user_id, loyalty_result['new_status']
-                )
-                # Уведомление о повышении статуса можно отправить вместе с платежом
-        except Exception as loyalty_exc:
-            logger.warning("Failed to process loyalty points: %s", loyalty_exc)
-        
-        # Начисляем бонус рефереру (если есть)
-        from src.services.referral_service import grant_referral_bonus
-        
+                    sub_info = await api_client.get_subscription_info(short_uuid)
+                    sub_data = sub_info.get("response", sub_info)
+                    subscription_url = sub_data.get("subscriptionUrl", "")
+                except:
+                    pass
+            
+            # Обновляем статус платежа
+            if not await Payment.aio.complete(payment_id, user_uuid):
+                logger.error(f"Payment {payment_id} was completed concurrently while provisioning user {user_id}")
+                return {"success": True, "user_uuid": user_uuid, "already_completed": True}
+        except Exception as e:
+            if _is_transient_error(e):
+                # Деньги уже списаны: платёж снова ожидает следующей попытки
+                logger.warning("Payment %s for user %s left pending after a temporary error: %s", payment_id, user_id, e)
+                await Payment.aio.release(payment_id)
+                return {"success": False, "error": str(e), "retryable": True}
+            logger.exception(f"Failed to process payment {payment_id} for user {user_id}: {e}")
+            await Payment.aio.release(payment_id, "failed")
+            return {"success": False, "error": str(e)}
+        finally:
+            # Статус платежа и подписка изменились при любом исходе
+            invalidate_user_cache(user_id)
+    
+    # Начисляем баллы лояльности
+    from src.services.loyalty_service import process_payment_loyalty, BASE_PRICES
+    try:
+        amount_rub = BASE_PRICES.get(subscription_days, 129)  # Базовая цена в рублях
+        loyalty_result = await process_payment_loyalty(user_id, amount_rub)
+        if loyalty_result and loyalty_result.get('status_upgraded'):
+            logger.info(
+                "User %s upgraded to %s status after payment",
+                user_id, loyalty_result['new_status']
+            )
+            # Уведомление о повышении статуса можно отправить вместе с платежом
+    except Exception as loyalty_exc:
+        logger.warning("Failed to process loyalty points: %s", loyalty_exc)
+    
+    # Начисляем бонус рефереру (если есть)
+    from src.services.referral_service import grant_referral_bonus
+    
+    try:
+        referral_data = await grant_referral_bonus(user_id)
+        if referral_data and bot:
+            # Отправляем уведомление о реферальном бонусе
+            from src.services.notification_service import notify_referral_bonus
+            await notify_referral_bonus(
+                bot,
+                referral_data["referrer_id"],
+                referral_data["referrer_username"],
+                referral_data["referred_id"],
+                referral_data["referred_username"],
+                referral_data["bonus_days"],
+                referral_data["new_expire"]
+            )
+    except Exception as ref_exc:
+        logger.warning("Failed to grant referral bonus on payment: %s", ref_exc)
+    
+    # Отправляем уведомление об успешной оплате
+    if bot:
+        from src.services.notification_service import notify_payment_success
         try:
-            referral_data = await grant_referral_bonus(user_id)
-            if referral_data and bot:
-                # Отправляем уведомление о реферальном бонусе
-                from src.services.notification_service import notify_referral_bonus
-                await notify_referral_bonus(
-                    bot,
-                    referral_data["referrer_id"],
-                    referral_data["referrer_username"],
-                    referral_data["referred_id"],
-                    referral_data["referred_username"],
-                    referral_data["bonus_days"],
-                    referral_data["new_expire"]
-                )
-        except Exception as ref_exc:
-            logger.warning("Failed to grant referral bonus on payment: %s", ref_exc)
+            await notify_payment_success(
+                bot,
+                user_id,
+                username,
+                subscription_months,
+                stars,
+                user_uuid,
+                expire_date,
+                subscription_url  # Передаём ссылку на конфиг
+            )
+        except Exception as notif_exc:
+            logger.warning("Failed to send payment success notification: %s", notif_exc)
+    
+    logger.info(f"Payment processed successfully for user {user_id}: user_uuid={user_uuid}")
+    
+    return {
+        "success": True,
+        "user_uuid": user_uuid,
+        "subscription_url": subscription_url,
+        "expire_date": expire_date
+    }
+
+
+async def process_successful_payment(
+    user_id: int,
+    invoice_payload: str,
+    total_amount: int,
+    bot: Bot | None = None
+) -> dict:
+    """Обрабатывает успешный платеж Stars и создает пользователя в Remnawave.
+    
+    Args:
+        user_id: ID пользователя Telegram
+        invoice_payload: Payload из invoice
+        total_amount: Общая сумма в Stars
+    
+    Returns:
+        Словарь с результатом (success, user_uuid, subscription_url, error)
+    """
+    try:
+        # Парсим короткий payload формата: user_id:months:stars
+        parts = invoice_payload.split(":")
+        if len(parts) < 3:
+            logger.error(f"Invalid payload format: {invoice_payload}")
+            return {"success": False, "error": "Invalid payload format"}
         
-        # Отправляем уведомление об успешной оплате
+        payload_user_id = int(parts[0])
+        subscription_months = int(parts[1])
+    except ValueError:
+        logger.error(f"Invalid payload format: {invoice_payload}")
+        return {"success": False, "error": "Invalid payload format"}
+    
+    # Проверяем user_id
+    if payload_user_id != user_id:
+        logger.error(f"User ID mismatch: payload={payload_user_id}, actual={user_id}")
+        return {"success": False, "error": "User ID mismatch"}
+    
+    # Находим платеж в БД
+    payment = await Payment.aio.get_by_payload(invoice_payload)
+    if not payment:
+        logger.error(f"Payment not found for payload: {invoice_payload}")
+        return {"success": False, "error": "Payment not found"}
+    
+    if payment["status"] == "completed":
+        logger.warning(f"Payment {payment['id']} already completed")
+        return {
+            "success": True,
+            "user_uuid": payment["remnawave_user_uuid"],
+            "already_completed": True
+        }
+    
+    # Проверяем сумму (допускаем небольшую погрешность)
+    if abs(payment["stars"] - total_amount) > 1:
+        logger.error(f"Amount mismatch: expected {payment['stars']}, got {total_amount}")
+        await Payment.aio.update_status(payment["id"], "failed")
+        invalidate_user_cache(user_id)
+        return {"success": False, "error": "Amount mismatch"}
+    
+    result = await complete_subscription_payment(
+        payment["id"],
+        user_id,
+        subscription_months,
+        subscription_months * 30,
+        stars=total_amount,
+        bot=bot
+    )
+    if result.get("retryable"):
+        # Платежи Stars сверка не повторяет: закрываем платёж и зовём админов выдать подписку вручную
+        await Payment.aio.close_pending(payment["id"], "failed")
+        invalidate_user_cache(user_id)
         if bot:
-            from src.services.notification_service import notify_payment_success
+            from src.services.notification_service import send_admin_notification
             try:
-                await notify_payment_success(
+                await send_admin_notification(
                     bot,
-                    user_id,
-                    username,
-                    subscription_months,
-                    total_amount,
-                    user_uuid,
-                    expire_date,
-                    subscription_url  # Передаём ссылку на конфиг
+                    f"⚠️ <b>Оплата Stars не обработана</b>\n\n"
+                    f"👤 Пользователь: <code>{user_id}</code>\n"
+                    f"🧾 Платёж: <code>{payment['id']}</code>\n"
+                    f"📅 Срок: {subscription_months} мес.\n"
+                    f"⭐ Сумма: {total_amount} Stars\n"
+                    f"❗ Ошибка: {html.escape(str(result.get('error')))}\n\n"
+                    f"Подписку нужно выдать вручную.",
+                    kind="payment_failed",
+                    summary=f"<code>{user_id}</code> · платёж {payment['id']} · {total_amount}⭐",
+                    critical=True
                 )
             except Exception as notif_exc:
-                logger.warning("Failed to send payment success notification: %s", notif_exc)
-        
-        logger.info(f"Payment processed successfully for user {user_id}: user_uuid={user_uuid}")
-        
-        return {
-            "success": True,
-            "user_uuid": user_uuid,
-            "subscription_url": subscription_url,
-            "expire_date": expire_date
-        }
-    except Exception as e:
-        logger.exception(f"Failed to process payment for user {user_id}: {e}")
-        payment = Payment.get_by_payload(invoice_payload)
-        if payment:
-            Payment.update_status(payment["id"], "failed")
-        return {"success": False, "error": str(e)}
+                logger.warning("Failed to send payment failure notification: %s", notif_exc)
+    return result
 
 
 async def create_gift_invoice(
@@ -483,13 +626,14 @@ async def create_gift_invoice(
     invoice_payload = f"gift:{user_id}:{subscription_months}:{stars}"
     
     # Создаем запись о платеже
-    payment_id = Payment.create(
+    payment_id = await Payment.aio.create(
         user_id=user_id,
         stars=stars,
         invoice_payload=invoice_payload,
         subscription_days=subscription_days,
         payment_method="stars"
     )
+    invalidate_user_cache(user_id)
     
     # Описание подарка
     locale_map = {
@@ -520,7 +664,8 @@ async def create_gift_invoice(
             "Failed to create gift invoice for user %s: %s",
             user_id, type(e).__name__
         )
-        Payment.update_status(payment_id, "failed")
+        await Payment.aio.update_status(payment_id, "failed")
+        invalidate_user_cache(user_id)
         raise
 
 
@@ -559,7 +704,7 @@ async def process_successful_gift_payment(
             return {"success": False, "error": "User ID mismatch"}
         
         # Находим платеж в БД
-        payment = Payment.get_by_payload(invoice_payload)
+        payment = await Payment.aio.get_by_payload(invoice_payload)
         if not payment:
             logger.error(f"Payment not found for payload: {invoice_payload}")
             return {"success": False, "error": "Payment not found"}
@@ -571,24 +716,34 @@ async def process_successful_gift_payment(
         # Проверяем сумму
         if abs(payment["stars"] - total_amount) > 1:
             logger.error(f"Amount mismatch: expected {payment['stars']}, got {total_amount}")
-            Payment.update_status(payment["id"], "failed")
+            await Payment.aio.update_status(payment["id"], "failed")
+            invalidate_user_cache(user_id)
             return {"success": False, "error": "Amount mismatch"}
         
-        # Создаем подарочный код
-        gift = GiftCode.create(
-            buyer_id=user_id,
-            subscription_days=subscription_days,
-            stars=total_amount,
-            payment_method="stars"
-        )
-        
-        if not gift:
-            logger.error("Failed to create gift code")
-            Payment.update_status(payment["id"], "failed")
-            return {"success": False, "error": "Failed to create gift code"}
-        
-        # Обновляем статус платежа
-        Payment.update_status(payment["id"], "completed")
+        async with payment_lock(payment["id"]):
+            # Параллельная обработка могла уже выдать код по этому платежу
+            payment = await Payment.aio.get(payment["id"])
+            if payment["status"] == "completed":
+                logger.warning(f"Gift payment {payment['id']} already completed")
+                return {"success": True, "already_completed": True}
+            
+            # Код и завершение платежа — одна транзакция: сбой между ними не даст второго кода
+            try:
+                gift = await GiftCode.aio.create_for_payment(
+                    payment["id"],
+                    buyer_id=user_id,
+                    subscription_days=subscription_days,
+                    stars=total_amount,
+                    payment_method="stars"
+                )
+            except Exception as gift_exc:
+                logger.error("Failed to create gift code: %s", gift_exc)
+                # Транзакция откатилась: платёж остаётся ожидающим, повторная обработка выдаст код
+                return {"success": False, "error": "Failed to create gift code"}
+            
+            if not gift:
+                logger.warning(f"Gift payment {payment['id']} already completed")
+                return {"success": True, "already_completed": True}
         
         # Начисляем баллы лояльности за покупку подарка
         # Конвертируем Stars в рубли для начисления баллов (используем базовые цены подписок)
@@ -604,7 +759,7 @@ async def process_successful_gift_payment(
         amount_rub_equivalent = rub_prices.get(subscription_months, 0)
         
         try:
-            loyalty_result = Loyalty.add_points(user_id, amount_rub_equivalent)
+            loyalty_result = await Loyalty.aio.add_points(user_id, amount_rub_equivalent)
             logger.info(
                 f"Loyalty points added for gift purchase (Stars): +{amount_rub_equivalent} points, "
                 f"total: {loyalty_result['points']}, status: {loyalty_result['status']}"
@@ -612,6 +767,7 @@ async def process_successful_gift_payment(
         except Exception as loyalty_exc:
             logger.warning(f"Failed to add loyalty points for gift purchase: {loyalty_exc}")
         
+        invalidate_user_cache(user_id)
         logger.info(f"Gift code created: {gift['code']} for user {user_id}")
         
         # Отправляем уведомление админам
@@ -624,7 +780,10 @@ async def process_successful_gift_payment(
                     f"👤 Покупатель: <code>{user_id}</code>\n"
                     f"🎫 Код: <code>{gift['code']}</code>\n"
                     f"📅 Срок: {subscription_days} дней\n"
-                    f"⭐ Сумма: {total_amount} Stars"
+                    f"⭐ Сумма: {total_amount} Stars",
+                    kind="gift",
+                    summary=f"<code>{user_id}</code> · {subscription_days} дн. · {total_amount}⭐",
+                    critical=True
                 )
             except Exception as notif_exc:
                 logger.warning("Failed to send gift notification: %s", notif_exc)
@@ -636,8 +795,10 @@ async def process_successful_gift_payment(
         }
     except Exception as e:
         logger.exception(f"Failed to process gift payment: {e}")
-        payment = Payment.get_by_payload(invoice_payload)
+        payment = await Payment.aio.get_by_payload(invoice_payload)
         if payment:
-            Payment.update_status(payment["id"], "failed")
+            # Завершённый платёж (код уже выдан) не трогаем
+            await Payment.aio.close_pending(payment["id"], "failed")
+            invalidate_user_cache(user_id)
         return {"success": False, "error": str(e)}
 
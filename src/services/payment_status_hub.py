@@ -0,0 +1,169 @@
+"""Статусы платежей YooKassa для Mini App: ожидание изменений без опроса YooKassa на каждый запрос клиента."""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from src.database import Payment
+from src.services.fanout import fan_out
+from src.utils.logger import logger
+
+# Как часто проверять в YooKassa платёж, статус которого ждёт Mini App (секунды)
+POLL_INTERVAL = float(os.getenv("PAYMENT_STATUS_POLL_SECONDS", "5"))
+# Одновременных запросов к YooKassa при проверке
+POLL_CONCURRENCY = 10
+# Через сколько секунд без обращений платёж перестаёт отслеживаться
+IDLE_TTL = 600
+# Ограничение на запрос статуса в YooKassa (обработку оплаченного платежа не прерываем)
+CHECK_TIMEOUT = 30
+
+STATUS_PENDING = "pending"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+
+def client_status(db_status: Optional[str]) -> str:
+    """Статус платежа из БД в терминах Mini App."""
+    if db_status == "completed":
+        return STATUS_COMPLETED
+    if db_status in ("failed", "canceled", "expired"):
+        return STATUS_FAILED
+    return STATUS_PENDING
+
+
+@dataclass
+class _Watch:
+    payment_id: int
+    yookassa_payment_id: str
+    invoice_payload: str
+    status: str = STATUS_PENDING
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    next_check: float = 0.0
+    last_used: float = field(default_factory=time.monotonic)
+    waiters: int = 0
+
+
+class PaymentStatusHub:
+    """
+    Таблица статусов отслеживаемых платежей в памяти процесса.
+
+    Клиенты Mini App ждут изменения статуса (wait); webhook YooKassa и
+    фоновая проверка (start_payment_status_reconciler) публикуют новые
+    статусы (publish). Каждый ожидающий платёж проверяется в YooKassa не
+    чаще раза в POLL_INTERVAL, сколько бы клиентов его ни ждали.
+    """
+
+    def __init__(self) -> None:
+        self._watches: dict[int, _Watch] = {}
+        self.bot = None
+
+    def _watch(self, payment: dict) -> _Watch:
+        watch = self._watches.get(payment["id"])
+        if watch is None:
+            watch = self._watches[payment["id"]] = _Watch(
+                payment_id=payment["id"],
+                yookassa_payment_id=payment.get("yookassa_payment_id") or "",
+                invoice_payload=payment.get("invoice_payload") or "",
+                status=client_status(payment.get("status")),
+            )
+        watch.last_used = time.monotonic()
+        return watch
+
+    def publish(self, payment_id: int, status: str) -> None:
+        """Сообщает ожидающим клиентам новый статус платежа."""
+        watch = self._watches.get(payment_id)
+        if watch is None or watch.status == status:
+            return
+        watch.status = status
+        # Будим всех текущих ожидающих; следующие будут ждать новое событие
+        watch.changed.set()
+        watch.changed = asyncio.Event()
+
+    async def refresh(self, payment_id: int) -> None:
+        """Публикует статус платежа из БД (после обработки вне хаба)."""
+        if payment_id not in self._watches:
+            return
+        payment = await Payment.aio.get(payment_id)
+        if payment:
+            self.publish(payment_id, client_status(payment.get("status")))
+
+    async def wait(self, payment: dict, known_status: Optional[str] = None, timeout: float = 0) -> str:
+        """
+        Текущий статус платежа; если он равен known_status — ждёт изменения
+        не дольше timeout секунд.
+        """
+        watch = self._watch(payment)
+        if watch.status != known_status or timeout <= 0:
+            return watch.status
+        changed = watch.changed
+        watch.waiters += 1
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watch.waiters -= 1
+            watch.last_used = time.monotonic()
+        return watch.status
+
+    async def _check(self, watch: _Watch) -> None:
+        from src.services.yookassa_service import check_yookassa_payment_status
+
+        yookassa_status = await asyncio.wait_for(
+            check_yookassa_payment_status(watch.yookassa_payment_id), CHECK_TIMEOUT
+        )
+        status = yookassa_status.get("status")
+        if status == "succeeded" and yookassa_status.get("paid"):
+            if watch.invoice_payload.startswith("yookassa_gift:"):
+                from src.services.yookassa_service import process_yookassa_gift_payment
+                result = await process_yookassa_gift_payment(watch.yookassa_payment_id, self.bot, verified=True)
+            else:
+                from src.services.yookassa_service import process_yookassa_payment
+                result = await process_yookassa_payment(watch.yookassa_payment_id, self.bot, verified=True)
+            if not result.get("success") and not result.get("in_progress"):
+                logger.warning("Payment %s processing failed: %s", watch.payment_id, result.get("error"))
+            # Итоговый статус — из БД: временная ошибка обработки оставляет платёж ожидающим
+            await self.refresh(watch.payment_id)
+        elif status == "canceled":
+            self.publish(watch.payment_id, STATUS_FAILED)
+
+    async def reconcile(self) -> None:
+        """Проверяет в YooKassa ожидающие платежи, которым пора, и забывает неиспользуемые."""
+        now = time.monotonic()
+        for payment_id, watch in list(self._watches.items()):
+            if not watch.waiters and now - watch.last_used > IDLE_TTL:
+                del self._watches[payment_id]
+
+        due = [
+            watch for watch in self._watches.values()
+            if watch.status == STATUS_PENDING and watch.yookassa_payment_id and watch.next_check <= now
+        ]
+        if not due:
+            return
+        for watch in due:
+            watch.next_check = now + POLL_INTERVAL
+        # Без общего таймаута: отмена посреди выдачи подписки продлила бы её повторно
+        report = await fan_out(due, self._check, concurrency=POLL_CONCURRENCY, timeout=None, retries=0)
+        for watch, error in report.failed:
+            logger.warning("Payment %s status check failed: %s", watch.payment_id, error)
+
+    @property
+    def watched(self) -> int:
+        return len(self._watches)
+
+
+# Single shared instance
+payment_status_hub = PaymentStatusHub()
+
+
+async def start_payment_status_reconciler(bot, interval_seconds: float = 1.0) -> None:
+    """Фоновая задача: проверяет в YooKassa платежи, статус которых ждёт Mini App."""
+    payment_status_hub.bot = bot
+    logger.info("Starting payment status reconciler (poll: %.0f seconds)", POLL_INTERVAL)
+    while True:
+        try:
+            await payment_status_hub.reconcile()
+        except Exception as e:
+            logger.exception("Error in payment status reconciler loop: %s", e)
+        await asyncio.sleep(interval_seconds)
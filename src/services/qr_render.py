@@ -0,0 +1,25 @@
+"""Рендер QR-кода в PNG.
+
+Отдельный модуль без зависимостей от бота: процессы пула QrService
+импортируют только его.
+"""
+import io
+
+
+def render_qr_png(data: str) -> bytes:
+    """Рисует QR-код для строки и возвращает PNG."""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_bytes = io.BytesIO()
+    img.save(img_bytes, format="PNG")
+    return img_bytes.getvalue()
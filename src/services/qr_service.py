@@ -0,0 +1,61 @@
+"""QR-коды для оплаты: рендер в отдельном процессе, не занимая event loop."""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from src.services.qr_render import render_qr_png
+from src.utils.logger import logger
+
+# Сколько процессов рендерят QR-коды
+QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))
+
+
+class QrService:
+    """
+    Рисует QR-код для строки оплаты в пуле процессов.
+
+    Кеша нет: у каждого платежа YooKassa своя ссылка подтверждения, и QR-код
+    показывается один раз сразу после создания платежа, так что повторных
+    обращений к тем же данным не бывает.
+    """
+
+    def __init__(self, workers: int = QR_WORKERS) -> None:
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: fork процесса с потоками (пул SQLite, поток записи) небезопасен
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def get_png(self, data: str) -> bytes:
+        """PNG с QR-кодом."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_executor(), render_qr_png, data)
+        except (BrokenProcessPool, OSError, RuntimeError) as e:
+            # Пул процессов недоступен (ограничения окружения) — рисуем в потоке
+            logger.warning("QR process pool unavailable, rendering in a thread: %s", e)
+            self._executor = None
+            return await asyncio.to_thread(render_qr_png, data)
+
+    async def get_photo(self, data: str):
+        """PNG-файл с QR-кодом для answer_photo."""
+        from aiogram.types import BufferedInputFile
+
+        return BufferedInputFile(await self.get_png(data), filename="qr_code.png")
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Single shared instance
+qr_service = QrService()
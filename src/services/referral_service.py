@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 from src.config import get_settings
 from src.database import BotUser, Referral
 from src.services.api_client import api_client
+from src.services.bootstrap_cache import invalidate_user_cache
 from src.utils.logger import logger
 
 
@@ -21,7 +22,7 @@ async def grant_referral_bonus(referred_user_id: int) -> dict | None:
     bonus_days = settings.referral_bonus_days
     
     # Получаем информацию о пользователе
-    referred_user = BotUser.get_or_create(referred_user_id, None)
+    referred_user = await BotUser.aio.get_or_create(referred_user_id, None)
     referrer_id = referred_user.get("referrer_id")
     
     if not referrer_id:
@@ -32,30 +33,22 @@ async def grant_referral_bonus(referred_user_id: int) -> dict | None:
     
     # Проверяем, не начислен ли уже бонус этому конкретному рефералу
     # (бонус начисляется только один раз — при первой активации триала/оплате)
-    from src.database import get_db_connection
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT bonus_days FROM referrals 
-            WHERE referrer_id = ? AND referred_id = ?
-        """, (referrer_id, referred_user_id))
-        row = cursor.fetchone()
-        
-        if not row:
-            logger.warning(
-                "⚠️ Referral bonus: No referral record found in database for referrer=%s referred=%s. "
-                "Make sure the referral relationship was created when the user clicked the referral link.",
-                referrer_id, referred_user_id
-            )
-            return None
-        
-        if row[0] > 0:
-            logger.info("✅ Referral bonus already granted for referrer=%s referred=%s (bonus_days=%s)", 
-                       referrer_id, referred_user_id, row[0])
-            return None
+    granted_days = await Referral.aio.get_referral_bonus(referrer_id, referred_user_id)
+    if granted_days is None:
+        logger.warning(
+            "⚠️ Referral bonus: No referral record found in database for referrer=%s referred=%s. "
+            "Make sure the referral relationship was created when the user clicked the referral link.",
+            referrer_id, referred_user_id
+        )
+        return None
+    
+    if granted_days > 0:
+        logger.info("✅ Referral bonus already granted for referrer=%s referred=%s (bonus_days=%s)", 
+                   referrer_id, referred_user_id, granted_days)
+        return None
     
     # Получаем UUID реферера в Remnawave
-    referrer_user = BotUser.get_or_create(referrer_id, None)
+    referrer_user = await BotUser.aio.get_or_create(referrer_id, None)
     referrer_uuid = referrer_user.get("remnawave_user_uuid")
     
     if not referrer_uuid:
@@ -96,7 +89,8 @@ async def grant_referral_bonus(referred_user_id: int) -> dict | None:
         await api_client.update_user(referrer_uuid, expireAt=new_expire_iso)
         
         # Записываем в БД
-        Referral.update_bonus_days(referrer_id, referred_user_id, bonus_days)
+        await Referral.aio.update_bonus_days(referrer_id, referred_user_id, bonus_days)
+        invalidate_user_cache(referrer_id)
         
         logger.info(
             "✅ Referral bonus granted: referrer=%s referred=%s bonus_days=%s new_expire=%s",
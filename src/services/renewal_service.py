@@ -1,5 +1,7 @@
 """Сервис для автопродления и напоминаний о истекающих подписках."""
 import asyncio
+import heapq
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -15,103 +17,193 @@ from src.utils.i18n import get_i18n
 from src.utils.logger import logger
 
 
-async def check_expiring_subscriptions(bot: Bot) -> None:
+# Небольшой запас, чтобы проснуться уже после перехода через порог
+_WAKE_EPSILON = timedelta(seconds=1)
+
+# Сколько запросов к Remnawave выполняется одновременно при сверке expireAt
+CHECK_CONCURRENCY = int(os.getenv("RENEWAL_CHECK_CONCURRENCY", "20"))
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    """Парсит ISO-дату из Remnawave/БД в naive datetime."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (ValueError, AttributeError, TypeError):
+        return None
+    # Приводим к UTC и убираем timezone для сравнения с naive datetime
+    return parsed.replace(tzinfo=None) if parsed.tzinfo else parsed
+
+
+def _reminder_type(
+    expire_at: datetime, status: Optional[str], last_notif_dt: Optional[datetime], now: datetime
+) -> Optional[str]:
     """
-    Проверяет пользователей с истекающими подписками и отправляет напоминания.
-    
+    Определяет, какое напоминание нужно отправить прямо сейчас.
+
     Логика:
-    - За 3-5 дней до окончания: напоминание с кнопкой "Продлить доступ"
+    - За 1-5 дней до окончания: напоминание с кнопкой "Продлить доступ"
     - За 1 день: повторное напоминание
     - После окончания: сообщение о приостановке доступа с кнопкой "Возобновить доступ"
     """
-    try:
-        # Получаем всех пользователей с включенным автопродлением
-        users_with_auto_renewal = BotUser.get_users_with_auto_renewal()
-        
-        if not users_with_auto_renewal:
-            logger.debug("No users with auto renewal enabled")
+    days_until_expiry = (expire_at - now).days
+    if status == "EXPIRED" or expire_at < now:
+        # Подписка уже истекла - отправляем уведомление о приостановке
+        if not last_notif_dt or (now - last_notif_dt).days >= 1:
+            return "expired"
+    elif 1 <= days_until_expiry <= 5:
+        if not last_notif_dt:
+            # Первое напоминание
+            return "expiring_soon"
+        if days_until_expiry == 1 and (now - last_notif_dt).days >= 1:
+            # Повторное напоминание за 1 день
+            return "expiring_tomorrow"
+    return None
+
+
+def _next_check_at(
+    expire_at: datetime, status: Optional[str], last_notif_dt: Optional[datetime], now: datetime
+) -> Optional[datetime]:
+    """Ближайший момент, когда для пользователя может понадобиться напоминание."""
+    if _reminder_type(expire_at, status, last_notif_dt, now):
+        return now
+    candidates = [
+        expire_at - timedelta(days=6),  # начало окна "за 5 дней"
+        expire_at - timedelta(days=2),  # начало окна "завтра"
+        expire_at,                      # окончание подписки
+    ]
+    if last_notif_dt:
+        candidates.append(last_notif_dt + timedelta(days=1))
+    future = [moment + _WAKE_EPSILON for moment in candidates if moment + _WAKE_EPSILON > now]
+    return min(future) if future else None
+
+
+class RenewalScheduler:
+    """
+    Расписание напоминаний об окончании подписки.
+
+    expireAt берётся из локального индекса пользователей панели, пользователи
+    лежат в куче по времени ближайшего порога. Перед отправкой напоминания
+    данные сверяются с Remnawave, запросы выполняются пачкой с ограничением
+    параллельности.
+    """
+
+    def __init__(self, bot: Bot, concurrency: int = CHECK_CONCURRENCY) -> None:
+        self.bot = bot
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._heap: list[tuple[datetime, int]] = []
+        self._users: dict[int, dict] = {}
+        self._due: dict[int, datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def next_due(self) -> Optional[datetime]:
+        """Время ближайшего запланированного порога."""
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)  # устаревшая запись после перепланирования
+        return self._heap[0][0] if self._heap else None
+
+    def _schedule(self, user: dict, now: datetime) -> None:
+        user_id = user["telegram_id"]
+        expire_at = _parse_datetime(user.get("expire_at"))
+        due = None
+        if expire_at:
+            due = _next_check_at(
+                expire_at, user.get("status"), _parse_datetime(user.get("last_renewal_notification")), now
+            )
+        if due is None:
+            self._users.pop(user_id, None)
+            self._due.pop(user_id, None)
             return
-        
-        logger.info("Checking %d users with auto renewal for expiring subscriptions", len(users_with_auto_renewal))
-        
-        now = datetime.now()
-        for user_data in users_with_auto_renewal:
-            user_id = user_data.get("telegram_id")
-            remnawave_uuid = user_data.get("remnawave_user_uuid")
-            last_notification = user_data.get("last_renewal_notification")
-            
-            if not remnawave_uuid:
-                continue
-            
+        self._users[user_id] = user
+        self._due[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+
+    async def _fetch_remote(self, user: dict) -> Optional[dict]:
+        """Получает актуальные expireAt/status из Remnawave и обновляет локальный индекс."""
+        from src.services.user_index_service import remember_users
+
+        async with self._semaphore:
             try:
-                # Получаем информацию о подписке пользователя из Remnawave
-                user_info_response = await api_client.get_user_by_uuid(remnawave_uuid)
-                user_info = user_info_response.get("response", user_info_response)
-                expire_at_str = user_info.get("expireAt")
-                status = user_info.get("status", "UNKNOWN")
-                
-                if not expire_at_str:
-                    continue
-                
-                # Парсим дату истечения
-                try:
-                    expire_at = datetime.fromisoformat(expire_at_str.replace("Z", "+00:00"))
-                    # Приводим к UTC и убираем timezone для сравнения с naive datetime
-                    if expire_at.tzinfo:
-                        expire_at = expire_at.replace(tzinfo=None)
-                except (ValueError, AttributeError) as e:
-                    logger.warning("Failed to parse expire_at for user %s: %s", user_id, e)
-                    continue
-                
-                # Вычисляем дни до окончания
-                days_until_expiry = (expire_at - now).days
-                
-                # Проверяем последнее напоминание
-                last_notif_dt = None
-                if last_notification:
-                    try:
-                        last_notif_dt = datetime.fromisoformat(last_notification)
-                    except (ValueError, TypeError):
-                        pass
-                
-                # Определяем, нужно ли отправлять напоминание
-                should_send_reminder = False
-                reminder_type = None
-                
-                if status == "EXPIRED" or expire_at < now:
-                    # Подписка уже истекла - отправляем уведомление о приостановке
-                    if not last_notif_dt or (now - last_notif_dt).days >= 1:
-                        should_send_reminder = True
-                        reminder_type = "expired"
-                elif 1 <= days_until_expiry <= 5:
-                    # За 1-5 дней до окончания
-                    if not last_notif_dt:
-                        # Первое напоминание
-                        should_send_reminder = True
-                        reminder_type = "expiring_soon"
-                    elif days_until_expiry == 1 and (now - last_notif_dt).days >= 1:
-                        # Повторное напоминание за 1 день
-                        should_send_reminder = True
-                        reminder_type = "expiring_tomorrow"
-                
-                if should_send_reminder:
-                    await send_renewal_reminder(
-                        bot=bot,
-                        user_id=user_id,
-                        days_until_expiry=days_until_expiry,
-                        reminder_type=reminder_type,
-                        expire_at=expire_at
-                    )
-                    # Обновляем время последнего напоминания
-                    BotUser.update_last_renewal_notification(user_id)
-            
+                response = await api_client.get_user_by_uuid(user["remnawave_user_uuid"])
             except NotFoundError:
-                logger.debug("User %s not found in Remnawave (uuid: %s)", user_id, remnawave_uuid)
-                continue
+                logger.debug(
+                    "User %s not found in Remnawave (uuid: %s)", user["telegram_id"], user["remnawave_user_uuid"]
+                )
+                return None
             except Exception as e:
-                logger.exception("Error checking subscription for user %s: %s", user_id, e)
+                logger.warning("Failed to check subscription for user %s: %s", user["telegram_id"], e)
+                return None
+        await remember_users(response)
+        info = response.get("response", response)
+        return {**user, "expire_at": info.get("expireAt"), "status": info.get("status", "UNKNOWN")}
+
+    async def _verify(self, users: list[dict]) -> list[dict]:
+        results = await asyncio.gather(*(self._fetch_remote(user) for user in users))
+        return [user for user in results if user]
+
+    async def rebuild(self) -> None:
+        """Перестраивает расписание по БД (новые пользователи, продления, отключённое автопродление)."""
+        rows = await BotUser.aio.get_renewal_schedule()
+        now = datetime.now()
+        # Пользователей, которых ещё нет в индексе панели, сверяем с Remnawave
+        missing = [row for row in rows if not row.get("expire_at")]
+        verified = await self._verify(missing) if missing else []
+        self._heap = []
+        self._users = {}
+        self._due = {}
+        for user in [row for row in rows if row.get("expire_at")] + verified:
+            self._schedule(user, now)
+        heapq.heapify(self._heap)
+        logger.info(
+            "Renewal schedule rebuilt: users=%d scheduled=%d verified_remotely=%d",
+            len(rows), len(self._due), len(missing)
+        )
+
+    async def run_due(self) -> int:
+        """Обрабатывает всех пользователей, чей порог уже наступил. Возвращает число напоминаний."""
+        now = datetime.now()
+        due_users = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _, user_id = heapq.heappop(self._heap)
+            self._due.pop(user_id, None)
+            due_users.append(self._users.pop(user_id))
+        if not due_users:
+            return 0
+
+        sent = 0
+        for user in await self._verify(due_users):
+            now = datetime.now()
+            expire_at = _parse_datetime(user.get("expire_at"))
+            if not expire_at:
                 continue
-    
+            last_notif_dt = _parse_datetime(user.get("last_renewal_notification"))
+            reminder_type = _reminder_type(expire_at, user.get("status"), last_notif_dt, now)
+            if reminder_type:
+                await send_renewal_reminder(
+                    bot=self.bot,
+                    user_id=user["telegram_id"],
+                    days_until_expiry=(expire_at - now).days,
+                    reminder_type=reminder_type,
+                    expire_at=expire_at,
+                    locale=user.get("language"),
+                )
+                # Обновляем время последнего напоминания
+                await BotUser.aio.update_last_renewal_notification(user["telegram_id"])
+                user = {**user, "last_renewal_notification": now.isoformat()}
+                sent += 1
+            self._schedule(user, now)
+        return sent
+
+
+async def check_expiring_subscriptions(bot: Bot) -> None:
+    """Разовая проверка: строит расписание и отправляет все наступившие напоминания."""
+    try:
+        scheduler = RenewalScheduler(bot)
+        await scheduler.rebuild()
+        await scheduler.run_due()
     except Exception as e:
         logger.exception("Error in check_expiring_subscriptions: %s", e)
 
@@ -121,7 +213,8 @@ async def send_renewal_reminder(
     user_id: int,
     days_until_expiry: int,
     reminder_type: str,
-    expire_at: datetime
+    expire_at: datetime,
+    locale: Optional[str] = None
 ) -> None:
     """
     Отправляет напоминание об истекающей подписке.
@@ -132,10 +225,12 @@ async def send_renewal_reminder(
         days_until_expiry: Количество дней до окончания (отрицательное, если уже истекла)
         reminder_type: Тип напоминания ("expiring_soon", "expiring_tomorrow", "expired")
         expire_at: Дата истечения подписки
+        locale: Язык пользователя (если не передан, берётся из БД)
     """
     try:
-        user = BotUser.get_or_create(user_id, None)
-        locale = user.get("language", "ru")
+        if not locale:
+            user = await BotUser.aio.get_or_create(user_id, None)
+            locale = user.get("language", "ru")
         
         i18n = get_i18n()
         with i18n.use_locale(locale):
@@ -191,22 +286,36 @@ async def send_renewal_reminder(
         logger.exception("Error in send_renewal_reminder for user %s: %s", user_id, e)
 
 
-async def start_renewal_checker(bot: Bot, interval_hours: int = 6) -> None:
+async def start_renewal_checker(bot: Bot, rescan_minutes: int = 30) -> None:
     """
-    Запускает фоновую задачу для периодической проверки истекающих подписок.
-    
+    Запускает фоновую задачу напоминаний об истекающих подписках.
+
+    Задача спит до ближайшего порога в расписании, а раз в rescan_minutes
+    перестраивает расписание по БД.
+
     Args:
         bot: Экземпляр бота
-        interval_hours: Интервал проверки в часах (по умолчанию 6 часов)
+        rescan_minutes: Интервал перестроения расписания в минутах
     """
-    logger.info("Starting renewal checker (interval: %d hours)", interval_hours)
-    
+    logger.info("Starting renewal checker (rescan interval: %d minutes)", rescan_minutes)
+    scheduler = RenewalScheduler(bot)
+    rescan_at = datetime.now()
+
     while True:
         try:
-            await check_expiring_subscriptions(bot)
+            if datetime.now() >= rescan_at:
+                await scheduler.rebuild()
+                rescan_at = datetime.now() + timedelta(minutes=rescan_minutes)
+            sent = await scheduler.run_due()
+            if sent:
+                logger.info("Sent %d renewal reminders", sent)
         except Exception as e:
             logger.exception("Error in renewal checker loop: %s", e)
-        
-        # Ждем перед следующей проверкой
-        await asyncio.sleep(interval_hours * 3600)
+            rescan_at = datetime.now() + timedelta(minutes=1)
 
+        # Спим до ближайшего порога или до перестроения расписания
+        wake_at = rescan_at
+        next_due = scheduler.next_due()
+        if next_due is not None and next_due < wake_at:
+            wake_at = next_due
+        await asyncio.sleep(max((wake_at - datetime.now()).total_seconds(), 1.0))
@@ -0,0 +1,184 @@
+"""Фоновая синхронизация локального индекса пользователей панели Remnawave."""
+import asyncio
+import os
+from typing import Optional
+
+from src.database import PanelUser
+from src.utils.logger import logger
+
+# Размер страницы при обходе панели (Remnawave принимает size до 1000)
+SYNC_PAGE_SIZE = int(os.getenv("USER_INDEX_PAGE_SIZE", "500"))
+# Сколько запросов к панели выполнять одновременно при догрузке пользователей
+PREFETCH_CONCURRENCY = int(os.getenv("USER_PREFETCH_CONCURRENCY", "10"))
+
+_refresh_requested: Optional[asyncio.Event] = None
+_sync_lock: Optional[asyncio.Lock] = None
+_ready = False
+
+
+def _get_refresh_event() -> asyncio.Event:
+    global _refresh_requested
+    if _refresh_requested is None:
+        _refresh_requested = asyncio.Event()
+    return _refresh_requested
+
+
+def _get_sync_lock() -> asyncio.Lock:
+    global _sync_lock
+    if _sync_lock is None:
+        _sync_lock = asyncio.Lock()
+    return _sync_lock
+
+
+def is_ready() -> bool:
+    """Индекс хотя бы раз полностью синхронизирован с панелью."""
+    return _ready
+
+
+def request_refresh() -> None:
+    """Просит фоновую задачу пересинхронизировать индекс вне расписания (после массовых операций)."""
+    _get_refresh_event().set()
+
+
+async def remember_users(*responses: dict) -> None:
+    """Обновляет индекс по ответам API после собственных изменений бота."""
+    users = []
+    for response in responses:
+        if not isinstance(response, dict):
+            continue
+        info = response.get("response", response)
+        if isinstance(info, dict) and info.get("uuid"):
+            users.append(info)
+    if not users:
+        return
+    try:
+        await PanelUser.aio.upsert_many(users)
+    except Exception:
+        logger.exception("Failed to update panel user index")
+
+
+async def forget_users(uuids: list[str]) -> None:
+    """Удаляет пользователей из индекса после их удаления в панели."""
+    try:
+        await PanelUser.aio.delete_many(list(uuids))
+    except Exception:
+        logger.exception("Failed to delete users from panel user index")
+
+
+async def search_users(query: str, limit: int = 200) -> Optional[list[dict]]:
+    """Ищет пользователей в индексе. Возвращает None, если индекс ещё пуст."""
+    if not _ready and not await PanelUser.aio.count():
+        return None
+    return await PanelUser.aio.search(query, limit)
+
+
+async def fetch_users(uuids: list[str]) -> list[dict]:
+    """
+    Данные пользователей по uuid: из индекса, недостающие — из панели параллельно.
+
+    Не найденные в панели пользователи пропускаются.
+    """
+    from src.services.api_client import ApiClientError, api_client
+
+    found = await PanelUser.aio.get_many(list(uuids))
+    missing = [uuid for uuid in uuids if uuid not in found]
+    if missing:
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+        async def fetch(uuid: str) -> None:
+            async with semaphore:
+                try:
+                    data = await api_client.get_user_by_uuid(uuid)
+                except ApiClientError:
+                    logger.debug("Failed to get user data user_uuid=%s", uuid)
+                    return
+            found[uuid] = data.get("response", data)
+
+        await asyncio.gather(*(fetch(uuid) for uuid in missing))
+    return [found[uuid] for uuid in uuids if uuid in found]
+
+
+async def get_users_by_status(status: str, fresh: bool = False) -> list[dict]:
+    """
+    Пользователи панели с указанным статусом.
+
+    Берутся из индекса, если он синхронизирован; fresh=True или пустой
+    индекс — выборка напрямую из панели.
+    """
+    from src.services.api_client import api_client
+
+    if _ready and not fresh:
+        return await PanelUser.aio.get_by_status(status)
+    return [
+        user
+        async for user in api_client.iter_users(
+            page_size=SYNC_PAGE_SIZE,
+            prefetch=PREFETCH_CONCURRENCY,
+            where=lambda user: user.get("status") == status and bool(user.get("uuid")),
+        )
+    ]
+
+
+async def sync_user_index() -> dict:
+    """
+    Сверяет индекс с панелью.
+
+    Панель обходится страницами по SYNC_PAGE_SIZE, в БД записываются только
+    пользователи с изменившимся updatedAt, а отсутствующие в панели удаляются.
+
+    Returns:
+        {'total': ..., 'changed': ..., 'removed': ...}
+    """
+    from src.services.api_client import api_client
+
+    global _ready
+    async with _get_sync_lock():
+        known = await PanelUser.aio.get_versions()
+        seen: set[str] = set()
+        changed = 0
+        updated: list[dict] = []
+        async for user in api_client.iter_users(page_size=SYNC_PAGE_SIZE):
+            uuid = user.get("uuid")
+            if not uuid:
+                continue
+            seen.add(uuid)
+            if uuid not in known or known[uuid] != user.get("updatedAt"):
+                updated.append(user)
+                if len(updated) >= SYNC_PAGE_SIZE:
+                    changed += await PanelUser.aio.upsert_many(updated)
+                    updated = []
+        if updated:
+            changed += await PanelUser.aio.upsert_many(updated)
+
+        removed = [uuid for uuid in known if uuid not in seen]
+        if removed:
+            await PanelUser.aio.delete_many(removed)
+        _ready = True
+        return {"total": len(seen), "changed": changed, "removed": len(removed)}
+
+
+async def start_user_index_sync(interval_minutes: int = 15) -> None:
+    """
+    Запускает фоновую синхронизацию индекса пользователей.
+
+    Args:
+        interval_minutes: Интервал полной сверки с панелью в минутах
+    """
+    logger.info("Starting panel user index sync (interval: %d minutes)", interval_minutes)
+    refresh = _get_refresh_event()
+
+    while True:
+        refresh.clear()
+        try:
+            stats = await sync_user_index()
+            logger.info(
+                "Panel user index synced: total=%s changed=%s removed=%s",
+                stats["total"], stats["changed"], stats["removed"]
+            )
+        except Exception as e:
+            logger.exception("Error in panel user index sync loop: %s", e)
+
+        try:
+            await asyncio.wait_for(refresh.wait(), timeout=interval_minutes * 60)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,108 @@
+"""Асинхронный клиент YooKassa API v3 (вместо блокирующего SDK)."""
+import asyncio
+import uuid
+from typing import Any, Optional
+
+import httpx
+
+from src.config import get_settings
+from src.utils.logger import logger
+
+# Временные ошибки, после которых запрос повторяется с тем же Idempotence-Key
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    """Ошибка ответа YooKassa (response — исходный httpx.Response, если он был)."""
+
+    def __init__(self, message: str, response: Optional[httpx.Response] = None) -> None:
+        super().__init__(message)
+        self.response = response
+        self.status_code = response.status_code if response is not None else None
+
+
+class YooKassaObject(dict):
+    """Ответ API с доступом к полям через атрибуты, как у объектов SDK.
+
+    Отсутствующие поля дают AttributeError (hasattr работает как раньше),
+    основные поля платежа при отсутствии возвращают None.
+    """
+
+    _optional_fields = ("id", "status", "paid", "amount", "confirmation", "metadata", "payment_method")
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            value = self[name]
+        except KeyError:
+            if name in self._optional_fields:
+                return None
+            raise AttributeError(name) from None
+        return YooKassaObject(value) if isinstance(value, dict) else value
+
+
+class YooKassaClient:
+    """Пул соединений к YooKassa с таймаутами, ключами идемпотентности и retry."""
+
+    def __init__(self, base_url: Optional[str] = None, max_retries: int = 3) -> None:
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            settings = get_settings()
+            if not settings.yookassa_shop_id or not settings.yookassa_secret_key:
+                raise ValueError("YooKassa not configured")
+            self._client = httpx.AsyncClient(
+                base_url=(self.base_url or settings.yookassa_api_url).rstrip("/"),
+                auth=httpx.BasicAuth(settings.yookassa_shop_id, settings.yookassa_secret_key),
+                headers={"Content-Type": "application/json"},
+                timeout=httpx.Timeout(connect=5.0, read=20.0, write=10.0, pool=5.0),
+                limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+            )
+        return self._client
+
+    async def _request(
+        self, method: str, url: str, json: Optional[dict] = None, idempotence_key: Optional[str] = None
+    ) -> YooKassaObject:
+        client = self._get_client()
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        last_exc: Optional[Exception] = None
+        for attempt in range(self.max_retries):
+            try:
+                response = await client.request(method, url, json=json, headers=headers)
+                if response.status_code in RETRY_STATUSES and attempt < self.max_retries - 1:
+                    last_exc = YooKassaError(f"YooKassa {method} {url} returned {response.status_code}", response)
+                else:
+                    if response.is_error:
+                        raise YooKassaError(
+                            f"YooKassa {method} {url} returned {response.status_code}", response
+                        )
+                    return YooKassaObject(response.json())
+            except (httpx.TimeoutException, httpx.TransportError) as exc:
+                last_exc = exc
+            if attempt < self.max_retries - 1:
+                delay = 0.5 * (2 ** attempt)  # Экспоненциальная задержка: 0.5s, 1s
+                logger.warning(
+                    "YooKassa %s %s failed: %s, retrying in %.1fs (attempt %d/%d)",
+                    method, url, last_exc, delay, attempt + 1, self.max_retries
+                )
+                await asyncio.sleep(delay)
+        raise YooKassaError(f"YooKassa {method} {url} failed after {self.max_retries} attempts") from last_exc
+
+    async def create_payment(self, params: dict, idempotence_key: Optional[str] = None) -> YooKassaObject:
+        """Создаёт платёж. Повторы запроса идут с тем же ключом, поэтому дубль платежа не создаётся."""
+        return await self._request("POST", "/payments", json=params, idempotence_key=idempotence_key or str(uuid.uuid4()))
+
+    async def get_payment(self, payment_id: str) -> YooKassaObject:
+        """Получает платёж по ID."""
+        return await self._request("GET", f"/payments/{payment_id}")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Single shared instance
+yookassa_client = YooKassaClient()
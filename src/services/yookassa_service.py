@@ -3,30 +3,27 @@ import io
 from datetime import datetime, timedelta
 from typing import Optional
 
-import qrcode
-from yookassa import Configuration, Payment as YooKassaPayment
-
 from src.config import get_settings
 from src.database import Payment
+from src.services.bootstrap_cache import invalidate_user_cache
+from src.services.yookassa_client import yookassa_client
 from src.utils.logger import logger
 
 
 def init_yookassa():
-    """Инициализирует YooKassa с настройками из конфига."""
+    """Проверяет, что в конфиге заданы данные магазина YooKassa."""
     settings = get_settings()
     if not settings.yookassa_shop_id or not settings.yookassa_secret_key:
         logger.warning("YooKassa credentials not configured")
         return False
-    
-    Configuration.account_id = settings.yookassa_shop_id
-    Configuration.secret_key = settings.yookassa_secret_key
     return True
 
 
 async def create_yookassa_payment(
     user_id: int,
     subscription_months: int,
-    payment_method: str  # "sbp" или "card"
+    payment_method: str,  # "sbp" или "card"
+    status: str | None = None
 ) -> dict:
     """Создает платеж через YooKassa.
     
@@ -34,6 +31,7 @@ async def create_yookassa_payment(
         user_id: ID пользователя Telegram
         subscription_months: Количество месяцев подписки (1, 3, 6, 12)
         payment_method: Способ оплаты ("sbp" или "card")
+        status: Статус лояльности, если уже известен (иначе читается из БД)
     
     Returns:
         Словарь с payment_id, payment_url и payment_db_id
@@ -45,8 +43,10 @@ async def create_yookassa_payment(
     subscription_days = subscription_months * 30
     
     # Получаем цену с учётом скидки лояльности
-    from src.services.loyalty_service import get_price_with_discount
-    price_info = get_price_with_discount(user_id, subscription_days)
+    from src.services.loyalty_service import fetch_loyalty_status, get_price_with_discount
+    if status is None:
+        status = await fetch_loyalty_status(user_id)
+    price_info = get_price_with_discount(user_id, subscription_days, status)
     
     base_amount = price_info['base_price']
     amount = price_info['discounted_price']
@@ -68,13 +68,14 @@ async def create_yookassa_payment(
     description = f"Подписка shftsecure {description_ru} | shftsecure subscription {description_en}"
     
     # Создаем запись о платеже в БД
-    payment_db_id = Payment.create(
+    payment_db_id = await Payment.aio.create(
         user_id=user_id,
         amount_rub=amount,
         invoice_payload=f"yookassa:{user_id}:{subscription_months}:{payment_method}",
         subscription_days=subscription_days,
         payment_method=payment_method
     )
+    invalidate_user_cache(user_id)
     
     # Настройки платежа в зависимости от метода
     # Для СБП используем qr, чтобы получить QR-код напрямую
@@ -124,8 +125,8 @@ async def create_yookassa_payment(
             amount_str, payment_method, subscription_months, user_id, confirmation_type
         )
         
-        # Создаем платеж в YooKassa
-        payment = YooKassaPayment.create(payment_params)
+        # Создаем платеж в YooKassa (ключ идемпотентности привязан к записи в БД)
+        payment = await yookassa_client.create_payment(payment_params, idempotence_key=f"payment-{payment_db_id}")
         
         yookassa_payment_id = payment.id
         confirmation_type_returned = getattr(payment.confirmation, 'type', 'unknown') if payment.confirmation else None
@@ -224,7 +225,7 @@ async def create_yookassa_payment(
         )
         
         # Обновляем запись в БД с информацией о платеже YooKassa
-        Payment.update_yookassa_payment(
+        await Payment.aio.update_yookassa_payment(
             payment_db_id,
             yookassa_payment_id,
             yookassa_payment_url or ""
@@ -274,7 +275,8 @@ async def create_yookassa_payment(
         logger.exception("Full traceback:")
         
         # Обновляем статус платежа на failed
-        Payment.update_status(payment_db_id, "failed")
+        await Payment.aio.update_status(payment_db_id, "failed")
+        invalidate_user_cache(user_id)
         raise
 
 
@@ -291,7 +293,7 @@ async def check_yookassa_payment_status(payment_id: str) -> dict:
         raise ValueError("YooKassa not configured")
     
     try:
-        payment = YooKassaPayment.find_one(payment_id)
+        payment = await yookassa_client.get_payment(payment_id)
         
         return {
             "id": payment.id,
@@ -307,19 +309,21 @@ async def check_yookassa_payment_status(payment_id: str) -> dict:
 
 async def process_yookassa_payment(
     payment_id: str,
-    bot=None
+    bot=None,
+    verified: bool = False
 ) -> dict:
     """Обрабатывает успешный платеж YooKassa.
     
     Args:
         payment_id: ID платежа в YooKassa
         bot: Экземпляр бота для уведомлений
+        verified: Вызывающий уже проверил в YooKassa, что платеж оплачен
     
     Returns:
         Словарь с результатом обработки
     """
     # Находим платеж в БД
-    payment = Payment.get_by_yookassa_id(payment_id)
+    payment = await Payment.aio.get_by_yookassa_id(payment_id)
     if not payment:
         logger.error(f"Payment not found for YooKassa ID: {payment_id}")
         return {"success": False, "error": "Payment not found"}
@@ -333,17 +337,18 @@ async def process_yookassa_payment(
         }
     
     # Проверяем статус в YooKassa
-    try:
-        yookassa_status = await check_yookassa_payment_status(payment_id)
-    except Exception as e:
-        logger.exception("Failed to check YooKassa payment status")
-        return {"success": False, "error": str(e)}
-    
-    if yookassa_status["status"] != "succeeded" or not yookassa_status["paid"]:
-        return {
-            "success": False,
-            "error": f"Payment not completed. Status: {yookassa_status['status']}"
-        }
+    if not verified:
+        try:
+            yookassa_status = await check_yookassa_payment_status(payment_id)
+        except Exception as e:
+            logger.exception("Failed to check YooKassa payment status")
+            return {"success": False, "error": str(e)}
+        
+        if yookassa_status["status"] != "succeeded" or not yookassa_status["paid"]:
+            return {
+                "success": False,
+                "error": f"Payment not completed. Status: {yookassa_status['status']}"
+            }
     
     # Парсим invoice_payload для получения данных
     invoice_payload = payment["invoice_payload"]
@@ -354,96 +359,38 @@ async def process_yookassa_payment(
     
     user_id = int(parts[1])
     subscription_months = int(parts[2])
-    subscription_days = payment["subscription_days"]
-    # Используем логику из payment_service для создания/обновления пользователя
-    # Но адаптируем под YooKassa - создаем временный payload
-    temp_payload = f"{user_id}:{subscription_months}:0"
-    
-    # Временно обновляем invoice_payload для совместимости с process_successful_payment
-    from src.database import get_db_connection
-    original_payload = payment["invoice_payload"]
-    with get_db_connection() as conn:
-        conn.execute(
-            "UPDATE payments SET invoice_payload = ? WHERE id = ?",
-            (temp_payload, payment["id"])
-        )
-        conn.commit()
     
-    try:
-        from src.services.payment_service import process_successful_payment
-        
-        result = await process_successful_payment(
-            user_id=user_id,
-            invoice_payload=temp_payload,
-            total_amount=0,  # Для YooKassa не используется
-            bot=bot
-        )
-        
-        # Восстанавливаем оригинальный payload
-        with get_db_connection() as conn:
-            conn.execute(
-                "UPDATE payments SET invoice_payload = ? WHERE id = ?",
-                (original_payload, payment["id"])
-            )
-            conn.commit()
-        
-        if result.get("success"):
-            # Обновляем статус платежа (если еще не обновлен в process_successful_payment)
-            if payment["status"] != "completed":
-                Payment.update_status(payment["id"], "completed", result.get("user_uuid"))
-            
-            # Уведомление пользователю уже отправлено в process_successful_payment
-            # Не дублируем его здесь
-            
-            return result
-        else:
-            Payment.update_status(payment["id"], "failed")
-            return result
-    except Exception as e:
-        logger.exception("Failed to process YooKassa payment")
-        # Восстанавливаем оригинальный payload даже при ошибке
-        with get_db_connection() as conn:
-            conn.execute(
-                "UPDATE payments SET invoice_payload = ? WHERE id = ?",
-                (original_payload, payment["id"])
-            )
-            conn.commit()
-        Payment.update_status(payment["id"], "failed")
-        return {"success": False, "error": str(e)}
+    # Общий путь выдачи подписки; данные платежа передаются явно
+    from src.services.payment_service import complete_subscription_payment
+    return await complete_subscription_payment(
+        payment["id"],
+        user_id,
+        subscription_months,
+        subscription_months * 30,
+        bot=bot
+    )
 
 
 def generate_qr_code_image(data: str) -> io.BytesIO:
     """Генерирует QR-код из данных и возвращает как BytesIO.
     
+    Рисует синхронно; в обработчиках используйте qr_service (пул процессов).
+    
     Args:
         data: Данные для QR-кода (обычно URL или строка для СБП)
     
     Returns:
         BytesIO объект с изображением QR-кода
     """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
-    )
-    qr.add_data(data)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    # Сохраняем в BytesIO
-    img_bytes = io.BytesIO()
-    img.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
-    
-    return img_bytes
+    from src.services.qr_render import render_qr_png
+    return io.BytesIO(render_qr_png(data))
 
 
 async def create_yookassa_gift_payment(
     user_id: int,
     subscription_months: int,
-    payment_method: str  # "sbp" или "card"
+    payment_method: str,  # "sbp" или "card"
+    status: str | None = None
 ) -> dict:
     """Создает платеж через YooKassa для подарочной подписки.
     
@@ -451,6 +398,7 @@ async def create_yookassa_gift_payment(
         user_id: ID покупателя (Telegram)
         subscription_months: Количество месяцев подписки (1, 3, 6, 12)
         payment_method: Способ оплаты ("sbp" или "card")
+        status: Статус лояльности, если уже известен (иначе читается из БД)
     
     Returns:
         Словарь с payment_id, payment_url и payment_db_id
@@ -462,8 +410,10 @@ async def create_yookassa_gift_payment(
     subscription_days = subscription_months * 30
     
     # Получаем цену с учётом скидки лояльности
-    from src.services.loyalty_service import get_price_with_discount
-    price_info = get_price_with_discount(user_id, subscription_days)
+    from src.services.loyalty_service import fetch_loyalty_status, get_price_with_discount
+    if status is None:
+        status = await fetch_loyalty_status(user_id)
+    price_info = get_price_with_discount(user_id, subscription_days, status)
     
     base_amount = price_info['base_price']
     amount = price_info['discounted_price']
@@ -485,13 +435,14 @@ async def create_yookassa_gift_payment(
     description = f"🎁 Подарок shftsecure {description_ru} | Gift shftsecure {description_en}"
     
     # Создаем запись о платеже в БД с пометкой gift
-    payment_db_id = Payment.create(
+    payment_db_id = await Payment.aio.create(
         user_id=user_id,
         amount_rub=amount,
         invoice_payload=f"yookassa_gift:{user_id}:{subscription_months}:{payment_method}",
         subscription_days=subscription_days,
         payment_method=payment_method
     )
+    invalidate_user_cache(user_id)
     
     # Настройки платежа
     if payment_method == "sbp":
@@ -526,7 +477,9 @@ async def create_yookassa_gift_payment(
                 "type": "sbp"
             }
         
-        yookassa_payment = YooKassaPayment.create(payment_params)
+        yookassa_payment = await yookassa_client.create_payment(
+            payment_params, idempotence_key=f"payment-{payment_db_id}"
+        )
         
         yookassa_payment_id = yookassa_payment.id
         confirmation = yookassa_payment.confirmation
@@ -556,7 +509,7 @@ async def create_yookassa_gift_payment(
                 raise ValueError("YooKassa did not return confirmation_url")
             qr_data = yookassa_payment_url
         
-        Payment.update_yookassa_payment(
+        await Payment.aio.update_yookassa_payment(
             payment_db_id,
             yookassa_payment_id,
             yookassa_payment_url or ""
@@ -579,19 +532,22 @@ async def create_yookassa_gift_payment(
             "Failed to create YooKassa gift payment for user %s: %s",
             user_id, e
         )
-        Payment.update_status(payment_db_id, "failed")
+        await Payment.aio.update_status(payment_db_id, "failed")
+        invalidate_user_cache(user_id)
         raise
 
 
 async def process_yookassa_gift_payment(
     payment_id: str,
-    bot=None
+    bot=None,
+    verified: bool = False
 ) -> dict:
     """Обрабатывает успешный подарочный платеж YooKassa.
     
     Args:
         payment_id: ID платежа в YooKassa
         bot: Экземпляр бота для уведомлений
+        verified: Вызывающий уже проверил в YooKassa, что платеж оплачен
     
     Returns:
         Словарь с результатом обработки
@@ -599,7 +555,7 @@ async def process_yookassa_gift_payment(
     from src.database import GiftCode
     
     # Находим платеж в БД
-    payment = Payment.get_by_yookassa_id(payment_id)
+    payment = await Payment.aio.get_by_yookassa_id(payment_id)
     if not payment:
         logger.error(f"Gift payment not found for YooKassa ID: {payment_id}")
         return {"success": False, "error": "Payment not found"}
@@ -609,17 +565,18 @@ async def process_yookassa_gift_payment(
         return {"success": True, "already_completed": True}
     
     # Проверяем статус в YooKassa
-    try:
-        yookassa_status = await check_yookassa_payment_status(payment_id)
-    except Exception as e:
-        logger.exception("Failed to check YooKassa gift payment status")
-        return {"success": False, "error": str(e)}
-    
-    if yookassa_status["status"] != "succeeded" or not yookassa_status["paid"]:
-        return {
-            "success": False,
-            "error": f"Payment not completed. Status: {yookassa_status['status']}"
-        }
+    if not verified:
+        try:
+            yookassa_status = await check_yookassa_payment_status(payment_id)
+        except Exception as e:
+            logger.exception("Failed to check YooKassa gift payment status")
+            return {"success": False, "error": str(e)}
+        
+        if yookassa_status["status"] != "succeeded" or not yookassa_status["paid"]:
+            return {
+                "success": False,
+                "error": f"Payment not completed. Status: {yookassa_status['status']}"
+            }
     
     # Парсим invoice_payload: yookassa_gift:user_id:months:method
     invoice_payload = payment["invoice_payload"]
@@ -634,26 +591,36 @@ async def process_yookassa_gift_payment(
     subscription_days = payment["subscription_days"]
     amount_rub = payment["amount_rub"]
     
-    # Создаем подарочный код
-    gift = GiftCode.create(
-        buyer_id=user_id,
-        subscription_days=subscription_days,
-        amount_rub=amount_rub,
-        payment_method=payment_method
-    )
-    
-    if not gift:
-        logger.error("Failed to create gift code for YooKassa payment")
-        Payment.update_status(payment["id"], "failed")
-        return {"success": False, "error": "Failed to create gift code"}
-    
-    # Обновляем статус платежа
-    Payment.update_status(payment["id"], "completed")
+    from src.services.payment_service import payment_lock
+    async with payment_lock(payment["id"]):
+        # Параллельная обработка могла уже выдать код по этому платежу
+        payment = await Payment.aio.get(payment["id"])
+        if payment["status"] == "completed":
+            logger.warning(f"Gift payment {payment['id']} already completed")
+            return {"success": True, "already_completed": True}
+        
+        # Код и завершение платежа — одна транзакция: сбой между ними не даст второго кода
+        try:
+            gift = await GiftCode.aio.create_for_payment(
+                payment["id"],
+                buyer_id=user_id,
+                subscription_days=subscription_days,
+                amount_rub=amount_rub,
+                payment_method=payment_method
+            )
+        except Exception as gift_exc:
+            logger.error("Failed to create gift code for YooKassa payment: %s", gift_exc)
+            # Транзакция откатилась: платёж остаётся ожидающим, повторная обработка выдаст код
+            return {"success": False, "error": "Failed to create gift code"}
+        
+        if not gift:
+            logger.warning(f"Gift payment {payment['id']} already completed")
+            return {"success": True, "already_completed": True}
     
     # Начисляем баллы лояльности за покупку подарка
     from src.database import Loyalty
     try:
-        loyalty_result = Loyalty.add_points(user_id, amount_rub)
+        loyalty_result = await Loyalty.aio.add_points(user_id, amount_rub)
         logger.info(
             f"Loyalty points added for gift purchase: +{amount_rub} points, "
             f"total: {loyalty_result['points']}, status: {loyalty_result['status']}"
@@ -661,6 +628,7 @@ async def process_yookassa_gift_payment(
     except Exception as loyalty_exc:
         logger.warning(f"Failed to add loyalty points for gift purchase: {loyalty_exc}")
     
+    invalidate_user_cache(user_id)
     logger.info(f"YooKassa gift code created: {gift['code']} for user {user_id}")
     
     # Отправляем уведомление пользователю о созданном подарке
@@ -674,8 +642,9 @@ async def process_yookassa_gift_payment(
                 f"💰 Сумма: <b>{amount_rub}₽</b>\n\n"
                 f"Отправьте этот код другу для активации подписки!"
             )
-            await bot.send_message(user_id, gift_text, parse_mode="HTML")
-            logger.info(f"Gift code notification sent to user {user_id}")
+            from src.services.notification_service import send_user_message
+            await send_user_message(bot, user_id, gift_text)
+            logger.info(f"Gift code notification queued for user {user_id}")
         except Exception as e:
             logger.warning(f"Failed to send gift notification to user {user_id}: {e}")
     
@@ -689,7 +658,10 @@ async def process_yookassa_gift_payment(
                 f"👤 Покупатель: <code>{user_id}</code>\n"
                 f"🎫 Код: <code>{gift['code']}</code>\n"
                 f"📅 Срок: {subscription_days} дней\n"
-                f"💰 Сумма: {amount_rub} ₽"
+                f"💰 Сумма: {amount_rub} ₽",
+                kind="gift",
+                summary=f"<code>{user_id}</code> · {subscription_days} дн. · {amount_rub}₽",
+                critical=True
             )
         except Exception as notif_exc:
             logger.warning("Failed to send gift notification: %s", notif_exc)
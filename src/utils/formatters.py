@@ -33,6 +33,11 @@ def format_bytes(value: float | int | None) -> str:
     return f"{size:.1f} PB"
 
 
+def format_count(value: int | None) -> str:
+    """Число или прочерк, если значение не удалось получить."""
+    return "—" if value is None else str(value)
+
+
 def format_datetime(dt_str: str | None) -> str:
     if not dt_str:
         return NA
@@ -0,0 +1,52 @@
+"""Хранилище aiogram FSM поверх PersistentDict (состояние переживает перезапуск)."""
+from typing import Any, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from src.utils.state_store import PersistentDict, STATE_TTL_HOURS
+
+
+class SQLiteStorage(BaseStorage):
+    """Замена MemoryStorage: LRU в памяти, TTL и отложенная запись в SQLite."""
+
+    def __init__(self, ttl: float = STATE_TTL_HOURS * 3600) -> None:
+        self._records = PersistentDict("fsm", ttl=ttl, key_type=str)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _update(self, key: StorageKey, **fields: Any) -> None:
+        record_key = self._key(key)
+        record = dict(self._records.get(record_key) or {})
+        record.update(fields)
+        if record.get("state") is None and not record.get("data"):
+            self._records.pop(record_key, None)
+        else:
+            self._records[record_key] = record
+
+    async def _record(self, key: StorageKey) -> dict:
+        """Запись ключа; отсутствующая в памяти подгружается из SQLite вне event loop."""
+        record_key = self._key(key)
+        await self._records.prefetch(record_key)
+        return self._records.get(record_key) or {}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._records.prefetch(self._key(key))
+        self._update(key, state=state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).get("state")
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        await self._records.prefetch(self._key(key))
+        self._update(key, data=dict(data))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._record(key)).get("data") or {})
+
+    async def close(self) -> None:
+        await self._records.flush()
@@ -1,7 +1,9 @@
 import gettext
 import json
+import threading
 from pathlib import Path
-from typing import Dict, Iterable, Tuple
+from string import Formatter
+from typing import Any, Dict, Iterable, Optional, Tuple
 
 from aiogram.utils.i18n import I18n, I18nMiddleware
 
@@ -20,12 +22,74 @@ def _flatten_translations(data: dict, prefix: str = "") -> Iterable[Tuple[str, s
             yield full_key, str(value)
 
 
+class MessageTemplate:
+    """Translation string with placeholders parsed once.
+
+    Rendering walks the pre-parsed parts instead of re-scanning the string on
+    every ``.format()``. Templates with positional or nested fields
+    (``{0}``, ``{user.name}``, ``{items[0]}``) fall back to ``str.format``.
+    """
+
+    __slots__ = ("text", "_parts", "_simple")
+
+    _formatter = Formatter()
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        try:
+            parts = list(self._formatter.parse(text))
+        except ValueError:
+            # Непарные фигурные скобки — рендерим как есть
+            parts = [(text, None, None, None)]
+        self._simple = all(
+            field is None or (field and field.isidentifier() and not (spec and "{" in spec))
+            for _, field, spec, _ in parts
+        )
+        self._parts = tuple(parts)
+
+    def render(self, **kwargs: Any) -> str:
+        if not self._simple:
+            return self.text.format(**kwargs)
+        chunks = []
+        for literal, field, spec, conversion in self._parts:
+            if literal:
+                chunks.append(literal)
+            if field is None:
+                continue
+            value = kwargs[field]
+            if conversion == "r":
+                value = repr(value)
+            elif conversion == "s":
+                value = str(value)
+            elif conversion == "a":
+                value = ascii(value)
+            chunks.append(format(value, spec or ""))
+        return "".join(chunks)
+
+
 class JsonTranslations(gettext.NullTranslations):
     """Minimal gettext-compatible translations backed by JSON files."""
 
     def __init__(self, messages: Dict[str, str]) -> None:
         super().__init__()
         self._messages = messages
+        # Every message is parsed once at load, not on first use
+        self._templates: Dict[str, MessageTemplate] = {
+            key: MessageTemplate(text) for key, text in messages.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def get(self, message: str) -> Optional[str]:
+        return self._messages.get(message)
+
+    def template(self, message: str) -> MessageTemplate:
+        """Returns the pre-parsed template for a key (the key itself if it is missing)."""
+        template = self._templates.get(message)
+        if template is None:
+            template = MessageTemplate(message)
+        return template
 
     def gettext(self, message: str) -> str:  # type: ignore[override]
         return self._messages.get(message, message)
@@ -59,9 +123,48 @@ class JsonI18n(I18n):
         return translations
 
 
-def get_i18n() -> I18n:
-    settings = get_settings()
-    return JsonI18n(path=BASE_LOCALES_PATH, default_locale=settings.default_locale, domain="messages")
+_i18n: Optional[JsonI18n] = None
+_i18n_lock = threading.Lock()
+
+
+def get_i18n() -> JsonI18n:
+    """Returns the process-wide i18n registry (locales are read from disk once)."""
+    global _i18n
+    if _i18n is None:
+        with _i18n_lock:
+            if _i18n is None:
+                settings = get_settings()
+                _i18n = JsonI18n(path=BASE_LOCALES_PATH, default_locale=settings.default_locale, domain="messages")
+    return _i18n
+
+
+def reload_i18n() -> Dict[str, int]:
+    """Re-reads locale JSON files into the shared registry (admin hot-reload).
+
+    Returns:
+        Number of keys per loaded locale
+    """
+    i18n = get_i18n()
+    i18n.reload()
+    return {locale: len(translations) for locale, translations in i18n.locales.items()}
+
+
+def t(key: str, locale: Optional[str] = None, **kwargs: Any) -> str:
+    """Translates ``key`` for ``locale`` (current/default locale if omitted).
+
+    Lookup is a single dict access; placeholders are substituted from the
+    pre-parsed template. Unknown keys are returned unchanged, like gettext.
+    """
+    i18n = get_i18n()
+    if locale is None:
+        locale = i18n.current_locale
+    translations = i18n.locales.get(locale) or i18n.locales.get(i18n.default_locale)
+    if translations is None:
+        return key.format(**kwargs) if kwargs else key
+    if not kwargs:
+        message = translations.get(key)
+        return key if message is None else message
+    return translations.template(key).render(**kwargs)
 
 
 def get_i18n_middleware() -> I18nMiddleware:
@@ -0,0 +1,232 @@
+"""Метрики в формате Prometheus (гистограммы задержек, счётчики, размеры очередей).
+
+Без внешних зависимостей: метрики пишутся из event loop, а отдаются текстом
+по /metrics на сервере Mini App.
+"""
+import asyncio
+import contextvars
+import math
+import time
+from collections.abc import Mapping
+from typing import Callable, Iterable, Optional
+
+# Границы корзин гистограмм задержек (секунды), как в prometheus_client
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Текущее значение. collect — функция, возвращающая {значения меток: число} при каждом scrape."""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        collect: Optional[Callable[[], dict[tuple[str, ...], float]]] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._collect = collect
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def render(self) -> list[str]:
+        values = dict(self._values)
+        if self._collect is not None:
+            try:
+                values.update(self._collect())
+            except Exception:
+                # Сбор не должен ломать весь /metrics
+                return []
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # {метки: [счётчики по корзинам..., сумма, количество]}
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, series in sorted(self._values.items()):
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {_format_value(count)}")
+            inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {_format_value(series[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Single shared instance
+registry = Registry()
+
+HANDLER_DURATION = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Time spent in aiogram handlers.", ("event", "handler", "status")
+))
+API_DURATION = registry.register(Histogram(
+    "remnawave_api_request_duration_seconds", "Remnawave API client call duration.", ("method", "status")
+))
+API_RETRIES = registry.register(Counter(
+    "remnawave_api_retries_total", "Remnawave API requests retried after network errors.", ("method",)
+))
+WEBAPP_DURATION = registry.register(Histogram(
+    "webapp_request_duration_seconds", "Mini App HTTP request duration.", ("route", "method", "status")
+))
+DB_DURATION = registry.register(Histogram(
+    "sqlite_query_duration_seconds", "SQLite model call duration including queueing.", ("operation", "kind")
+))
+LOOP_LAG = registry.register(Gauge(
+    "event_loop_lag_seconds", "Delay of a periodic event loop wakeup over its schedule."
+))
+
+# Метод RemnawaveApiClient, в рамках которого идёт запрос (для счётчика повторов)
+current_api_method: contextvars.ContextVar[str] = contextvars.ContextVar("current_api_method", default="unknown")
+
+
+def _collect_state_sizes() -> dict[tuple[str, ...], float]:
+    from src.handlers import state
+
+    return {
+        (name,): len(value)
+        for name, value in vars(state).items()
+        if name.isupper() and isinstance(value, Mapping)
+    }
+
+
+def _collect_db_queue() -> dict[tuple[str, ...], float]:
+    from src.database import get_write_queue_size
+
+    return {(): get_write_queue_size()}
+
+
+def _collect_api_cache() -> dict[tuple[str, ...], float]:
+    from src.services.api_client import api_client
+
+    return {(name,): value for name, value in api_client.cache_stats().items()}
+
+
+def _collect_api_resilience() -> dict[tuple[str, ...], float]:
+    from src.services.api_client import api_client
+
+    return {(name,): value for name, value in api_client.resilience_stats().items()}
+
+
+registry.register(Gauge(
+    "bot_state_entries", "In-memory entries of the state dicts in src/handlers/state.py.", ("name",),
+    collect=_collect_state_sizes,
+))
+registry.register(Gauge(
+    "sqlite_write_queue_size", "Pending operations in the SQLite writer queue.", collect=_collect_db_queue,
+))
+registry.register(Gauge(
+    "remnawave_api_cache", "Remnawave API response cache counters.", ("stat",), collect=_collect_api_cache,
+))
+registry.register(Gauge(
+    "remnawave_api_circuit", "Remnawave API circuit breaker state and retry budget.", ("stat",),
+    collect=_collect_api_resilience,
+))
+
+
+async def start_loop_lag_monitor(interval_seconds: float = 0.5) -> None:
+    """Фоновая задача: измеряет, насколько event loop опаздывает с пробуждением."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval_seconds)
+        LOOP_LAG.set(max(0.0, time.monotonic() - started - interval_seconds))
@@ -0,0 +1,35 @@
+"""Middleware, записывающий длительность обработчиков aiogram в метрики."""
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from src.utils.metrics import HANDLER_DURATION
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработки события по имени обработчика (регистрируется как inner middleware)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            handler_object = data.get("handler")
+            callback = getattr(handler_object, "callback", None)
+            HANDLER_DURATION.observe(
+                time.perf_counter() - started,
+                event=type(event).__name__,
+                handler=getattr(callback, "__name__", "unknown"),
+                status=status,
+            )
@@ -2,12 +2,15 @@
 from datetime import datetime
 
 from aiogram import Bot
-from aiogram.types import Message
+from aiogram.types import BufferedInputFile, Message
 
 from src.config import get_settings
 from src.utils.formatters import format_bytes, format_datetime
 from src.utils.logger import logger
 
+# Сколько пользователей перечислять в сводном уведомлении; больше — список уходит файлом
+BULK_NOTIFICATION_LIST_LIMIT = 30
+
 
 async def send_user_notification(
     bot: Bot,
@@ -202,19 +205,18 @@ async def send_user_notification(
         
         text = "\n".join(lines)
         
-        # Отправляем в топик
-        message_kwargs = {
-            "chat_id": settings.notifications_chat_id,
-            "text": text,
-            "parse_mode": "HTML",
-        }
+        # Отправляем в топик через очередь; при всплеске уведомления сворачиваются в сводку
+        from src.services.notification_outbox import Notification, enqueue_notification
         
-        # Добавляем message_thread_id только если он указан
-        if settings.notifications_topic_id is not None:
-            message_kwargs["message_thread_id"] = settings.notifications_topic_id
-        
-        await bot.send_message(**message_kwargs)
-        logger.info("User notification sent successfully action=%s chat_id=%s", action, settings.notifications_chat_id)
+        title = {"created": "✅", "updated": "✏️", "deleted": "🗑"}.get(action, action)
+        await enqueue_notification(bot, Notification(
+            chat_id=settings.notifications_chat_id,
+            text=text,
+            thread_id=settings.notifications_topic_id,
+            kind="user",
+            summary=f"{title} <code>{_esc(info.get('username', 'n/a'))}</code>",
+        ))
+        logger.info("User notification queued action=%s chat_id=%s", action, settings.notifications_chat_id)
         
     except Exception as exc:
         logger.exception(
@@ -227,6 +229,59 @@ async def send_user_notification(
         )
 
 
+async def send_bulk_user_notification(
+    bot: Bot,
+    action: str,  # "deleted"
+    users: list[dict],
+    status: str | None = None,
+) -> None:
+    """Отправляет одно сводное уведомление о массовом действии вместо сообщения на каждого пользователя."""
+    settings = get_settings()
+
+    if not settings.notifications_chat_id or not users:
+        return
+
+    try:
+        infos = [user.get("response", user) for user in users]
+        title = {"deleted": "🗑 <b>Пользователи удалены</b>"}.get(action, f"<b>{_esc(action)}</b>")
+        lines = [title, "", f"👥 <b>Количество:</b> <code>{len(infos)}</code>"]
+        if status:
+            lines.append(f"📌 <b>Статус:</b> <code>{_esc(status)}</code>")
+
+        message_kwargs = {"chat_id": settings.notifications_chat_id, "parse_mode": "HTML"}
+        if settings.notifications_topic_id is not None:
+            message_kwargs["message_thread_id"] = settings.notifications_topic_id
+
+        if len(infos) <= BULK_NOTIFICATION_LIST_LIMIT:
+            lines.append("")
+            lines.extend(f"• <code>{_esc(info.get('username', 'n/a'))}</code>" for info in infos)
+            from src.services.notification_outbox import Notification, enqueue_notification
+            await enqueue_notification(bot, Notification(
+                chat_id=settings.notifications_chat_id,
+                text="\n".join(lines),
+                thread_id=settings.notifications_topic_id,
+            ))
+        else:
+            # Полный список не помещается в сообщение — прикладываем файлом
+            listing = "\n".join(
+                f"{info.get('username', 'n/a')}\t{info.get('uuid', '')}\t{info.get('telegramId') or ''}"
+                for info in infos
+            )
+            lines.append("📎 Полный список — во вложении")
+            filename = f"{action}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+            await bot.send_document(
+                document=BufferedInputFile(listing.encode("utf-8"), filename=filename),
+                caption="\n".join(lines),
+                **message_kwargs,
+            )
+        logger.info("Bulk user notification sent action=%s count=%d", action, len(infos))
+    except Exception as exc:
+        logger.exception(
+            "Failed to send bulk user notification action=%s count=%d chat_id=%s error=%s",
+            action, len(users), settings.notifications_chat_id, exc,
+        )
+
+
 def _esc(text: str) -> str:
     """Экранирует HTML символы."""
     if not text:
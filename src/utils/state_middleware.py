@@ -0,0 +1,26 @@
+"""Middleware, подгружающий из SQLite состояние пользователя и чата до обработки события."""
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from src.utils.state_store import prefetch_all
+
+
+class StatePrefetchMiddleware(BaseMiddleware):
+    """
+    Подгружает записи src/handlers/state.py для пользователя и чата события
+    (регистрируется как outer middleware — до фильтров и обработчиков),
+    чтобы синхронный доступ к словарям состояния не читал SQLite в event loop.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        ids = {obj.id for obj in (data.get("event_from_user"), data.get("event_chat")) if obj is not None}
+        if ids:
+            await prefetch_all(*ids)
+        return await handler(event, data)
@@ -0,0 +1,335 @@
+"""Состояние диалогов в памяти с ограничением размера, TTL и отложенной записью в SQLite."""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Iterator, Optional
+
+from src.utils.logger import logger
+
+# Сколько записей каждого словаря держать в памяти; остальные читаются из SQLite по запросу
+STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))
+# Срок жизни записи после последнего изменения (часы)
+STATE_TTL_HOURS = float(os.getenv("STATE_TTL_HOURS", "24"))
+# Как часто сбрасывать изменения в SQLite (секунды)
+STATE_FLUSH_SECONDS = float(os.getenv("STATE_FLUSH_SECONDS", "2"))
+
+_MISSING = object()
+_stores: list["PersistentDict"] = []
+
+
+class PersistentDict(MutableMapping):
+    """
+    Словарь, который переживает перезапуск бота.
+
+    Последние max_entries записей хранятся в памяти (LRU), изменения
+    пишутся в таблицу bot_state фоновой задачей (flush_all). При запуске
+    load() загружает сохранённые записи, а prefetch() подгружает остальные
+    до обращения из обработчиков (StatePrefetchMiddleware), чтобы чтение
+    SQLite не блокировало event loop. Синхронное чтение при обращении
+    остаётся запасным путём для скриптов и ключей без prefetch.
+    Запись истекает через ttl секунд после последнего присваивания.
+    Значения должны сериализоваться в JSON; остальные живут только в памяти.
+    Изменения вложенных объектов (ctx["data"][...] = ...) тоже сохраняются.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl: float = STATE_TTL_HOURS * 3600,
+        max_entries: int = STATE_CACHE_SIZE,
+        key_type: Callable[[str], Any] = int,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.key_type = key_type
+        # {ключ: (значение, expires_at)}
+        self._cache: OrderedDict[Any, tuple[Any, float]] = OrderedDict()
+        # Ключи, сохранённые в SQLite (None — ещё не загружены)
+        self._stored: Optional[set] = None
+        # Последнее сохранённое JSON-представление записей из кеша
+        self._snapshots: dict[Any, str] = {}
+        self._assigned: set = set()
+        self._touched: set = set()
+        self._deleted: set = set()
+        # Изменённые записи, вытесненные из кеша до сохранения
+        self._pending: dict[Any, tuple[str, float]] = {}
+        _stores.append(self)
+
+    def _stored_keys(self) -> set:
+        if self._stored is None:
+            from src.database import StateEntry
+
+            try:
+                self._stored = {self.key_type(key) for key in StateEntry.get_keys(self.namespace)}
+            except sqlite3.Error:
+                # Таблицы ещё нет (скрипты, тесты) — работаем только в памяти
+                logger.debug("State store %s works in memory only", self.namespace, exc_info=True)
+                self._stored = set()
+        return self._stored
+
+    def _needs_load(self, key: Any) -> bool:
+        """Запись есть только в SQLite: в памяти её нет и она не менялась."""
+        return (
+            self._stored is not None and key in self._stored
+            and key not in self._cache and key not in self._pending and key not in self._deleted
+        )
+
+    def _remember_loaded(self, key: Any, value_json: str, expires_at: float) -> None:
+        self._snapshots[key] = value_json
+        self._cache[key] = (json.loads(value_json), expires_at)
+
+    async def load(self) -> None:
+        """Загружает из SQLite сохранённые ключи и последние max_entries записей."""
+        from src.database import StateEntry
+
+        try:
+            keys = await StateEntry.aio.get_keys(self.namespace)
+            recent = await StateEntry.aio.get_recent(self.namespace, self.max_entries)
+        except sqlite3.Error:
+            # Таблицы ещё нет (скрипты, тесты) — работаем только в памяти
+            logger.debug("State store %s works in memory only", self.namespace, exc_info=True)
+            if self._stored is None:
+                self._stored = set()
+            return
+        self._stored = {self.key_type(key) for key in keys} | (self._stored or set())
+        # От старых к новым: последние изменённые окажутся в конце LRU
+        for key, value_json, expires_at in reversed(recent):
+            key = self.key_type(key)
+            if self._needs_load(key):
+                self._remember_loaded(key, value_json, expires_at)
+        self._evict()
+
+    async def prefetch(self, *keys: Any) -> None:
+        """Подгружает из SQLite записи keys, которых нет в памяти, перед синхронным доступом."""
+        if self._stored is None:
+            await self.load()
+        missing = [key for key in keys if self._needs_load(key)]
+        if not missing:
+            return
+        from src.database import StateEntry
+
+        try:
+            rows = await StateEntry.aio.get_many(self.namespace, [str(key) for key in missing])
+        except sqlite3.Error:
+            logger.exception("Failed to load state %s", self.namespace)
+            return
+        for key in missing:
+            # Пока ждали SQLite, запись могли изменить
+            if not self._needs_load(key):
+                continue
+            row = rows.get(str(key))
+            if row is None:
+                self._stored.discard(key)
+            else:
+                self._remember_loaded(key, *row)
+        self._evict()
+
+    def _load(self, key: Any) -> Optional[tuple[Any, float]]:
+        """Подгружает запись, вытесненную из памяти или сохранённую до перезапуска."""
+        if key in self._pending:
+            value_json, expires_at = self._pending.pop(key)
+            self._assigned.add(key)
+        else:
+            if key in self._deleted or key not in self._stored_keys():
+                return None
+            from src.database import StateEntry
+
+            # Запасной путь: ключ не был подгружен load()/prefetch()
+            row = StateEntry.get(self.namespace, str(key))
+            if row is None:
+                self._stored.discard(key)
+                return None
+            self._remember_loaded(key, *row)
+            self._evict()
+            return self._cache.get(key)
+        entry = (json.loads(value_json), expires_at)
+        self._cache[key] = entry
+        self._evict()
+        return entry
+
+    def _lookup(self, key: Any) -> Any:
+        entry = self._cache.get(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is None:
+                return _MISSING
+        if entry[1] <= time.time():
+            self._discard(key)
+            return _MISSING
+        self._cache.move_to_end(key)
+        self._touched.add(key)
+        return entry[0]
+
+    def _discard(self, key: Any) -> None:
+        self._cache.pop(key, None)
+        self._snapshots.pop(key, None)
+        self._pending.pop(key, None)
+        self._assigned.discard(key)
+        self._touched.discard(key)
+        if key in self._stored_keys():
+            self._deleted.add(key)
+
+    def _evict(self) -> None:
+        while len(self._cache) > self.max_entries:
+            key, (value, expires_at) = self._cache.popitem(last=False)
+            if key in self._assigned or key in self._touched:
+                row = self._serialize(key, value, expires_at, force=key in self._assigned)
+                if row is not None:
+                    self._pending[key] = (row[2], row[3])
+            self._snapshots.pop(key, None)
+            self._assigned.discard(key)
+            self._touched.discard(key)
+
+    def _serialize(self, key: Any, value: Any, expires_at: float, force: bool) -> Optional[tuple]:
+        """Строка для bot_state, если запись изменилась с последнего сохранения."""
+        try:
+            value_json = json.dumps(value, ensure_ascii=False)
+        except (TypeError, ValueError):
+            logger.debug("State %s[%s] is not JSON-serializable, kept in memory only", self.namespace, key)
+            return None
+        if not force and self._snapshots.get(key) == value_json:
+            return None
+        return (self.namespace, str(key), value_json, expires_at)
+
+    # --- MutableMapping ---
+    def __getitem__(self, key: Any) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._cache[key] = (value, time.time() + self.ttl)
+        self._cache.move_to_end(key)
+        self._pending.pop(key, None)
+        self._deleted.discard(key)
+        self._assigned.add(key)
+        self._evict()
+
+    def __delitem__(self, key: Any) -> None:
+        if self._lookup(key) is _MISSING:
+            raise KeyError(key)
+        self._discard(key)
+
+    def __contains__(self, key: object) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def pop(self, key: Any, default: Any = _MISSING) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        self._discard(key)
+        return value
+
+    def __iter__(self) -> Iterator[Any]:
+        """Ключи записей, находящихся в памяти."""
+        return iter(list(self._cache))
+
+    def __len__(self) -> int:
+        """Количество записей в памяти."""
+        return len(self._cache)
+
+    async def flush(self) -> None:
+        """Сохраняет изменения с прошлого вызова в SQLite."""
+        from src.database import StateEntry
+
+        rows = []
+        for key in self._assigned | self._touched:
+            entry = self._cache.get(key)
+            if entry is None:
+                continue
+            row = self._serialize(key, entry[0], entry[1], force=key in self._assigned)
+            if row is not None:
+                rows.append(row)
+                self._snapshots[key] = row[2]
+        rows.extend((self.namespace, str(key), value_json, expires_at)
+                    for key, (value_json, expires_at) in self._pending.items())
+        deleted = [str(key) for key in self._deleted]
+        if not rows and not deleted:
+            self._assigned.clear()
+            self._touched.clear()
+            return
+
+        written = {self.key_type(row[1]) for row in rows}
+        pending = dict(self._pending)
+        removed = set(self._deleted)
+        self._assigned.clear()
+        self._touched.clear()
+        self._pending.clear()
+        self._deleted.clear()
+        # Заранее: удаление ключа во время записи тоже должно дойти до SQLite
+        self._stored_keys().update(written)
+        self._stored.difference_update(removed)
+        try:
+            await StateEntry.aio.save_many(rows)
+            await StateEntry.aio.delete_many(self.namespace, deleted)
+        except sqlite3.Error:
+            logger.exception("Failed to persist state %s", self.namespace)
+            # Повторим при следующем сохранении то, что не изменили заново
+            for key in written:
+                self._snapshots.pop(key, None)
+                if key in self._cache:
+                    self._assigned.add(key)
+            for key, row in pending.items():
+                if key not in self._cache and key not in self._deleted:
+                    self._pending.setdefault(key, row)
+            self._deleted.update(key for key in removed if key not in self._cache)
+
+
+async def load_all() -> None:
+    """Загружает сохранённое состояние всех хранилищ (при запуске бота)."""
+    for store in _stores:
+        try:
+            await store.load()
+        except Exception:
+            logger.exception("Failed to load state store %s", store.namespace)
+
+
+async def prefetch_all(*keys: int) -> None:
+    """Подгружает записи с ключами keys (ID пользователя, чата) во всех хранилищах с числовыми ключами."""
+    for store in _stores:
+        if store.key_type is int:
+            await store.prefetch(*keys)
+
+
+async def flush_all() -> None:
+    """Сохраняет изменения всех хранилищ состояния."""
+    for store in _stores:
+        try:
+            await store.flush()
+        except Exception:
+            logger.exception("Failed to flush state store %s", store.namespace)
+
+
+async def start_state_flusher(interval_seconds: float = STATE_FLUSH_SECONDS, purge_minutes: int = 30) -> None:
+    """Фоновая задача: периодически сохраняет состояние и удаляет истёкшие записи."""
+    from src.database import StateEntry
+
+    logger.info("Starting state flusher (interval: %.1f seconds)", interval_seconds)
+    last_purge = time.monotonic()
+    try:
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await flush_all()
+            if time.monotonic() - last_purge >= purge_minutes * 60:
+                last_purge = time.monotonic()
+                try:
+                    purged = await StateEntry.aio.purge_expired()
+                    if purged:
+                        logger.info("Purged %d expired state entries", purged)
+                except sqlite3.Error:
+                    logger.exception("Failed to purge expired state entries")
+    finally:
+        # Последние изменения перед остановкой бота
+        await flush_all()
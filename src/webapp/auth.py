@@ -4,12 +4,22 @@
 import hashlib
 import hmac
 import json
+import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from urllib.parse import unquote
 from typing import Optional
 from dataclasses import dataclass
 
+# Сколько секунд initData считается действительным после auth_date (0 — без ограничения)
+INIT_DATA_MAX_AGE = int(os.getenv('WEBAPP_INIT_DATA_MAX_AGE', '86400'))
+# Кеш проверенных initData: записей и срок жизни записи (секунды)
+INIT_DATA_CACHE_SIZE = int(os.getenv('WEBAPP_INIT_DATA_CACHE_SIZE', '4096'))
+INIT_DATA_CACHE_TTL = 300
 
-@dataclass
+
+@dataclass(frozen=True)
 class TelegramUser:
     """Данные пользователя из Telegram initData."""
     id: int
@@ -20,6 +30,116 @@ class TelegramUser:
     is_premium: bool = False
 
 
+class InitDataValidator:
+    """
+    Проверка initData для одного бота.
+
+    Секретный ключ вычисляется один раз, а успешно проверенные строки
+    initData запоминаются (LRU с TTL по SHA-256 строки), поэтому повторные
+    запросы Mini App с тем же initData не разбираются и не подписываются заново.
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        max_age: int = INIT_DATA_MAX_AGE,
+        cache_size: int = INIT_DATA_CACHE_SIZE,
+        cache_ttl: float = INIT_DATA_CACHE_TTL,
+    ) -> None:
+        self._secret_key = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # {sha256(initData): (пользователь, auth_date, до какого времени действует запись)}
+        self._cache: OrderedDict[bytes, tuple[TelegramUser, int, float]] = OrderedDict()
+
+    def _is_fresh(self, auth_date: int, now: float) -> bool:
+        return not self.max_age or now - auth_date <= self.max_age
+
+    def validate(self, init_data: str) -> Optional[TelegramUser]:
+        """TelegramUser, если initData подписан ботом и не устарел, иначе None."""
+        if not init_data:
+            return None
+
+        now = time.time()
+        key = hashlib.sha256(init_data.encode()).digest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            user, auth_date, expires_at = cached
+            if expires_at > now and self._is_fresh(auth_date, now):
+                self._cache.move_to_end(key)
+                return user
+            del self._cache[key]
+
+        result = self._check(init_data)
+        if result is None:
+            return None
+        user, auth_date = result
+        if not self._is_fresh(auth_date, now):
+            return None
+
+        if self.cache_size > 0:
+            self._cache[key] = (user, auth_date, now + self.cache_ttl)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def _check(self, init_data: str) -> Optional[tuple[TelegramUser, int]]:
+        """Полная проверка подписи и разбор пользователя."""
+        try:
+            # Парсим данные
+            parsed = {}
+            for pair in init_data.split('&'):
+                if '=' in pair:
+                    key, value = pair.split('=', 1)
+                    parsed[key] = unquote(value)
+
+            # Получаем hash для проверки
+            check_hash = parsed.pop('hash', None)
+            if not check_hash:
+                return None
+
+            # Формируем строку для проверки
+            data_check_string = '\n'.join(
+                f'{k}={v}' for k, v in sorted(parsed.items())
+            )
+
+            # Вычисляем hash
+            computed_hash = hmac.new(
+                self._secret_key,
+                data_check_string.encode(),
+                hashlib.sha256
+            ).hexdigest()
+
+            # Сравниваем
+            if not hmac.compare_digest(computed_hash, check_hash):
+                return None
+
+            # Парсим данные пользователя
+            user_data = json.loads(parsed.get('user', '{}'))
+            if not user_data.get('id'):
+                return None
+
+            user = TelegramUser(
+                id=user_data['id'],
+                first_name=user_data.get('first_name', ''),
+                last_name=user_data.get('last_name'),
+                username=user_data.get('username'),
+                language_code=user_data.get('language_code'),
+                is_premium=user_data.get('is_premium', False),
+            )
+            return user, int(parsed.get('auth_date', 0))
+
+        except Exception:
+            return None
+
+
+@lru_cache(maxsize=4)
+def get_validator(bot_token: str) -> InitDataValidator:
+    """Валидатор initData для токена бота (один на процесс)."""
+    return InitDataValidator(bot_token)
+
+
 def validate_init_data(init_data: str, bot_token: str) -> Optional[TelegramUser]:
     """
     Проверяет подлинность initData от Telegram Mini App.
@@ -31,59 +151,4 @@ def validate_init_data(init_data: str, bot_token: str) -> Optional[TelegramUser]
     Returns:
         TelegramUser если данные валидны, None если нет
     """
-    if not init_data:
-        return None
-
-    try:
-        # Парсим данные
-        parsed = {}
-        for pair in init_data.split('&'):
-            if '=' in pair:
-                key, value = pair.split('=', 1)
-                parsed[key] = unquote(value)
-
-        # Получаем hash для проверки
-        check_hash = parsed.pop('hash', None)
-        if not check_hash:
-            return None
-
-        # Формируем строку для проверки
-        data_check_string = '\n'.join(
-            f'{k}={v}' for k, v in sorted(parsed.items())
-        )
-
-        # Вычисляем секретный ключ
-        secret_key = hmac.new(
-            b'WebAppData',
-            bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-
-        # Вычисляем hash
-        computed_hash = hmac.new(
-            secret_key,
-            data_check_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
-
-        # Сравниваем
-        if computed_hash != check_hash:
-            return None
-
-        # Парсим данные пользователя
-        user_data = json.loads(parsed.get('user', '{}'))
-        if not user_data.get('id'):
-            return None
-
-        return TelegramUser(
-            id=user_data['id'],
-            first_name=user_data.get('first_name', ''),
-            last_name=user_data.get('last_name'),
-            username=user_data.get('username'),
-            language_code=user_data.get('language_code'),
-            is_premium=user_data.get('is_premium', False),
-        )
-
-    except Exception:
-        return None
-
+    return get_validator(bot_token).validate(init_data)
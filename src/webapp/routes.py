@@ -1,15 +1,21 @@
 """
 API маршруты для Mini App.
 """
+import asyncio
+import hashlib
+import json
+import time
 from aiohttp import web
 from datetime import datetime, timedelta
 from typing import Optional
 
-from .auth import validate_init_data, TelegramUser
+from .auth import get_validator, TelegramUser
 from src.config import get_settings
 from src.database import BotUser, Loyalty, Payment, GiftCode
 from src.services.api_client import api_client, NotFoundError, ApiClientError
+from src.services.bootstrap_cache import get_cached_bootstrap, invalidate_user_cache, store_bootstrap
 from src.services.loyalty_service import get_price_with_discount
+from src.services.payment_status_hub import STATUS_PENDING, payment_status_hub
 from src.utils.logger import logger
 from src.utils.datetime_utils import to_utc_iso
 
@@ -25,14 +31,17 @@ LOYALTY_DISCOUNT_PERCENT = {
     'platinum': 15
 }
 
-routes = web.RouteTableDef()
+# Статус платежа: максимальное ожидание long-poll, интервал пинга и длительность потока SSE (секунды)
+PAYMENT_STATUS_MAX_WAIT = 30
+PAYMENT_EVENTS_PING_SECONDS = 15
+PAYMENT_EVENTS_MAX_SECONDS = 600
 
+routes = web.RouteTableDef()
 
 def get_user_from_request(request: web.Request) -> Optional[TelegramUser]:
     """Извлекает и валидирует пользователя из запроса."""
     init_data = request.headers.get('X-Telegram-Init-Data', '')
-    bot_token = request.app.get('bot_token', '')
-    return validate_init_data(init_data, bot_token)
+    return request.app['init_data_validator'].validate(init_data)
 
 
 def require_auth(handler):
@@ -48,84 +57,203 @@ def require_auth(handler):
 
 # ==================== User API ====================
 
+async def _load_user_data(user: TelegramUser) -> dict:
+    """Данные пользователя из БД одним чтением (пользователь создаётся при первом входе)."""
+    data = await BotUser.aio.get_mini_app_data(user.id)
+    if data is None:
+        await BotUser.aio.get_or_create(user.id, user.username)
+        data = await BotUser.aio.get_mini_app_data(user.id)
+    return data
+
+
+def _subscription_status(info: dict) -> str:
+    """Статус подписки по дате окончания."""
+    status = 'none'
+    expire_at = info.get('expireAt')
+    if expire_at:
+        try:
+            expire_dt = datetime.fromisoformat(expire_at.replace('Z', '+00:00'))
+            if expire_dt.replace(tzinfo=None) > datetime.now():
+                status = 'active'
+            else:
+                status = 'expired'
+        except Exception:
+            status = info.get('status', 'none')
+    return status
+
+
+async def _fetch_subscription_url(short_uuid: str) -> str:
+    try:
+        sub_info = await api_client.get_subscription_info(short_uuid)
+        return sub_info.get('response', {}).get('subscriptionUrl', '')
+    except Exception:
+        return ''
+
+
+async def _fetch_subscription(telegram_id: int, data: dict) -> Optional[dict]:
+    """Подписка пользователя из Remnawave (None, если её нет или панель недоступна)."""
+    remnawave_uuid = data['user'].get('remnawave_user_uuid')
+    if not remnawave_uuid:
+        return None
+
+    # shortUuid известен из индекса пользователей панели — ссылку запрашиваем параллельно
+    short_uuid = data.get('short_uuid')
+    url_task = asyncio.create_task(_fetch_subscription_url(short_uuid)) if short_uuid else None
+    try:
+        user_remnawave = await api_client.get_user_by_uuid(remnawave_uuid)
+        info = user_remnawave.get('response', user_remnawave)
+
+        actual_short_uuid = info.get('shortUuid')
+        if url_task is not None and actual_short_uuid == short_uuid:
+            subscription_url = await url_task
+        else:
+            subscription_url = await _fetch_subscription_url(actual_short_uuid) if actual_short_uuid else ''
+
+        return {
+            'status': _subscription_status(info),
+            'expireAt': info.get('expireAt'),
+            'trafficUsed': info.get('userTraffic', {}).get('usedTrafficBytes', 0),
+            'trafficLimit': info.get('trafficLimitBytes', 0),
+            'subscriptionUrl': subscription_url,
+            'autoRenewal': bool(data['user'].get('auto_renewal')),
+        }
+    except NotFoundError:
+        logger.warning(f"Remnawave user {remnawave_uuid} not found")
+        await BotUser.aio.set_remnawave_uuid(telegram_id, None)
+    except ApiClientError as e:
+        logger.error(f"Error fetching Remnawave user: {e}")
+    finally:
+        if url_task is not None and not url_task.done():
+            url_task.cancel()
+    return None
+
+
+def _format_profile(user: TelegramUser, data: dict, subscription: Optional[dict]) -> dict:
+    settings = get_settings()
+    bot_user = data['user']
+    loyalty_status = bot_user.get('loyalty_status') or 'bronze'
+    return {
+        'telegramId': user.id,
+        'username': user.username,
+        'loyalty': {
+            'points': bot_user.get('loyalty_points') or 0,
+            'status': loyalty_status,
+            'discount': LOYALTY_DISCOUNT_PERCENT.get(loyalty_status, 0),
+            'totalSpent': bot_user.get('total_spent') or 0,
+        },
+        'subscription': subscription,
+        'referralLink': f"https://t.me/{settings.bot_username}?start={user.id}",
+        'totalGiftsPurchased': len(data['purchased_gifts']),
+        'totalGiftsReceived': len(data['received_gifts']),
+    }
+
+
+def _format_payments(payments: list) -> list:
+    formatted = []
+    for p in payments:
+        payment_method = p.get('payment_method', 'unknown')
+        is_stars = payment_method == 'stars'
+        
+        # Определяем статус
+        status = p.get('status', 'unknown')
+        if status == 'succeeded':
+            status = 'completed'
+        elif status in ('pending', 'processing', 'waiting_for_capture'):
+            status = 'pending'
+        elif status in ['canceled', 'failed', 'expired']:
+            status = 'failed'
+        
+        # Определяем тип платежа (подарок или подписка)
+        payload = str(p.get('invoice_payload', ''))
+        is_gift = payload.startswith('gift:') or payload.startswith('yookassa_gift:')
+        
+        formatted.append({
+            'id': str(p.get('id')),
+            'date': p.get('created_at', '')[:10] if p.get('created_at') else '',
+            'amount': p.get('stars', 0) if is_stars else p.get('amount_rub', 0),
+            'currency': '⭐' if is_stars else '₽',
+            'type': 'gift' if is_gift else 'subscription',
+            'periodDays': p.get('subscription_days', 0),
+            'method': payment_method,
+            'status': status,
+        })
+    return formatted
+
+
+def _format_gifts(purchased: list, received: list) -> tuple[list, list]:
+    purchased_formatted = []
+    for g in purchased:
+        purchased_formatted.append({
+            'id': str(g.get('id')),
+            'code': g.get('code', ''),
+            'status': g.get('status', 'unknown'),
+            'periodDays': g.get('subscription_days', 0),
+            'createdAt': g.get('created_at', '')[:10] if g.get('created_at') else '',
+            'activatedAt': g.get('activated_at', '')[:10] if g.get('activated_at') else None,
+        })
+    
+    received_formatted = []
+    for g in received:
+        received_formatted.append({
+            'id': str(g.get('id')),
+            'code': g.get('code', ''),
+            'periodDays': g.get('subscription_days', 0),
+            'activatedAt': g.get('activated_at', '')[:10] if g.get('activated_at') else '',
+        })
+    return purchased_formatted, received_formatted
+
+
+@routes.get('/api/bootstrap')
+@require_auth
+async def get_bootstrap(request: web.Request) -> web.Response:
+    """
+    Профиль, платежи и подарки одним запросом (открытие Mini App).
+
+    Ответ кешируется на BOOTSTRAP_CACHE_SECONDS и отдаётся с ETag:
+    при совпадении If-None-Match возвращается 304 без тела.
+    """
+    user: TelegramUser = request['tg_user']
+    cached = get_cached_bootstrap(user.id)
+    
+    if cached is None:
+        try:
+            data = await _load_user_data(user)
+            subscription = await _fetch_subscription(user.id, data)
+        except Exception:
+            logger.exception("Error getting Mini App bootstrap")
+            return web.json_response({'success': False, 'error': 'Internal error'}, status=500)
+        
+        purchased, received = _format_gifts(data['purchased_gifts'], data['received_gifts'])
+        body = json.dumps({
+            'success': True,
+            'user': _format_profile(user, data, subscription),
+            'payments': _format_payments(data['payments']),
+            'purchasedGifts': purchased,
+            'receivedGifts': received,
+        }, ensure_ascii=False).encode()
+        cached = (f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+        store_bootstrap(user.id, *cached)
+    
+    etag, body = cached
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in (tag.strip() for tag in if_none_match.split(',')):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type='application/json', headers=headers)
+
+
 @routes.get('/api/profile')
 @require_auth
 async def get_user_profile(request: web.Request) -> web.Response:
     """Получает профиль пользователя."""
     user: TelegramUser = request['tg_user']
-    settings = get_settings()
     
     try:
-        bot_user = BotUser.get_or_create(user.id, user.username)
-        loyalty_data = Loyalty.get_user_loyalty(user.id)
-        remnawave_uuid = bot_user.get('remnawave_user_uuid')
-        
-        subscription = None
-        if remnawave_uuid:
-            try:
-                user_remnawave = await api_client.get_user_by_uuid(remnawave_uuid)
-                info = user_remnawave.get('response', user_remnawave)
-                
-                subscription_url = ''
-                short_uuid = info.get('shortUuid')
-                if short_uuid:
-                    try:
-                        sub_info = await api_client.get_subscription_info(short_uuid)
-                        subscription_url = sub_info.get('response', {}).get('subscriptionUrl', '')
-                    except Exception:
-                        pass
-                
-                # Определяем статус подписки
-                status = 'none'
-                expire_at = info.get('expireAt')
-                if expire_at:
-                    try:
-                        expire_dt = datetime.fromisoformat(expire_at.replace('Z', '+00:00'))
-                        if expire_dt.replace(tzinfo=None) > datetime.now():
-                            status = 'active'
-                        else:
-                            status = 'expired'
-                    except Exception:
-                        status = info.get('status', 'none')
-                
-                subscription = {
-                    'status': status,
-                    'expireAt': expire_at,
-                    'trafficUsed': info.get('userTraffic', {}).get('usedTrafficBytes', 0),
-                    'trafficLimit': info.get('trafficLimitBytes', 0),
-                    'subscriptionUrl': subscription_url,
-                    'autoRenewal': BotUser.get_auto_renewal(user.id),
-                }
-            except NotFoundError:
-                logger.warning(f"Remnawave user {remnawave_uuid} not found")
-                BotUser.set_remnawave_uuid(user.id, None)
-            except ApiClientError as e:
-                logger.error(f"Error fetching Remnawave user: {e}")
-        
-        purchased_gifts = GiftCode.get_user_gifts(user.id)
-        received_gifts = GiftCode.get_received_gifts(user.id) if hasattr(GiftCode, 'get_received_gifts') else []
-        
-        # Получаем данные лояльности
-        points = loyalty_data.get('points', 0)
-        loyalty_status = loyalty_data.get('status', 'bronze')
-        discount = LOYALTY_DISCOUNT_PERCENT.get(loyalty_status, 0)
-        
+        data = await _load_user_data(user)
+        subscription = await _fetch_subscription(user.id, data)
         return web.json_response({
             'success': True,
-            'user': {
-                'telegramId': user.id,
-                'username': user.username,
-                'loyalty': {
-                    'points': points,
-                    'status': loyalty_status,
-                    'discount': discount,
-                    'totalSpent': loyalty_data.get('total_spent', 0),
-                },
-                'subscription': subscription,
-                'referralLink': f"https://t.me/{settings.bot_username}?start={user.id}",
-                'totalGiftsPurchased': len(purchased_gifts),
-                'totalGiftsReceived': len(received_gifts),
-            }
+            'user': _format_profile(user, data, subscription),
         })
     except Exception as e:
         logger.exception("Error getting user profile")
@@ -139,38 +267,8 @@ async def get_user_payments(request: web.Request) -> web.Response:
     user: TelegramUser = request['tg_user']
     
     try:
-        payments = Payment.get_user_payments(user.id)
-        formatted = []
-        
-        for p in payments:
-            payment_method = p.get('payment_method', 'unknown')
-            is_stars = payment_method == 'stars'
-            
-            # Определяем статус
-            status = p.get('status', 'unknown')
-            if status == 'succeeded':
-                status = 'completed'
-            elif status == 'pending' or status == 'waiting_for_capture':
-                status = 'pending'
-            elif status in ['canceled', 'failed', 'expired']:
-                status = 'failed'
-            
-            # Определяем тип платежа (подарок или подписка)
-            payload = str(p.get('invoice_payload', ''))
-            is_gift = payload.startswith('gift:') or payload.startswith('yookassa_gift:')
-            
-            formatted.append({
-                'id': str(p.get('id')),
-                'date': p.get('created_at', '')[:10] if p.get('created_at') else '',
-                'amount': p.get('stars', 0) if is_stars else p.get('amount_rub', 0),
-                'currency': '⭐' if is_stars else '₽',
-                'type': 'gift' if is_gift else 'subscription',
-                'periodDays': p.get('subscription_days', 0),
-                'method': payment_method,
-                'status': status,
-            })
-        
-        return web.json_response({'success': True, 'payments': formatted})
+        payments = await Payment.aio.get_user_payments(user.id)
+        return web.json_response({'success': True, 'payments': _format_payments(payments)})
     except Exception as e:
         logger.exception("Error getting payments")
         return web.json_response({'success': False, 'error': 'Internal error'}, status=500)
@@ -183,29 +281,9 @@ async def get_user_gifts(request: web.Request) -> web.Response:
     user: TelegramUser = request['tg_user']
     
     try:
-        purchased = GiftCode.get_user_gifts(user.id)
-        received = GiftCode.get_received_gifts(user.id) if hasattr(GiftCode, 'get_received_gifts') else []
-        
-        purchased_formatted = []
-        for g in purchased:
-            purchased_formatted.append({
-                'id': str(g.get('id')),
-                'code': g.get('code', ''),
-                'status': g.get('status', 'unknown'),
-                'periodDays': g.get('subscription_days', 0),
-                'createdAt': g.get('created_at', '')[:10] if g.get('created_at') else '',
-                'activatedAt': g.get('activated_at', '')[:10] if g.get('activated_at') else None,
-            })
-        
-        received_formatted = []
-        for g in received:
-            received_formatted.append({
-                'id': str(g.get('id')),
-                'code': g.get('code', ''),
-                'periodDays': g.get('subscription_days', 0),
-                'activatedAt': g.get('activated_at', '')[:10] if g.get('activated_at') else '',
-            })
-        
+        purchased = await GiftCode.aio.get_user_gifts(user.id)
+        received = await GiftCode.aio.get_received_gifts(user.id)
+        purchased_formatted, received_formatted = _format_gifts(purchased, received)
         return web.json_response({
             'success': True,
             'purchasedGifts': purchased_formatted,
@@ -235,7 +313,7 @@ async def activate_gift(request: web.Request) -> web.Response:
         return web.json_response({'success': False, 'error': 'Введите код подарка'}, status=400)
     
     try:
-        gift = GiftCode.get_by_code(code)
+        gift = await GiftCode.aio.get_by_code(code)
         if not gift:
             return web.json_response({'success': False, 'error': 'Код не найден'}, status=404)
         if gift.get('status') != 'active':
@@ -243,7 +321,7 @@ async def activate_gift(request: web.Request) -> web.Response:
         if gift.get('buyer_id') == user.id:
             return web.json_response({'success': False, 'error': 'Нельзя активировать свой код'}, status=400)
         
-        bot_user = BotUser.get_or_create(user.id, user.username)
+        bot_user = await BotUser.aio.get_or_create(user.id, user.username)
         existing_uuid = bot_user.get('remnawave_user_uuid')
         subscription_days = gift.get('subscription_days', 30)
         
@@ -264,7 +342,9 @@ async def activate_gift(request: web.Request) -> web.Response:
             
             expire_str = to_utc_iso(new_expire)
             await api_client.update_user(existing_uuid, expireAt=expire_str)
-            GiftCode.activate(code, user.id, existing_uuid)
+            await GiftCode.aio.activate(code, user.id, existing_uuid)
+            invalidate_user_cache(user.id)
+            invalidate_user_cache(gift.get('buyer_id'))
             
             return web.json_response({
                 'success': True,
@@ -288,8 +368,10 @@ async def activate_gift(request: web.Request) -> web.Response:
             result_data = result.get('response', result) if result else {}
             if result_data and result_data.get('uuid'):
                 new_uuid = result_data['uuid']
-                BotUser.set_remnawave_uuid(user.id, new_uuid)
-                GiftCode.activate(code, user.id, new_uuid)
+                await BotUser.aio.set_remnawave_uuid(user.id, new_uuid)
+                await GiftCode.aio.activate(code, user.id, new_uuid)
+                invalidate_user_cache(user.id)
+                invalidate_user_cache(gift.get('buyer_id'))
                 
                 expire_formatted = (datetime.now() + timedelta(days=subscription_days)).strftime('%d.%m.%Y')
                 return web.json_response({
@@ -385,89 +467,86 @@ async def create_payment(request: web.Request) -> web.Response:
         return web.json_response({'success': False, 'error': 'Внутренняя ошибка'}, status=500)
 
 
-@routes.get('/api/payments/{payment_id}/status')
-@require_auth
-async def check_payment_status(request: web.Request) -> web.Response:
-    """Проверяет статус платежа YooKassa."""
+async def _get_yookassa_payment(request: web.Request) -> tuple[Optional[dict], Optional[web.Response]]:
+    """Платёж YooKassa текущего пользователя из URL (или ответ с ошибкой)."""
     user: TelegramUser = request['tg_user']
-    
     try:
         payment_id = int(request.match_info['payment_id'])
     except ValueError:
-        return web.json_response({'success': False, 'error': 'Неверный ID платежа'}, status=400)
+        return None, web.json_response({'success': False, 'error': 'Неверный ID платежа'}, status=400)
     
+    payment = await Payment.aio.get(payment_id)
+    if not payment:
+        return None, web.json_response({'success': False, 'error': 'Платёж не найден'}, status=404)
+    if payment.get('user_id') != user.id:
+        return None, web.json_response({'success': False, 'error': 'Нет доступа'}, status=403)
+    if payment.get('status') != 'completed' and not payment.get('yookassa_payment_id'):
+        return None, web.json_response({'success': False, 'error': 'Не YooKassa платёж'}, status=400)
+    return payment, None
+
+
+@routes.get('/api/payments/{payment_id}/status')
+@require_auth
+async def check_payment_status(request: web.Request) -> web.Response:
+    """
+    Проверяет статус платежа YooKassa.
+    
+    Статус берётся из payment_status_hub, YooKassa опрашивается в фоне.
+    С параметром wait (секунды) работает как long-poll: ответ приходит, когда
+    статус отличается от known (по умолчанию pending), или по истечении wait.
+    """
     try:
-        payment = Payment.get(payment_id)
-        if not payment:
-            return web.json_response({'success': False, 'error': 'Платёж не найден'}, status=404)
-        if payment.get('user_id') != user.id:
-            return web.json_response({'success': False, 'error': 'Нет доступа'}, status=403)
-        
-        if payment.get('status') == 'completed':
-            return web.json_response({
-                'success': True,
-                'status': 'completed',
-            })
-        
-        yookassa_payment_id = payment.get('yookassa_payment_id')
-        if not yookassa_payment_id:
-            return web.json_response({'success': False, 'error': 'Не YooKassa платёж'}, status=400)
+        payment, error = await _get_yookassa_payment(request)
+        if error:
+            return error
         
-        from src.services.yookassa_service import check_yookassa_payment_status
-        
-        yookassa_status = await check_yookassa_payment_status(yookassa_payment_id)
-        status = yookassa_status.get('status')
-        
-        if status == 'succeeded' and yookassa_status.get('paid'):
-            # Обрабатываем успешный платёж
-            invoice_payload = payment.get('invoice_payload', '')
-            
-            if invoice_payload.startswith('gift:'):
-                from src.services.yookassa_service import process_yookassa_gift_payment
-                bot = request.app.get('bot')
-                result = await process_yookassa_gift_payment(yookassa_payment_id, bot)
-                
-                if result.get('success'):
-                    return web.json_response({
-                        'success': True,
-                        'status': 'completed',
-                    })
-                else:
-                    return web.json_response({
-                        'success': False,
-                        'status': 'failed',
-                    }, status=500)
-            else:
-                from src.services.yookassa_service import process_yookassa_payment
-                bot = request.app.get('bot')
-                result = await process_yookassa_payment(yookassa_payment_id, bot)
-                
-                if result.get('success'):
-                    return web.json_response({
-                        'success': True,
-                        'status': 'completed',
-                    })
-                else:
-                    return web.json_response({
-                        'success': False,
-                        'status': 'failed',
-                    }, status=500)
-        elif status == 'canceled':
-            return web.json_response({
-                'success': True,
-                'status': 'failed',
-            })
-        else:
-            return web.json_response({
-                'success': True,
-                'status': 'pending',
-            })
+        try:
+            wait = min(float(request.query.get('wait', 0)), PAYMENT_STATUS_MAX_WAIT)
+        except ValueError:
+            wait = 0
+        known = request.query.get('known', STATUS_PENDING)
+        status = await payment_status_hub.wait(payment, known, timeout=wait)
+        return web.json_response({'success': True, 'status': status})
             
     except Exception as e:
         logger.exception("Error checking payment status")
         return web.json_response({'success': False, 'error': 'Внутренняя ошибка'}, status=500)
 
 
+@routes.get('/api/payments/{payment_id}/events')
+@require_auth
+async def payment_status_events(request: web.Request) -> web.StreamResponse:
+    """Статус платежа YooKassa потоком Server-Sent Events: текущий сразу, затем каждое изменение."""
+    payment, error = await _get_yookassa_payment(request)
+    if error:
+        return error
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+    
+    status = None
+    deadline = time.monotonic() + PAYMENT_EVENTS_MAX_SECONDS
+    try:
+        while time.monotonic() < deadline:
+            new_status = await payment_status_hub.wait(payment, status, timeout=PAYMENT_EVENTS_PING_SECONDS)
+            if new_status == status:
+                # Комментарий SSE держит соединение через прокси
+                await response.write(b': ping\n\n')
+                continue
+            status = new_status
+            await response.write(f'event: status\ndata: {json.dumps({"status": status})}\n\n'.encode())
+            if status != STATUS_PENDING:
+                break
+    except ConnectionResetError:
+        # Клиент закрыл Mini App
+        pass
+    return response
+
+
 # ==================== Webhook API ====================
 
 @routes.get('/webhook/yookassa')
@@ -496,7 +575,7 @@ async def yookassa_webhook(request: web.Request) -> web.Response:
             return web.json_response({'error': 'Missing payment ID'}, status=400)
         
         # Получаем платёж из БД
-        payment = Payment.get_by_yookassa_id(payment_id)
+        payment = await Payment.aio.get_by_yookassa_id(payment_id)
         if not payment:
             logger.error(f"YooKassa webhook: payment not found {payment_id}")
             return web.json_response({'error': 'Payment not found'}, status=404)
@@ -505,6 +584,9 @@ async def yookassa_webhook(request: web.Request) -> web.Response:
         if payment.get('status') == 'completed':
             logger.info(f"YooKassa webhook: payment {payment_id} already completed")
             return web.json_response({'status': 'ok'})
+        if payment.get('status') == 'processing':
+            logger.info(f"YooKassa webhook: payment {payment_id} is already being processed")
+            return web.json_response({'status': 'ok'})
         
         # Обрабатываем платёж
         bot = request.app.get('bot')
@@ -519,6 +601,11 @@ async def yookassa_webhook(request: web.Request) -> web.Response:
             from src.services.yookassa_service import process_yookassa_payment
             result = await process_yookassa_payment(payment_id, bot)
         
+        await payment_status_hub.refresh(payment['id'])
+        
+        if result.get('in_progress'):
+            logger.info(f"YooKassa webhook: payment {payment_id} is already being processed")
+            return web.json_response({'status': 'ok'})
         if result.get('success'):
             logger.info(f"YooKassa webhook: payment {payment_id} processed successfully")
             return web.json_response({'status': 'ok'})
@@ -543,6 +630,7 @@ def setup_routes(app: web.Application, bot_token: str, bot_instance=None):
         bot_instance: Экземпляр aiogram Bot
     """
     app['bot_token'] = bot_token
+    app['init_data_validator'] = get_validator(bot_token)
     if bot_instance:
         app['bot'] = bot_instance
     app.add_routes(routes)
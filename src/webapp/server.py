@@ -2,11 +2,65 @@
 HTTP сервер для Mini App API.
 """
 import asyncio
+import hmac
+import ipaddress
+import os
+import time
 from aiohttp import web
 from typing import Optional
 
 from .routes import setup_routes
 from src.utils.logger import logger
+from src.utils.metrics import WEBAPP_DURATION, registry
+
+
+@web.middleware
+async def metrics_middleware(request: web.Request, handler) -> web.StreamResponse:
+    """Записывает длительность запросов к Mini App API по шаблону маршрута."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as exc:
+        status = exc.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        WEBAPP_DURATION.observe(
+            time.perf_counter() - started,
+            route=resource.canonical if resource is not None else "unmatched",
+            method=request.method,
+            status=str(status),
+        )
+
+
+def _is_local_request(request: web.Request) -> bool:
+    """Запрос пришёл напрямую с localhost (не через обратный прокси)."""
+    if 'X-Forwarded-For' in request.headers or 'X-Real-IP' in request.headers:
+        return False
+    try:
+        return ipaddress.ip_address(request.remote or '').is_loopback
+    except ValueError:
+        return False
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """
+    Метрики в текстовом формате Prometheus.
+
+    С METRICS_TOKEN — только по Bearer-токену, без него — только напрямую с localhost.
+    """
+    token = os.getenv('METRICS_TOKEN')
+    if token:
+        auth = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth, f'Bearer {token}'):
+            raise web.HTTPUnauthorized()
+    elif not _is_local_request(request):
+        raise web.HTTPForbidden()
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
 
 
 class WebAppServer:
@@ -19,18 +73,22 @@ class WebAppServer:
         self.runner: Optional[web.AppRunner] = None
         self.site: Optional[web.TCPSite] = None
     
-    async def start(self, bot_token: str, bot_instance=None):
+    async def start(self, bot_token: str, bot_instance=None, webhook=None):
         """
         Запускает HTTP сервер.
         
         Args:
             bot_token: Токен бота для валидации initData
             bot_instance: Экземпляр aiogram Bot
+            webhook: UpdateDispatcher для приёма обновлений Telegram (webhook-режим)
         """
-        self.app = web.Application()
+        self.app = web.Application(middlewares=[metrics_middleware])
         
         # Настраиваем маршруты Mini App
         setup_routes(self.app, bot_token, bot_instance)
+        self.app.router.add_get('/metrics', metrics_handler)
+        if webhook is not None:
+            self.app.router.add_post(webhook.path, webhook.handle)
         
         # Запускаем сервер
         self.runner = web.AppRunner(self.app)
@@ -52,7 +110,7 @@ class WebAppServer:
 _server: Optional[WebAppServer] = None
 
 
-async def start_webapp_server(bot_token: str, bot_instance=None, port: int = 8080) -> WebAppServer:
+async def start_webapp_server(bot_token: str, bot_instance=None, port: int = 8080, webhook=None) -> WebAppServer:
     """
     Запускает Mini App API сервер.
     
@@ -60,13 +118,14 @@ async def start_webapp_server(bot_token: str, bot_instance=None, port: int = 808
         bot_token: Токен бота
         bot_instance: Экземпляр aiogram Bot
         port: Порт сервера
+        webhook: UpdateDispatcher, если обновления приходят через webhook
     
     Returns:
         WebAppServer instance
     """
     global _server
     _server = WebAppServer(port=port)
-    await _server.start(bot_token, bot_instance)
+    await _server.start(bot_token, bot_instance, webhook)
     return _server
 
 
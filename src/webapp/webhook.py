@@ -0,0 +1,190 @@
+"""
+Приём обновлений Telegram через webhook на сервере Mini App.
+
+Обновления кладутся в ограниченную очередь и обрабатываются пулом воркеров;
+обновления одного чата обрабатываются строго по очереди.
+"""
+import asyncio
+import hmac
+import os
+import secrets
+import signal
+from collections import deque
+from typing import Hashable, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiohttp import web
+
+from src.utils.logger import logger
+from src.utils.metrics import Gauge, registry
+
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook/telegram')
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '16'))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000'))
+
+
+def _ordering_key(update: Update) -> Hashable:
+    """Чат (или пользователь), в рамках которого обновления должны идти по порядку."""
+    for event in (update.message, update.edited_message, update.callback_query,
+                  update.pre_checkout_query, update.my_chat_member):
+        if event is None:
+            continue
+        chat = getattr(event, 'chat', None) or getattr(getattr(event, 'message', None), 'chat', None)
+        if chat is not None:
+            return ('chat', chat.id)
+        if getattr(event, 'from_user', None) is not None:
+            return ('user', event.from_user.id)
+    return ('update', update.update_id)
+
+
+class UpdateDispatcher:
+    """
+    Пул воркеров для обновлений из webhook.
+
+    У каждого чата своя очередь; чат с необработанными обновлениями стоит в
+    общей очереди готовых ровно один раз, поэтому его обновления не
+    обрабатываются параллельно, а медленный чат не задерживает остальные.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        secret_token: Optional[str] = None,
+        path: str = WEBHOOK_PATH,
+    ) -> None:
+        if not secret_token:
+            # Путь /webhook/* открыт снаружи: без секрета любой мог бы прислать поддельное
+            # обновление (от имени администратора или с successful_payment)
+            secret_token = secrets.token_urlsafe(32)
+            logger.warning('WEBHOOK_SECRET is not set, using a random secret for this run')
+        self.dp = dp
+        self.bot = bot
+        self.workers = workers
+        self.queue_size = queue_size
+        self.secret_token = secret_token
+        self.path = path
+        self._chats: dict[Hashable, deque[Update]] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._queued = 0
+        self._tasks: list[asyncio.Task] = []
+        # Те же данные, что aiogram передаёт обработчикам при polling
+        self.context = {'dispatcher': dp, 'bots': [bot]}
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._work(), name=f'webhook-worker-{i}') for i in range(self.workers)
+        ]
+        registry.register(Gauge(
+            'webhook_update_queue_size', 'Webhook updates accepted but not processed yet.',
+            collect=lambda: {(): self._queued},
+        ))
+        logger.info('Webhook update workers started (workers: %d, queue: %d)', self.workers, self.queue_size)
+
+    def submit(self, update: Update) -> bool:
+        """Ставит обновление в очередь. False — очередь переполнена."""
+        if self._queued >= self.queue_size:
+            return False
+        key = _ordering_key(update)
+        pending = self._chats.get(key)
+        if pending is None:
+            self._chats[key] = deque([update])
+            self._ready.put_nowait(key)
+        else:
+            pending.append(update)
+        self._queued += 1
+        return True
+
+    async def _work(self) -> None:
+        while True:
+            key = await self._ready.get()
+            pending = self._chats[key]
+            while pending:
+                update = pending[0]
+                try:
+                    result = await self.dp.feed_update(self.bot, update, **self.context)
+                    if isinstance(result, TelegramMethod):
+                        await self.dp.silent_call_request(self.bot, result)
+                except Exception:
+                    logger.exception('Failed to process update %s', update.update_id)
+                finally:
+                    pending.popleft()
+                    self._queued -= 1
+            del self._chats[key]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """POST от Telegram с одним обновлением."""
+        received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(received, self.secret_token):
+            raise web.HTTPUnauthorized()
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception:
+            logger.warning('Invalid webhook payload', exc_info=True)
+            raise web.HTTPBadRequest()
+        if not self.submit(update):
+            # Telegram повторит доставку позже
+            logger.warning('Webhook update queue is full (%d), rejecting update %s', self._queued, update.update_id)
+            raise web.HTTPServiceUnavailable()
+        return web.Response()
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается обработки принятых обновлений и останавливает воркеров."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._queued and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def run_webhook(updates: UpdateDispatcher, url: str) -> None:
+    """
+    Регистрирует webhook и обрабатывает обновления до SIGINT/SIGTERM.
+
+    Сервер с маршрутом updates.path должен быть уже запущен. Webhook при
+    остановке не удаляется: Telegram накопит обновления до перезапуска.
+    """
+    dp, bot = updates.dp, updates.bot
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    signals = (signal.SIGINT, signal.SIGTERM)
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stopping.set)
+        except NotImplementedError:
+            # Windows: остаётся KeyboardInterrupt
+            pass
+
+    updates.start()
+    try:
+        await dp.emit_startup(bot=bot, **updates.context, **dp.workflow_data)
+        await bot.set_webhook(
+            url,
+            secret_token=updates.secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info('Receiving updates via webhook %s', url)
+        await stopping.wait()
+        logger.info('Stopping webhook update processing')
+    finally:
+        for sig in signals:
+            try:
+                loop.remove_signal_handler(sig)
+            except NotImplementedError:
+                pass
+        await updates.stop()
+        try:
+            await dp.emit_shutdown(bot=bot, **updates.context, **dp.workflow_data)
+        finally:
+            await bot.session.close()